@@ -250,6 +250,10 @@ def _check_cmc_keys_health():
             cmc_keys_status['status'] = 'no_keys'
             cmc_keys_status['message'] = '未配置任何CMC API Key'
             cmc_keys_status['warning'] = True
+
+        # credit 预算余量和当日消耗
+        from apps.cmc_proxy.utils import get_cmc_credit_metrics
+        cmc_keys_status['credit_budget'] = get_cmc_credit_metrics()
             
     except Exception as e:
         cmc_keys_status = {
@@ -6,17 +6,43 @@ COINMARKETCAP_API_KEY = getattr(settings, 'COINMARKETCAP_API_KEY', os.environ.ge
 CMC_N1 = 200  # 获取的"主要热门代币"数量
 CMC_TTL_HOT = 600  # 获取的"主要热门代币"在Redis中的缓存时间（秒）
 CMC_T1_MERGE_WINDOW_SECONDS = 1  # 合并用户请求的最大等待时间窗口（秒）
+CMC_BATCH_WAIT_TIMEOUT_SECONDS = 5  # 缓存未命中时等待批处理写入结果的最长时间（秒）
 CMC_N2_BATCH_TARGET_SIZE = 100  # 批量查询的目标代币数量
+CMC_BATCH_REQUEST_MAX_PENDING_SECONDS = 30  # 等待超过该时间的请求优先入批，不再按请求次数排队（秒）
 CMC_N3_SUPPLEMENT_POOL_RANGE = 200  # "次热门补充池"的代币数量
 CMC_TTL_WARM_COLD = 600  # 获取的代币在Redis中的缓存时间（秒）
 CMC_TTL_BASE = 3600  # 每日全量更新的代币在Redis中的基础缓存时间（秒）
 CMC_MARKET_DATA_TTL = 600  # 市场数据缓存时间（秒） - 10分钟
+CMC_MARKET_DATA_PAGE_TTL = 600  # 分页行情响应缓存时间（秒），正常情况下先被代数计数器失效
+CMC_MARKET_DATA_PAGE_REBUILD_LOCK_TTL = 30  # 分页响应重建锁的过期时间（秒）
+CMC_MARKET_DATA_PAGE_REBUILD_WAIT_SECONDS = 5  # 无旧数据可用时等待其他进程重建页面的最长时间（秒）
+CMC_SYNC_BATCH_SIZE = 1000  # Redis -> 数据库同步时每批 SCAN/MGET/bulk upsert 的键数量
+CMC_SYNC_PAYLOAD_HASH_TTL = 86400  # 已同步报价哈希的保留时间（秒），过期后全部重新写入一次
 CMC_PRICE_FALLBACK_WARNING_THRESHOLD = 900  # CMC价格回退警告阈值（秒） - 15分钟
 CCXT_PRICE_STALE_THRESHOLD = 300  # CCXT价格过期阈值（秒） - 5分钟
 CMC_DAILY_FULL_SYNC_SCHEDULE = "0 3 * * *"  # 每日全量更新任务的执行时间（Cron格式）
+CMC_QUOTE_CODEC = getattr(settings, 'CMC_QUOTE_CODEC', 'p1')  # cmc:quote_data 写入格式，见 quote_codec.CODECS
+
+# CMC credit 令牌桶配置，按 API Key 区分（外部Key未配置时与K线Key共用同一个桶）
+# 默认值约等于 Standard 套餐：每月 50 万 credit ≈ 0.19 credit/秒
+CMC_CREDIT_BUDGETS = getattr(settings, 'CMC_CREDIT_BUDGETS', {
+    'klines': {'capacity': 500, 'refill_per_second': 0.19},
+    'external': {'capacity': 500, 'refill_per_second': 0.19},
+})
+CMC_CREDIT_BACKGROUND_RESERVE_RATIO = 0.2  # 后台任务不能动用的桶容量比例，留给用户请求
+CMC_CREDIT_USER_ACQUIRE_TIMEOUT = 10  # 用户请求等待 credit 的最长时间（秒）
+CMC_CREDIT_BACKGROUND_ACQUIRE_TIMEOUT = 600  # 后台任务等待 credit 的最长时间（秒）
 
 # CoinMarketCap Redis 键名模式
 CMC_QUOTE_DATA_KEY = "cmc:quote_data:%(symbol_id)s"
 CMC_SUPPLEMENT_POOL_KEY = "cmc:supplement_pool_by_marketcap"
-CMC_BATCH_REQUESTS_PENDING_KEY = "cmc:batch_requests_pending"  # Key for Redis list storing pending requests
+CMC_BATCH_REQUESTS_PENDING_KEY = "cmc:batch_requests_pending:first_seen"  # Sorted set of pending cmc_ids scored by first request time
+CMC_BATCH_REQUESTS_DEMAND_KEY = "cmc:batch_requests_pending:demand"  # Sorted set of pending cmc_ids scored by request count
 CMC_BATCH_PROCESSING_LOCK_KEY = "cmc:lock:batch_processing"  # Lock for the batch processing task
+CMC_QUOTE_READY_CHANNEL = "cmc:quote_ready"  # Pub/sub channel announcing cmc_ids whose quote data has been written
+CMC_MARKET_DATA_GENERATION_KEY = "cmc:market_data_generation"  # Bumped whenever CmcMarketData, CmcKline or AssetPrice change
+CMC_MARKET_DATA_PAGE_KEY = "cmc:market_data_page:%(params)s"  # Pre-rendered /cmc/market-data page bodies
+CMC_MARKET_DATA_PAGE_LOCK_KEY = "cmc:lock:market_data_page:%(params)s"  # Rebuild lock per page
+CMC_SYNC_PAYLOAD_HASH_KEY = "cmc:sync_payload_hash"  # Hash of cmc_id -> digest of the quote payload last written to the database
+CMC_CREDIT_BUCKET_KEY = "cmc:credit_bucket:%(key_id)s"  # Token bucket state (tokens, ts) per API key
+CMC_CREDIT_SPEND_KEY = "cmc:credit_spend:%(key_id)s:%(date)s"  # Daily credits / calls / throttled counters per API key
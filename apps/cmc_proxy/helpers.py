@@ -2,6 +2,7 @@ from datetime import timedelta
 from typing import Dict, Any, List, Optional
 
 from django.apps import apps
+from django.db.models import Q
 from django.utils import timezone
 from common.helpers import getLogger
 from apps.cmc_proxy.consts import CMC_PRICE_FALLBACK_WARNING_THRESHOLD, CCXT_PRICE_STALE_THRESHOLD
@@ -40,7 +41,11 @@ class MarketDataFormatter:
         """格式化单个市场数据项，使用CCXT价格替换CMC价格"""
         # 尝试获取CCXT价格
         ccxt_data = await MarketDataFormatter.get_ccxt_price_for_cmc_asset(item.asset)
-        
+        return MarketDataFormatter.build_market_data_item(item, ccxt_data)
+
+    @staticmethod
+    def build_market_data_item(item, ccxt_data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """用已获取的CCXT价格格式化单个市场数据项（批量场景下避免逐条查询价格）"""
         # 使用CCXT价格（如果可用），否则回退到CMC价格
         if ccxt_data:
             price_usd = ccxt_data['price_usd']
@@ -93,25 +98,68 @@ class MarketDataFormatter:
                 price_obj = await AssetPrice.objects.filter(base_asset=base_asset).order_by('-updated_at').afirst()
             
             if price_obj:
-                # 检查价格数据的新鲜度
-                age_minutes = (timezone.now() - price_obj.updated_at).total_seconds() / 60
-                age_seconds = (timezone.now() - price_obj.updated_at).total_seconds()
-                if age_seconds > CCXT_PRICE_STALE_THRESHOLD:
-                    logger.info(f"CCXT price for {cmc_asset.symbol} is {age_minutes:.1f} minutes old, may be stale")
-                
-                return {
-                    'price_usd': float(price_obj.price),
-                    'price_change_24h': float(price_obj.price_change_24h) if price_obj.price_change_24h else None,
-                    'volume_24h': float(price_obj.volume_24h) if price_obj.volume_24h else None,
-                    'price_timestamp': price_obj.price_timestamp,
-                    'exchange': price_obj.exchange,
-                    'data_age_minutes': age_minutes
-                }
+                return MarketDataFormatter._format_ccxt_price(cmc_asset, price_obj)
         except Exception as e:
             # 如果CCXT价格获取失败，记录错误但不影响主流程
             logger.warning(f"Failed to get CCXT price for CMC asset {cmc_asset.symbol} (cmc_id: {cmc_asset.cmc_id}): {e}")
         return None
 
+    @staticmethod
+    async def get_ccxt_prices_for_cmc_assets(cmc_assets) -> Dict[int, Optional[Dict[str, Any]]]:
+        """
+        批量获取多个CMC资产的CCXT价格，一次 AssetPrice 查询覆盖整页资产。
+        匹配规则与 get_ccxt_price_for_cmc_asset 相同：优先 cmc_asset 关联，其次 base_asset。
+
+        Returns:
+            {cmc_asset.id: ccxt价格数据或None}
+        """
+        cmc_assets = [asset for asset in cmc_assets if asset]
+        if not cmc_assets:
+            return {}
+
+        results: Dict[int, Optional[Dict[str, Any]]] = {asset.id: None for asset in cmc_assets}
+        try:
+            AssetPrice = apps.get_model('price_oracle', 'AssetPrice')
+
+            asset_ids = set(results.keys())
+            base_assets = {asset.symbol.lower() for asset in cmc_assets}
+            qs = AssetPrice.objects.filter(
+                Q(cmc_asset_id__in=asset_ids) | Q(base_asset__in=base_assets)
+            ).order_by('-updated_at')
+
+            # 按 updated_at 降序扫描，每个键只保留第一条（即最新的）价格
+            by_cmc_asset = {}
+            by_base_asset = {}
+            async for price_obj in qs:
+                if price_obj.cmc_asset_id in asset_ids:
+                    by_cmc_asset.setdefault(price_obj.cmc_asset_id, price_obj)
+                by_base_asset.setdefault(price_obj.base_asset, price_obj)
+
+            for asset in cmc_assets:
+                price_obj = by_cmc_asset.get(asset.id) or by_base_asset.get(asset.symbol.lower())
+                if price_obj:
+                    results[asset.id] = MarketDataFormatter._format_ccxt_price(asset, price_obj)
+        except Exception as e:
+            logger.warning(f"Failed to get CCXT prices for {len(cmc_assets)} CMC assets: {e}")
+        return results
+
+    @staticmethod
+    def _format_ccxt_price(cmc_asset, price_obj) -> Dict[str, Any]:
+        # 检查价格数据的新鲜度
+        age_minutes = (timezone.now() - price_obj.updated_at).total_seconds() / 60
+        age_seconds = (timezone.now() - price_obj.updated_at).total_seconds()
+        if age_seconds > CCXT_PRICE_STALE_THRESHOLD:
+            logger.info(f"CCXT price for {cmc_asset.symbol} is {age_minutes:.1f} minutes old, may be stale")
+
+        return {
+            'price_usd': float(price_obj.price),
+            'price_change_24h': float(price_obj.price_change_24h) if price_obj.price_change_24h else None,
+            'volume_24h': float(price_obj.volume_24h) if price_obj.volume_24h else None,
+            'price_timestamp': price_obj.price_timestamp,
+            'exchange': price_obj.exchange,
+            'data_age_minutes': age_minutes
+        }
+
     @staticmethod
     async def format_market_data_from_db(market_data) -> Dict[str, Any]:
         """
@@ -194,21 +242,31 @@ class MarketDataFormatter:
 class KlineDataProcessor:
     """K线数据处理工具"""
 
+    @staticmethod
+    def serialize_kline(k) -> Dict[str, Any]:
+        """序列化单条K线"""
+        return {
+            'timestamp': k.timestamp.isoformat(),
+            'open': float(k.open),
+            'high': float(k.high),
+            'low': float(k.low),
+            'close': float(k.close),
+            'volume': float(k.volume),
+            'volume_token_count': float(k.volume_token_count) if k.volume_token_count else None,
+        }
+
     @staticmethod
     async def serialize_klines_data(klines_qs):
         """序列化K线数据"""
-        return [
-            {
-                'timestamp': k.timestamp.isoformat(),
-                'open': float(k.open),
-                'high': float(k.high),
-                'low': float(k.low),
-                'close': float(k.close),
-                'volume': float(k.volume),
-                'volume_token_count': float(k.volume_token_count) if k.volume_token_count else None,
-            }
-            async for k in klines_qs
-        ]
+        return [KlineDataProcessor.serialize_kline(k) async for k in klines_qs]
+
+    @staticmethod
+    async def serialize_klines_by_asset(klines_qs) -> Dict[int, List[Dict[str, Any]]]:
+        """按 asset_id 分组序列化K线数据，klines_qs 需按 (asset, timestamp) 排序"""
+        grouped: Dict[int, List[Dict[str, Any]]] = {}
+        async for k in klines_qs:
+            grouped.setdefault(k.asset_id, []).append(KlineDataProcessor.serialize_kline(k))
+        return grouped
 
     @staticmethod
     def calculate_high_low_24h(klines: List[Dict[str, Any]], start_time_24h) -> tuple:
@@ -0,0 +1,323 @@
+import asyncio
+import json
+import random
+import statistics
+import time
+from unittest import mock
+
+from aiohttp import web
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.cmc_proxy import consts
+from apps.cmc_proxy.models import CmcAsset, CmcMarketData
+from apps.cmc_proxy.quote_codec import decode_quote, encode_quote
+from apps.cmc_proxy.services import CoinMarketCapClient, CoinMarketCapService
+from apps.cmc_proxy.tasks import _process_pending_cmc_batch_requests_with_lock, _sync_data_from_redis_implementation
+from apps.cmc_proxy.utils import CMCRedisClient
+from common.helpers import getLogger
+
+logger = getLogger(__name__)
+
+# 基准测试使用的 cmc_id 起始值，远离真实 CMC ID，避免污染正常缓存
+BENCH_ID_BASE = 9_000_000
+BENCH_TASK_LOCK_KEY = "cmc:lock:benchmark_batch_task"
+BENCH_LEGACY_PENDING_KEY = "cmc:benchmark:legacy_pending"
+BENCH_PENDING_KEY = "cmc:benchmark:pending:first_seen"
+BENCH_DEMAND_KEY = "cmc:benchmark:pending:demand"
+
+
+def _fake_token(cmc_id: int) -> dict:
+    """构造与 CMC quotes/latest 结构一致的假数据"""
+    price = random.uniform(0.01, 1000)
+    return {
+        'id': cmc_id,
+        'name': f'Bench Token {cmc_id}',
+        'symbol': f'B{cmc_id % 100000}',
+        'slug': f'bench-token-{cmc_id}',
+        'cmc_rank': cmc_id - BENCH_ID_BASE + 1,
+        'circulating_supply': 1_000_000,
+        'total_supply': 2_000_000,
+        'last_updated': '2025-01-01T00:00:00.000Z',
+        'quote': {'USD': {
+            'price': price,
+            'volume_24h': price * 10_000,
+            'market_cap': price * 1_000_000,
+            'percent_change_24h': random.uniform(-10, 10),
+        }},
+    }
+
+
+def _fake_listing_item(cmc_id: int) -> dict:
+    """构造与 listings/latest 单个条目结构和字段数量相近的假数据"""
+    item = _fake_token(cmc_id)
+    item.update({
+        'num_market_pairs': random.randint(1, 1000),
+        'date_added': '2021-05-01T00:00:00.000Z',
+        'tags': ['defi', 'ethereum-ecosystem', 'binance-smart-chain', 'layer-1', 'yield-farming', 'dao'],
+        'max_supply': None,
+        'infinite_supply': False,
+        'platform': {'id': 1027, 'name': 'Ethereum', 'symbol': 'ETH', 'slug': 'ethereum',
+                     'token_address': f"0x{cmc_id:040x}"},
+        'self_reported_circulating_supply': None,
+        'self_reported_market_cap': None,
+        'tvl_ratio': None,
+    })
+    usd = item['quote']['USD']
+    usd.update({
+        'volume_change_24h': random.uniform(-50, 50),
+        'percent_change_1h': random.uniform(-2, 2),
+        'percent_change_7d': random.uniform(-20, 20),
+        'percent_change_30d': random.uniform(-40, 40),
+        'percent_change_60d': random.uniform(-60, 60),
+        'percent_change_90d': random.uniform(-80, 80),
+        'market_cap_dominance': random.uniform(0, 1),
+        'fully_diluted_market_cap': usd['market_cap'] * 2,
+        'tvl': None,
+        'last_updated': '2025-01-01T00:00:00.000Z',
+    })
+    return item
+
+
+async def _start_fake_cmc_server(api_latency: float):
+    """启动本地假 CMC 服务，返回 (runner, base_url)"""
+
+    async def quotes_latest(request):
+        await asyncio.sleep(api_latency)
+        ids = [int(i) for i in request.query.get('id', '').split(',') if i]
+        return web.json_response({'data': {str(i): _fake_token(i) for i in ids}})
+
+    app = web.Application()
+    app.router.add_get('/v2/cryptocurrency/quotes/latest', quotes_latest)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def _legacy_initiate_batch_request_processing(self, symbol_id):
+    """旧实现：入队后固定睡眠合并窗口再读缓存，用作对照组"""
+    symbol_id = str(symbol_id)
+    await self.cmc_redis.enqueue_batch_request(symbol_id)
+    await asyncio.sleep(consts.CMC_T1_MERGE_WINDOW_SECONDS)
+    return await self.cmc_redis.get_token_quote_data(symbol_id)
+
+
+async def _legacy_enqueue(redis, symbol_id):
+    """旧实现：列表 + LPOS 去重，入队成本随队列长度线性增长"""
+    if await redis.lpos(BENCH_LEGACY_PENDING_KEY, symbol_id) is None:
+        await redis.rpush(BENCH_LEGACY_PENDING_KEY, symbol_id)
+
+
+async def _legacy_sync_data_from_redis(cmc_redis, keys):
+    """旧实现：逐个 GET，每个代币两次 update_or_create"""
+    for key in keys:
+        api_data = json.loads(await cmc_redis.get(key))
+        asset, _ = await CmcAsset.objects.update_or_create_from_api_data(api_data)
+        await CmcMarketData.objects.update_or_create_from_api_data(asset, api_data)
+
+
+def _percentile(values, pct):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks CMC proxy hot paths against the configured Redis and a local fake CoinMarketCap server.'
+
+    SCENARIOS = ('singleflight', 'sync', 'enqueue', 'codec')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=self.SCENARIOS, help='Benchmark scenario to run.')
+        parser.add_argument('--requests', type=int, default=1000, help='Number of concurrent requests.')
+        parser.add_argument('--distinct-ids', type=int, default=100,
+                            help='Number of distinct cmc_ids the requests are spread over.')
+        parser.add_argument('--batch-interval', type=float, default=2.0,
+                            help='Seconds between simulated process_pending_cmc_batch_requests runs.')
+        parser.add_argument('--api-latency', type=float, default=0.2,
+                            help='Artificial latency of the fake CMC server in seconds.')
+        parser.add_argument('--tokens', type=int, default=10000,
+                            help='Number of quote payloads seeded into Redis for the sync scenario.')
+        parser.add_argument('--pending', type=int, default=50000,
+                            help='Largest pending queue size for the enqueue scenario.')
+        parser.add_argument('--mode', choices=('legacy', 'current', 'both'), default='both',
+                            help='Run the legacy implementation, the current one, or both.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.WARNING(
+            "Benchmarks write to the configured Redis; run them against a development instance."))
+        asyncio.run(getattr(self, f"_bench_{options['scenario']}")(options))
+
+    def _report(self, label, latencies, extra=''):
+        self.stdout.write(
+            f"{label:>12}: n={len(latencies)} "
+            f"p50={_percentile(latencies, 50) * 1000:.1f}ms "
+            f"p99={_percentile(latencies, 99) * 1000:.1f}ms "
+            f"max={max(latencies) * 1000:.1f}ms {extra}"
+        )
+
+    async def _bench_singleflight(self, options):
+        """1,000 个并发缓存未命中：旧的固定睡眠窗口 vs single-flight 通知唤醒"""
+        modes = ['legacy', 'current'] if options['mode'] == 'both' else [options['mode']]
+        runner, base_url = await _start_fake_cmc_server(options['api_latency'])
+        try:
+            with mock.patch.object(CoinMarketCapClient, 'BASE_URL', base_url), \
+                    mock.patch('apps.cmc_proxy.tasks._get_top_market_cap_ids_from_db',
+                               mock.AsyncMock(return_value=[])):
+                for mode in modes:
+                    if mode == 'legacy':
+                        with mock.patch.object(CoinMarketCapService, 'initiate_batch_request_processing',
+                                               _legacy_initiate_batch_request_processing):
+                            await self._run_singleflight_round(mode, options)
+                    else:
+                        await self._run_singleflight_round(mode, options)
+        finally:
+            await runner.cleanup()
+
+    async def _run_singleflight_round(self, label, options):
+        ids = [BENCH_ID_BASE + i for i in range(options['distinct_ids'])]
+        service = CoinMarketCapService(client_type="external")
+        await service.async_init()
+        redis = service.cmc_redis
+
+        # 清理上一轮留下的缓存和待处理请求
+        await redis.delete(*[consts.CMC_QUOTE_DATA_KEY % {"symbol_id": str(i)} for i in ids])
+        await redis.zrem(consts.CMC_BATCH_REQUESTS_PENDING_KEY, *[str(i) for i in ids])
+        await redis.zrem(consts.CMC_BATCH_REQUESTS_DEMAND_KEY, *[str(i) for i in ids])
+
+        stop = asyncio.Event()
+
+        async def batch_beat():
+            while not stop.is_set():
+                await _process_pending_cmc_batch_requests_with_lock(BENCH_TASK_LOCK_KEY)
+                try:
+                    await asyncio.wait_for(stop.wait(), options['batch_interval'])
+                except asyncio.TimeoutError:
+                    pass
+
+        async def timed_request(cmc_id):
+            start = time.perf_counter()
+            data = await service.get_token_market_data(cmc_id)
+            return time.perf_counter() - start, data is not None
+
+        beat_task = asyncio.create_task(batch_beat())
+        try:
+            results = await asyncio.gather(
+                *[timed_request(random.choice(ids)) for _ in range(options['requests'])])
+        finally:
+            stop.set()
+            await beat_task
+            await service.close()
+
+        latencies = [latency for latency, _ in results]
+        empty = sum(1 for _, found in results if not found)
+        self._report(label, latencies, f"empty={empty}")
+
+    async def _bench_sync(self, options):
+        """Redis -> 数据库同步吞吐：逐行 update_or_create vs 批量 upsert（首次写入与无变化两轮）"""
+        modes = ['legacy', 'current'] if options['mode'] == 'both' else [options['mode']]
+        ids = [BENCH_ID_BASE + i for i in range(options['tokens'])]
+        keys = [consts.CMC_QUOTE_DATA_KEY % {"symbol_id": i} for i in ids]
+        redis = await CMCRedisClient.create(settings.REDIS_CMC_URL)
+        try:
+            for offset in range(0, len(ids), 1000):
+                await redis.mset({key: json.dumps(_fake_token(i))
+                                  for key, i in zip(keys[offset:offset + 1000], ids[offset:offset + 1000])})
+
+            for mode in modes:
+                await CmcAsset.objects.filter(cmc_id__gte=BENCH_ID_BASE).adelete()
+                await redis.hdel(consts.CMC_SYNC_PAYLOAD_HASH_KEY, *[str(i) for i in ids])
+                rounds = ('cold', 'unchanged') if mode == 'current' else ('cold',)
+                for round_name in rounds:
+                    start = time.perf_counter()
+                    if mode == 'legacy':
+                        await _legacy_sync_data_from_redis(redis, keys)
+                    else:
+                        await _sync_data_from_redis_implementation(redis)
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(f"{mode:>8} {round_name:>9}: {len(ids)} tokens in {elapsed:.2f}s "
+                                      f"({len(ids) / elapsed:,.0f} rows/s)")
+        finally:
+            await CmcAsset.objects.filter(cmc_id__gte=BENCH_ID_BASE).adelete()
+            await redis.hdel(consts.CMC_SYNC_PAYLOAD_HASH_KEY, *[str(i) for i in ids])
+            for offset in range(0, len(keys), 1000):
+                await redis.delete(*keys[offset:offset + 1000])
+            await redis.aclose()
+
+    async def _bench_enqueue(self, options):
+        """入队成本随待处理队列长度的变化：列表 + LPOS vs 有序集合"""
+        modes = ['legacy', 'current'] if options['mode'] == 'both' else [options['mode']]
+        checkpoints = sorted({1000, 10000, options['pending']})
+        redis = await CMCRedisClient.create(settings.REDIS_CMC_URL)
+        try:
+            with mock.patch('apps.cmc_proxy.utils.CMC_BATCH_REQUESTS_PENDING_KEY', BENCH_PENDING_KEY), \
+                    mock.patch('apps.cmc_proxy.utils.CMC_BATCH_REQUESTS_DEMAND_KEY', BENCH_DEMAND_KEY):
+                for mode in modes:
+                    await redis.delete(BENCH_LEGACY_PENDING_KEY, BENCH_PENDING_KEY, BENCH_DEMAND_KEY)
+                    enqueue = (lambda i: _legacy_enqueue(redis, i)) if mode == 'legacy' else redis.enqueue_batch_request
+                    size = 0
+                    for checkpoint in checkpoints:
+                        # 先把队列填充到目标长度（不计时）
+                        for offset in range(size, checkpoint, 1000):
+                            members = [str(BENCH_ID_BASE + i) for i in range(offset, min(offset + 1000, checkpoint))]
+                            if mode == 'legacy':
+                                await redis.rpush(BENCH_LEGACY_PENDING_KEY, *members)
+                            else:
+                                now = time.time()
+                                await redis.zadd(BENCH_PENDING_KEY, {m: now for m in members})
+                                await redis.zadd(BENCH_DEMAND_KEY, {m: 1 for m in members})
+                        size = checkpoint
+
+                        # 新ID入队，最坏情况：需要扫描整个列表
+                        latencies = []
+                        for n in range(200):
+                            symbol_id = str(BENCH_ID_BASE + 10_000_000 + checkpoint + n)
+                            start = time.perf_counter()
+                            await enqueue(symbol_id)
+                            latencies.append(time.perf_counter() - start)
+                        self._report(mode, latencies, f"pending={checkpoint}")
+        finally:
+            await redis.delete(BENCH_LEGACY_PENDING_KEY, BENCH_PENDING_KEY, BENCH_DEMAND_KEY)
+            await redis.aclose()
+
+    async def _bench_codec(self, options):
+        """cmc:quote_data 编码格式：旧 json.dumps vs orjson 全量 (j1) vs 字段投影 (p1)"""
+        items = [_fake_listing_item(BENCH_ID_BASE + i) for i in range(options['tokens'])]
+        keys = [consts.CMC_QUOTE_DATA_KEY % {"symbol_id": item['id']} for item in items]
+        formats = {
+            'json': (lambda item: json.dumps(item), json.loads),
+            'j1': (lambda item: encode_quote(item, codec='j1'), decode_quote),
+            'p1': (lambda item: encode_quote(item, codec='p1'), decode_quote),
+        }
+        redis = await CMCRedisClient.create(settings.REDIS_CMC_URL)
+        try:
+            for name, (encode, decode) in formats.items():
+                start = time.perf_counter()
+                encoded = [encode(item) for item in items]
+                encode_time = time.perf_counter() - start
+
+                for offset in range(0, len(keys), 1000):
+                    await redis.mset(dict(zip(keys[offset:offset + 1000], encoded[offset:offset + 1000])))
+                async with redis.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.memory_usage(key)
+                    memory = sum(await pipe.execute())
+                raw_values = []
+                for offset in range(0, len(keys), 1000):
+                    raw_values.extend(await redis.mget(keys[offset:offset + 1000]))
+
+                start = time.perf_counter()
+                for raw in raw_values:
+                    decode(raw)
+                decode_time = time.perf_counter() - start
+
+                self.stdout.write(
+                    f"{name:>5}: encode={encode_time * 1000:.1f}ms decode={decode_time * 1000:.1f}ms "
+                    f"redis={memory / 1024 / 1024:.2f}MiB ({memory / len(keys):.0f} B/token)")
+        finally:
+            for offset in range(0, len(keys), 1000):
+                await redis.delete(*keys[offset:offset + 1000])
+            await redis.aclose()
@@ -1,12 +1,10 @@
 import asyncio
-import json
 import time
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
 
-from apps.cmc_proxy.consts import CMC_QUOTE_DATA_KEY
-from apps.cmc_proxy.models import CmcAsset, CmcMarketData
+from apps.cmc_proxy.tasks import _sync_data_from_redis_implementation
 from apps.cmc_proxy.utils import CMCRedisClient
 from common.helpers import getLogger
 
@@ -72,63 +70,16 @@ class Command(BaseCommand):
                 logger.info("Redis connection closed.")
 
     async def sync_data_from_redis(self, cmc_redis: CMCRedisClient):
-        # 使用 scan_iter 高效地遍历所有代币数据的键
-        pattern = CMC_QUOTE_DATA_KEY.replace("%(symbol_id)s", "*")
-        keys = [key async for key in cmc_redis.scan_iter(match=pattern)]
-
-        if not keys:
-            logger.warning("No CMC data keys found in Redis to sync.")
+        stats = await _sync_data_from_redis_implementation(cmc_redis)
+        if not stats['total']:
             return
 
-        logger.info(f"Found {len(keys)} CMC data keys in Redis.")
-
-        assets_created_count = 0
-        assets_updated_count = 0
-        market_data_updated_count = 0
-        failed_count = 0
-        total_count = len(keys)
-
-        for key in keys:
-            try:
-                raw_data = await cmc_redis.get(key)
-                if not raw_data:
-                    failed_count += 1
-                    continue
-
-                api_data = json.loads(raw_data)
-                cmc_id = api_data.get('id')
-                if not cmc_id:
-                    logger.warning(f"Skipping key {key} due to missing 'id' field.")
-                    failed_count += 1
-                    continue
-
-                # 1. 同步 CmcAsset (资产元数据)
-                asset, created = await CmcAsset.objects.update_or_create_from_api_data(api_data)
-                if not asset:
-                    failed_count += 1
-                    continue
-
-                if created:
-                    assets_created_count += 1
-                else:
-                    assets_updated_count += 1
-
-                # 2. 同步 CmcMarketData (最新行情)
-                await CmcMarketData.objects.update_or_create_from_api_data(asset, api_data)
-                market_data_updated_count += 1
-
-            except json.JSONDecodeError:
-                logger.error(f"Failed to decode JSON from key {key}.")
-                failed_count += 1
-            except Exception as e:
-                logger.error(f"Error processing data for key {key}: {e}", exc_info=True)
-                failed_count += 1
-
         self.stdout.write(self.style.SUCCESS(
             f'Successfully synchronized CMC data. '
-            f'Total Processed: {total_count}, '
-            f'Assets Created: {assets_created_count}, '
-            f'Assets Updated: {assets_updated_count}, '
-            f'Market Data Touched: {market_data_updated_count}, '
-            f'Failed: {failed_count}'
+            f'Total Processed: {stats["total"]}, '
+            f'Unchanged: {stats["unchanged"]}, '
+            f'Assets Created: {stats["assets_created"]}, '
+            f'Assets Updated: {stats["assets_updated"]}, '
+            f'Market Data Touched: {stats["market_data_touched"]}, '
+            f'Failed: {stats["failed"]}'
         ))
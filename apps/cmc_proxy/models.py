@@ -1,3 +1,8 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from django.contrib.postgres.aggregates import ArrayAgg
 from django.db import models
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
@@ -7,12 +12,17 @@ from common.model_fields import DecField
 from common.models import BaseModel
 
 
-class CmcAssetManager(models.Manager):
-    async def update_or_create_from_api_data(self, api_data: dict):
-        cmc_id = api_data.get('id')
-        if not cmc_id:
-            return None, False
+def _group_by_fields(rows):
+    """按字段集合分组，保证同一条 INSERT ... ON CONFLICT 语句的更新字段一致"""
+    groups = defaultdict(list)
+    for key, defaults in rows:
+        groups[frozenset(defaults)].append((key, defaults))
+    return groups.items()
 
+
+class CmcAssetManager(models.Manager):
+    @staticmethod
+    def defaults_from_api_data(api_data: dict) -> dict:
         defaults = {
             'name': api_data.get('name'),
             'symbol': api_data.get('symbol'),
@@ -28,13 +38,45 @@ class CmcAssetManager(models.Manager):
             'tvl_ratio': api_data.get('tvl_ratio'),
         }
         # 过滤掉None值，避免用None覆盖已有数据
-        defaults = {k: v for k, v in defaults.items() if v is not None}
+        return {k: v for k, v in defaults.items() if v is not None}
 
+    async def update_or_create_from_api_data(self, api_data: dict):
+        cmc_id = api_data.get('id')
+        if not cmc_id:
+            return None, False
+
+        defaults = self.defaults_from_api_data(api_data)
         return await self.aupdate_or_create(cmc_id=cmc_id, defaults=defaults)
 
+    async def abulk_upsert_from_api_data(self, api_data_list: List[dict]) -> Tuple[Dict[int, 'CmcAsset'], int]:
+        """
+        批量写入资产元数据，返回 ({cmc_id: asset}, 新建数量)。
+        每组字段相同的数据只执行一条 INSERT ... ON CONFLICT (cmc_id) DO UPDATE。
+        """
+        # 同一条语句不能两次更新同一行，重复的 cmc_id 以最后一条为准
+        rows = {api_data['id']: self.defaults_from_api_data(api_data) for api_data in api_data_list}
+        if not rows:
+            return {}, 0
+
+        existing = {cmc_id async for cmc_id in self.filter(cmc_id__in=list(rows)).values_list('cmc_id', flat=True)}
+        assets = {}
+        for fields, group in _group_by_fields(rows.items()):
+            objs = [self.model(cmc_id=cmc_id, **defaults) for cmc_id, defaults in group]
+            await self.abulk_create(
+                objs, update_conflicts=True, unique_fields=['cmc_id'],
+                update_fields=[*fields, 'updated_at'],
+            )
+            assets.update((obj.cmc_id, obj) for obj in objs)
+        return assets, len(assets.keys() - existing)
+
 
 class CmcMarketDataManager(models.Manager):
-    async def update_or_create_from_api_data(self, asset, api_data: dict):
+    DECIMAL_FIELDS = ('price_usd', 'market_cap', 'fully_diluted_market_cap', 'volume_24h',
+                      'tvl', 'volume_24h_token_count', 'circulating_supply', 'total_supply')
+
+    @classmethod
+    def defaults_from_api_data(cls, api_data: dict, symbol=None) -> Optional[dict]:
+        """解析并校验行情数据；除时间戳外没有任何有效数据时返回 None"""
         timestamp_str = api_data.get('last_updated')
         timestamp = timezone.now()
         if timestamp_str:
@@ -81,18 +123,21 @@ class CmcMarketDataManager(models.Manager):
         for k, v in defaults.items():
             if v is not None:
                 # 对Decimal字段进行验证
-                if k in ['price_usd', 'market_cap', 'fully_diluted_market_cap', 'volume_24h', 
-                        'tvl', 'volume_24h_token_count', 'circulating_supply', 'total_supply']:
-                    validated_value = CmcKlineManager._validate_decimal_value(k, v, asset.symbol)
+                if k in cls.DECIMAL_FIELDS:
+                    validated_value = CmcKlineManager._validate_decimal_value(k, v, symbol)
                     if validated_value is not None:
                         validated_defaults[k] = validated_value
                 else:
                     validated_defaults[k] = v
-        
-        defaults = validated_defaults
 
         # 如果除了时间戳之外没有任何有效数据，可能就不需要更新
-        if len(defaults) <= 1:
+        if len(validated_defaults) <= 1:
+            return None
+        return validated_defaults
+
+    async def update_or_create_from_api_data(self, asset, api_data: dict):
+        defaults = self.defaults_from_api_data(api_data, asset.symbol)
+        if defaults is None:
             return None, False
 
         return await self.aupdate_or_create(
@@ -100,6 +145,23 @@ class CmcMarketDataManager(models.Manager):
             defaults=defaults,
         )
 
+    async def abulk_upsert_from_api_data(self, items: List[Tuple['CmcAsset', dict]]) -> int:
+        """批量写入最新行情（以 asset 为冲突键），返回写入行数"""
+        rows = {}
+        for asset, api_data in items:
+            defaults = self.defaults_from_api_data(api_data, asset.symbol)
+            if defaults is not None:
+                # 同一条语句不能两次更新同一行，重复的 asset 以最后一条为准
+                rows[asset] = defaults
+
+        for fields, group in _group_by_fields(rows.items()):
+            await self.abulk_create(
+                [self.model(asset=asset, **defaults) for asset, defaults in group],
+                update_conflicts=True, unique_fields=['asset'],
+                update_fields=[*fields, 'updated_at'],
+            )
+        return len(rows)
+
 
 class CmcKlineManager(models.Manager):
     
@@ -167,28 +229,30 @@ class CmcKlineManager(models.Manager):
         except (InvalidOperation, ValueError, OverflowError) as e:
             logger.error(f"Error validating decimal value {value} for {field_name} on {symbol}: {e}")
             return None
-    async def update_or_create_from_api_data(self, asset, quote_data: dict, timeframe='1h'):
+    @classmethod
+    def defaults_from_api_data(cls, quote_data: dict, symbol=None) -> Optional[Tuple[datetime, dict]]:
+        """解析并校验单根K线，返回 (开盘时间, defaults)；数据无效时返回 None"""
         time_open_str = quote_data.get('time_open')
         if not time_open_str:
-            return None, False
-            
+            return None
+
         # 解析开盘时间
         dt = parse_datetime(time_open_str)
         if dt is None:
-            return None, False
+            return None
         timestamp = timezone.make_aware(dt) if timezone.is_naive(dt) else dt
-            
+
         usd_quote = quote_data.get('quote', {}).get('USD', {})
         if not usd_quote:
-            return None, False
-            
+            return None
+
         # 计算token数量交易量
         price = usd_quote.get('close') or usd_quote.get('open')
         volume_usd = usd_quote.get('volume')
         volume_token_count = None
         if price and volume_usd and price > 0:
             volume_token_count = volume_usd / price
-            
+
         defaults = {
             'open': usd_quote.get('open'),
             'high': usd_quote.get('high'),
@@ -197,21 +261,26 @@ class CmcKlineManager(models.Manager):
             'volume': volume_usd,
             'volume_token_count': volume_token_count,
         }
-        
+
         # 过滤掉None值并验证数据精度
         validated_defaults = {}
         for k, v in defaults.items():
             if v is not None:
                 # 验证和调整数据精度
-                validated_value = CmcKlineManager._validate_decimal_value(k, v, asset.symbol)
+                validated_value = cls._validate_decimal_value(k, v, symbol)
                 if validated_value is not None:
                     validated_defaults[k] = validated_value
-        
-        defaults = validated_defaults
-        
-        if not defaults:
+
+        if not validated_defaults:
+            return None
+        return timestamp, validated_defaults
+
+    async def update_or_create_from_api_data(self, asset, quote_data: dict, timeframe='1h'):
+        parsed = self.defaults_from_api_data(quote_data, asset.symbol)
+        if parsed is None:
             return None, False
-            
+        timestamp, defaults = parsed
+
         return await self.aupdate_or_create(
             asset=asset,
             timeframe=timeframe,
@@ -219,6 +288,60 @@ class CmcKlineManager(models.Manager):
             defaults=defaults,
         )
 
+    async def amissing_depths(self, asset_ids: List[int], count: int, timeframe='1h',
+                              end_time: Optional[datetime] = None) -> Dict[int, int]:
+        """
+        一次查询计算每个资产最近 count 根小时K线的缺口，返回 {asset_id: 回补深度}。
+
+        回补深度是最早缺失的那根K线距 end_time 的小时数，即补齐缺口所需的 count；
+        没有任何K线的资产深度为 count，没有缺口的资产不出现在结果中。
+        """
+        end_time = end_time or timezone.now().replace(minute=0, second=0, microsecond=0)
+        slots = [end_time - timedelta(hours=hours) for hours in range(1, count + 1)]
+
+        present = {
+            row['asset_id']: set(row['timestamps'])
+            async for row in self.filter(
+                asset_id__in=asset_ids, timeframe=timeframe, timestamp__gte=slots[-1], timestamp__lt=end_time,
+            ).values('asset_id').annotate(timestamps=ArrayAgg('timestamp')).order_by()
+        }
+
+        depths = {}
+        for asset_id in asset_ids:
+            timestamps = present.get(asset_id, ())
+            for depth in range(count, 0, -1):
+                if slots[depth - 1] not in timestamps:
+                    depths[asset_id] = depth
+                    break
+        return depths
+
+    async def abulk_upsert_from_api_data(self, items: List[Tuple['CmcAsset', dict]], timeframe='1h') -> Dict[int, int]:
+        """
+        批量写入K线，返回 {asset_id: 写入根数}。
+        整个批次按 (asset, timeframe, timestamp) 冲突键执行 INSERT ... ON CONFLICT DO UPDATE。
+        """
+        rows = {}
+        for asset, quote_data in items:
+            parsed = self.defaults_from_api_data(quote_data, asset.symbol)
+            if parsed is None:
+                continue
+            timestamp, defaults = parsed
+            # 同一条语句不能两次更新同一行，重复的开盘时间以最后一根为准
+            rows[(asset, timestamp)] = defaults
+
+        for fields, group in _group_by_fields(rows.items()):
+            await self.abulk_create(
+                [self.model(asset=asset, timeframe=timeframe, timestamp=timestamp, **defaults)
+                 for (asset, timestamp), defaults in group],
+                update_conflicts=True, unique_fields=['asset', 'timeframe', 'timestamp'],
+                update_fields=[*fields, 'updated_at'],
+            )
+
+        counts = defaultdict(int)
+        for asset, _ in rows:
+            counts[asset.id] += 1
+        return counts
+
 
 class CmcAsset(BaseModel):
     cmc_id = models.BigIntegerField(unique=True, db_index=True)
@@ -0,0 +1,134 @@
+"""
+cmc:quote_data 缓存条目的编解码。
+
+条目格式：
+- 旧格式：完整 JSON 对象（以 "{" 开头），没有版本标记，始终可读
+- 新格式："<版本>|<载荷>"，版本决定载荷的解码方式；字段集合变化时新增版本，旧版本保留解码能力
+"""
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Tuple, Union
+
+import orjson
+
+from apps.cmc_proxy.consts import CMC_QUOTE_CODEC
+
+# 读取方（数据库同步、行情格式化）实际用到的字段
+QUOTE_FIELDS_V1 = (
+    'id', 'name', 'symbol', 'slug', 'platform', 'num_market_pairs', 'date_added', 'tags', 'max_supply',
+    'infinite_supply', 'circulating_supply', 'total_supply', 'cmc_rank', 'self_reported_circulating_supply',
+    'self_reported_market_cap', 'tvl_ratio', 'last_updated',
+)
+USD_QUOTE_FIELDS_V1 = (
+    'price', 'volume_24h', 'volume_change_24h', 'percent_change_1h', 'percent_change_24h', 'percent_change_7d',
+    'percent_change_30d', 'percent_change_60d', 'percent_change_90d', 'market_cap', 'market_cap_dominance',
+    'fully_diluted_market_cap', 'tvl', 'last_updated',
+)
+
+VERSION_SEPARATOR = b'|'
+
+
+class QuoteCodec(ABC):
+    """报价编解码器基类，version 写入每个条目的前缀"""
+    version: str
+
+    @abstractmethod
+    def encode(self, data: Dict[str, Any]) -> bytes:
+        pass
+
+    @abstractmethod
+    def decode(self, payload: Union[str, bytes]) -> Dict[str, Any]:
+        pass
+
+
+class JsonQuoteCodec(QuoteCodec):
+    """完整保存 CMC 返回的数据，只是换成 orjson 序列化"""
+    version = 'j1'
+
+    def encode(self, data: Dict[str, Any]) -> bytes:
+        return orjson.dumps(data)
+
+    def decode(self, payload: Union[str, bytes]) -> Dict[str, Any]:
+        return orjson.loads(payload)
+
+
+class ProjectedQuoteCodec(QuoteCodec):
+    """
+    只保存读取方需要的字段，按固定顺序存成数组，省去重复的字段名。
+
+    载荷为 [字段值, USD 字段值]；原始数据缺少某些字段时追加 [缺失字段下标, 缺失 USD 字段下标]，
+    解码时不还原这些键，读取方的 .get(key, 默认值) 仍然生效。
+    """
+
+    def __init__(self, version: str, fields: Tuple[str, ...], usd_fields: Tuple[str, ...]):
+        self.version = version
+        self.fields = fields
+        self.usd_fields = usd_fields
+
+    @staticmethod
+    def _project(data: Dict[str, Any], fields: Tuple[str, ...]) -> Tuple[List[Any], List[int]]:
+        values, missing = [], []
+        for i, field in enumerate(fields):
+            if field in data:
+                values.append(data[field])
+            else:
+                values.append(None)
+                missing.append(i)
+        return values, missing
+
+    @staticmethod
+    def _restore(fields: Tuple[str, ...], values: List[Any], missing: List[int]) -> Dict[str, Any]:
+        data = dict(zip(fields, values))
+        for i in missing:
+            del data[fields[i]]
+        return data
+
+    def encode(self, data: Dict[str, Any]) -> bytes:
+        values, missing = self._project(data, self.fields)
+        usd_values, usd_missing = self._project(data.get('quote', {}).get('USD', {}), self.usd_fields)
+        payload = [values, usd_values]
+        if missing or usd_missing:
+            payload.extend((missing, usd_missing))
+        return orjson.dumps(payload)
+
+    def decode(self, payload: Union[str, bytes]) -> Dict[str, Any]:
+        try:
+            values, usd_values, *absent = orjson.loads(payload)
+            missing, usd_missing = absent or ((), ())
+            data = self._restore(self.fields, values, missing)
+            data['quote'] = {'USD': self._restore(self.usd_fields, usd_values, usd_missing)}
+        except (TypeError, ValueError, IndexError, KeyError) as e:
+            # orjson.JSONDecodeError 是 ValueError 的子类；结构不对时统一转换为 ValueError
+            raise ValueError(f"Malformed {self.version} quote payload: {e}") from e
+        return data
+
+
+CODECS: Dict[str, QuoteCodec] = {
+    codec.version: codec
+    for codec in (JsonQuoteCodec(), ProjectedQuoteCodec('p1', QUOTE_FIELDS_V1, USD_QUOTE_FIELDS_V1))
+}
+
+
+def encode_quote(data: Dict[str, Any], codec: str = None) -> bytes:
+    """按当前配置的编解码器编码报价，并加上版本前缀"""
+    quote_codec = CODECS[codec or CMC_QUOTE_CODEC]
+    return quote_codec.version.encode() + VERSION_SEPARATOR + quote_codec.encode(data)
+
+
+def decode_quote(raw: Union[str, bytes]) -> Dict[str, Any]:
+    """
+    解码任意版本的报价条目。
+
+    Raises:
+        ValueError: 数据损坏或版本未知
+    """
+    # decode_responses=True 的客户端返回 str，其他客户端返回 bytes
+    text = isinstance(raw, str)
+    if raw[:1] == ('{' if text else b'{'):
+        # 未带版本标记的旧 JSON 条目
+        return orjson.loads(raw)
+
+    version, separator, payload = raw.partition('|' if text else VERSION_SEPARATOR)
+    quote_codec = CODECS.get(version if text else version.decode(errors='replace'))
+    if not separator or quote_codec is None:
+        raise ValueError(f"Unknown quote data version: {version[:8]!r}")
+    return quote_codec.decode(payload)
@@ -1,21 +1,23 @@
 import asyncio
-import json
 import logging
+from collections import defaultdict
 from datetime import datetime
 from typing import Dict, Any, Optional, List
 
 import httpx
 from django.conf import settings
 from django.utils import timezone
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, retry_if_not_exception_type, stop_after_attempt, wait_exponential
 
-from apps.cmc_proxy.consts import CMC_N1, CMC_BATCH_PROCESSING_LOCK_KEY, CMC_BATCH_REQUESTS_PENDING_KEY, \
-    CMC_T1_MERGE_WINDOW_SECONDS, CMC_QUOTE_DATA_KEY, CMC_TTL_BASE, CMC_MARKET_DATA_TTL
+from apps.cmc_proxy.consts import CMC_N1, CMC_BATCH_PROCESSING_LOCK_KEY, \
+    CMC_BATCH_WAIT_TIMEOUT_SECONDS, CMC_TTL_BASE, CMC_MARKET_DATA_TTL
 from apps.cmc_proxy.helpers import KlineDataProcessor, MarketDataFormatter
 from apps.cmc_proxy.models import CmcAsset, CmcKline, CmcMarketData
-from apps.cmc_proxy.utils import CMCRedisClient
+from apps.cmc_proxy.utils import CMCRedisClient, QuoteSingleFlight, CreditBudget, CMCCreditBudgetExhausted, \
+    cmc_credit_cost
 from apps.cmc_proxy.utils import acquire_lock, release_lock
 from common.helpers import getLogger
+from common.redis_client import get_async_redis_client
 
 logger = getLogger(__name__)
 logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -57,6 +59,11 @@ class CoinMarketCapClient:
         }
         self.timeout = timeout
         self._http_client = httpx.AsyncClient(timeout=self.timeout)
+        # 外部Key服务用户请求；K线Key服务后台任务，预算紧张时让位于用户请求
+        self._background = self.client_type == "klines"
+        self._budget_redis = get_async_redis_client(settings.REDIS_CMC_URL)
+        self._credit_budget = CreditBudget(
+            self._budget_redis, self.api_key, "external" if self.client_type == "external" else "klines")
         
     def _is_valid_api_key(self, api_key: str) -> bool:
         """验证API Key格式（CMC API Key通常是UUID格式）"""
@@ -66,13 +73,15 @@ class CoinMarketCapClient:
         return api_key.replace('-', '').replace('_', '').isalnum()
 
     async def _make_api_request(self, endpoint, params):
+        await self._credit_budget.acquire(cmc_credit_cost(endpoint, params), background=self._background)
         logger.info(f"Calling CMC API ({self.client_type}): {endpoint} with params: {params}")
         response = await self._http_client.get(endpoint, headers=self.headers, params=params)
         response.raise_for_status()
         # data = await to_thread(response.json)  # JSON数据量很大的时候使用
         return response.json()
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10))
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10),
+           retry=retry_if_not_exception_type(CMCCreditBudgetExhausted))
     async def get_listings_latest(self, start=1, limit=None):
         endpoint = f"{self.BASE_URL}/v1/cryptocurrency/listings/latest"
         params = {
@@ -81,13 +90,15 @@ class CoinMarketCapClient:
         }
         return await self._make_api_request(endpoint, params)
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10))
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10),
+           retry=retry_if_not_exception_type(CMCCreditBudgetExhausted))
     async def get_quotes_latest(self, ids=None):
         endpoint = f"{self.BASE_URL}/v2/cryptocurrency/quotes/latest"
         params = {'id': ','.join(map(str, ids))}
         return await self._make_api_request(endpoint, params)
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10))
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10),
+           retry=retry_if_not_exception_type(CMCCreditBudgetExhausted))
     async def get_ohlcv_historical(self, coin_ids, count=24):
         endpoint = f"{self.BASE_URL}/v2/cryptocurrency/ohlcv/historical"
         # 支持批量获取多个代币数据
@@ -106,6 +117,7 @@ class CoinMarketCapClient:
 
     async def close(self):
         await self._http_client.aclose()
+        await self._budget_redis.aclose()
 
 
 class SingletonMeta(type):
@@ -134,6 +146,7 @@ class CoinMarketCapService:
         self._client = None
         self._client_type = client_type
         self._cmc_redis = None
+        self._single_flight = None
         self._initialized = False
         self._init_lock = None  # 将在async_init中创建
 
@@ -163,11 +176,13 @@ class CoinMarketCapService:
                     logger.info("Async initializing CoinMarketCapService")
                     try:
                         self._cmc_redis = await CMCRedisClient.create(self.redis_url)
+                        self._single_flight = QuoteSingleFlight(self._cmc_redis)
                         self._initialized = True
                     except Exception as e:
                         logger.error(f"Failed to initialize CoinMarketCapService: {e}", exc_info=True)
                         # 重置状态以允许重试
                         self._cmc_redis = None
+                        self._single_flight = None
                         self._initialized = False
                         raise
 
@@ -191,6 +206,9 @@ class CoinMarketCapService:
 
     async def _safe_close_redis(self):
         """安全地关闭Redis连接"""
+        if self._single_flight:
+            await self._single_flight.close()
+            self._single_flight = None
         if self._cmc_redis:
             try:
                 # 尝试关闭连接池
@@ -234,15 +252,10 @@ class CoinMarketCapService:
             response_data = await self.client.get_listings_latest()
             tokens_data = response_data.get('data', [])
             # 使用 Redis pipeline 批量缓存热门列表数据
-            pipe = self.cmc_redis.pipeline()
-            for token_item in tokens_data:
-                cmc_id = token_item.get('id')
-                symbol = token_item.get('symbol')
-                if not cmc_id or not symbol:
-                    continue
-                key_data = CMC_QUOTE_DATA_KEY % {"symbol_id": str(cmc_id)}
-                await pipe.set(key_data, json.dumps(token_item), ex=ttl_hot)
-            await pipe.execute()
+            await self.cmc_redis.cache_token_quotes(
+                [token_item for token_item in tokens_data if token_item.get('id') and token_item.get('symbol')],
+                ttl_hot,
+            )
 
             # 尝试获取目标代币数据
             target_data = await self.cmc_redis.get_token_quote_data(target_symbol_id)
@@ -260,7 +273,8 @@ class CoinMarketCapService:
 
     async def initiate_batch_request_processing(self, symbol_id):
         """
-        将请求添加到待处理批次，等待合并窗口，然后尝试从缓存获取数据。
+        将请求添加到待处理批次，等待批处理任务写入数据的通知，然后从缓存获取数据。
+        同一 cmc_id 的并发请求共享一次入队和一次等待（single-flight）。
         Args:
             symbol_id: 代币ID
             
@@ -275,14 +289,9 @@ class CoinMarketCapService:
             await self._ensure_initialized()
 
             symbol_id = str(symbol_id)
-            position = await self.cmc_redis.lpos(CMC_BATCH_REQUESTS_PENDING_KEY, symbol_id)
-            if position is not None:
-                logger.debug(f"Request for {symbol_id} already in pending batch")
-            else:
-                await self.cmc_redis.rpush(CMC_BATCH_REQUESTS_PENDING_KEY, symbol_id)
-                logger.debug(f"Added {symbol_id} to pending batch")
-
-            await asyncio.sleep(CMC_T1_MERGE_WINDOW_SECONDS)
+            await self._single_flight.wait(
+                symbol_id, self.cmc_redis.enqueue_batch_request, CMC_BATCH_WAIT_TIMEOUT_SECONDS,
+                record_demand=self.cmc_redis.record_batch_demand)
 
             data = await self.cmc_redis.get_token_quote_data(symbol_id)
             return data
@@ -417,6 +426,8 @@ class CoinMarketCapService:
             logger.error(f"Unexpected data format from CMC API: {type(data)}")
             return {'success': 0, 'failed': len(assets_map), 'total_klines': 0}
 
+        # 先校验并收集整批K线，再一次性批量写入
+        items = []
         for cmc_id_str, asset_data in data.items():
             try:
                 cmc_id = int(cmc_id_str)
@@ -431,26 +442,31 @@ class CoinMarketCapService:
                     failed_count += 1
                     continue
 
-                # 存储K线数据
-                asset_klines_count = 0
-                for quote_data in quotes_data:
-                    kline, created = await CmcKline.objects.update_or_create_from_api_data(
-                        asset, quote_data, timeframe='1h'
-                    )
-                    if kline:
-                        asset_klines_count += 1
-
-                if asset_klines_count > 0:
-                    success_count += 1
-                    total_klines_stored += asset_klines_count
-                    logger.debug(f"Stored {asset_klines_count} klines for {asset.symbol}")
-                else:
-                    failed_count += 1
+                items.extend((asset, quote_data) for quote_data in quotes_data)
 
             except Exception as e:
                 logger.error(f"Error processing klines for cmc_id {cmc_id_str}: {e}")
                 failed_count += 1
 
+        if not items:
+            return {'success': success_count, 'failed': failed_count, 'total_klines': total_klines_stored}
+
+        assets = {asset.id: asset for asset, _ in items}
+        try:
+            stored = await CmcKline.objects.abulk_upsert_from_api_data(items, timeframe='1h')
+        except Exception as e:
+            logger.error(f"Error storing klines for {len(assets)} assets: {e}", exc_info=True)
+            return {'success': success_count, 'failed': failed_count + len(assets), 'total_klines': 0}
+
+        for asset_id, asset in assets.items():
+            asset_klines_count = stored.get(asset_id, 0)
+            if asset_klines_count > 0:
+                success_count += 1
+                total_klines_stored += asset_klines_count
+                logger.debug(f"Stored {asset_klines_count} klines for {asset.symbol}")
+            else:
+                failed_count += 1
+
         return {'success': success_count, 'failed': failed_count, 'total_klines': total_klines_stored}
 
     async def process_klines(
@@ -465,7 +481,7 @@ class CoinMarketCapService:
         """
         公共 K 线处理方法：
           only_missing=False → 增量更新
-          only_missing=True  → 初始化时只处理缺失的资产
+          only_missing=True  → 初始化时只回补缺失或有缺口的K线
         """
         # 1. 构建资产查询集
         qs = CmcAsset.objects.all()
@@ -481,16 +497,18 @@ class CoinMarketCapService:
             logger.warning("No assets found for process_klines")
             return {'success': 0, 'failed': 0, 'total_klines': 0}
 
-        # 2. 如果初始化模式，只保留还没有任何 K 线数据的资产
+        # 2. 如果初始化模式，一次查询找出没有K线或最近 count 小时内有缺口的资产，只回补缺失部分
         if only_missing:
-            filtered = []
-            for asset in assets:
-                if await CmcKline.objects.filter(asset=asset).acount() == 0:
-                    filtered.append(asset)
-            assets = filtered
-            if not assets:
-                logger.info("All assets already have klines, skipping process_klines")
+            depths = await CmcKline.objects.amissing_depths([asset.id for asset in assets], count)
+            if not depths:
+                logger.info("All assets already have complete klines, skipping process_klines")
                 return {'success': 0, 'failed': 0, 'total_klines': 0}
+            return await self.fetch_and_store_missing_klines(
+                {asset.cmc_id: depths[asset.id] for asset in assets if asset.id in depths},
+                max_count=count,
+                batch_size=batch_size,
+                delay_between_calls=delay_between_calls,
+            )
 
         # 3. 批量获取并存储
         asset_ids = [asset.cmc_id for asset in assets]
@@ -501,6 +519,32 @@ class CoinMarketCapService:
             delay_between_calls=delay_between_calls,
         )
 
+    async def fetch_and_store_missing_klines(self, depths, max_count, batch_size=100, delay_between_calls=2.0):
+        """
+        按回补深度分组拉取缺失的K线。
+
+        深度向上取整到 2 的幂（不超过 max_count），让深度相近的资产共用同一次 CMC 调用，
+        避免每种深度都单独发起一批请求。
+
+        Args:
+            depths: {cmc_id: 需要回补的K线数量}
+            max_count: 回补深度上限
+        """
+        groups = defaultdict(list)
+        for cmc_id, depth in depths.items():
+            groups[min(1 << (depth - 1).bit_length(), max_count)].append(cmc_id)
+
+        totals = {'success': 0, 'failed': 0, 'total_klines': 0}
+        for index, (count, cmc_ids) in enumerate(sorted(groups.items())):
+            if index:
+                await asyncio.sleep(delay_between_calls)
+            logger.info(f"Backfilling {count} klines for {len(cmc_ids)} assets")
+            result = await self.fetch_and_store_klines_batch(
+                cmc_ids, count=count, delay_between_calls=delay_between_calls, batch_size=batch_size)
+            for key in totals:
+                totals[key] += result[key]
+        return totals
+
     async def close(self):
         """关闭所有资源连接"""
         # 关闭Redis连接
@@ -583,75 +627,92 @@ async def get_klines_for_asset(asset: CmcAsset, timeframe: str, start_time: date
     从数据库获取并处理单个资产的K线数据。
     如果数据库没有数据，使用Redis缓存防止重复CMC API调用。
     """
-    klines_qs = CmcKline.objects.filter(
-        asset=asset,
-        timeframe=timeframe,
-        timestamp__gte=start_time,
-        timestamp__lte=end_time
-    ).order_by('timestamp')
-
-    klines = await KlineDataProcessor.serialize_klines_data(klines_qs)
-
-    # 如果数据库没有K线数据，检查缓存防止重复API调用
-    if not klines:
-        cache_key = f"klines_fetch_lock:{asset.cmc_id}:{timeframe}"
-        
-        try:
-            # 外部用户请求K线数据，使用外部专用Key
-            service = await get_cmc_service(client_type="external")
-            
-            # 检查是否已有正在进行的API请求（防止重复调用）
-            existing_lock = await service.cmc_redis.get(cache_key)
-            if existing_lock:
-                logger.info(f"Klines fetch already in progress for {asset.symbol} (cmc_id: {asset.cmc_id}), skipping duplicate request")
-                # 返回空数据，避免重复API调用
-                high_24h, low_24h = KlineDataProcessor.calculate_high_low_24h([], start_time_24h)
-                return {
-                    'klines': [],
-                    'high_24h': high_24h,
-                    'low_24h': low_24h,
-                }
-            
-            # 设置锁，防止并发重复请求（5分钟过期）
-            await service.cmc_redis.set(cache_key, "fetching", ex=300)
-            
-            logger.info(f"No klines found for asset {asset.symbol} (cmc_id: {asset.cmc_id}), attempting to fetch from CMC")
-            
-            # 获取24小时的历史数据用于初始化
-            result = await service.fetch_and_store_klines_batch([asset.cmc_id], count=24, batch_size=1)
-
-            if result['success'] > 0:
-                logger.info(f"Successfully fetched and stored {result['total_klines']} klines for {asset.symbol}")
-                # 重新查询数据库获取刚存储的K线数据
-                klines_qs = CmcKline.objects.filter(
-                    asset=asset,
-                    timeframe=timeframe,
-                    timestamp__gte=start_time,
-                    timestamp__lte=end_time
-                ).order_by('timestamp')
-                klines = await KlineDataProcessor.serialize_klines_data(klines_qs)
-            else:
-                logger.warning(f"Failed to fetch klines for {asset.symbol} from CMC API")
-            
-            # 清除锁
-            await service.cmc_redis.delete(cache_key)
+    results = await get_klines_for_assets([asset], timeframe, start_time, end_time, start_time_24h)
+    return results[asset.id]
 
-        except Exception as e:
-            logger.error(f"Error fetching klines for asset {asset.symbol}: {e}", exc_info=True)
-            # 出错时也要清除锁
+
+async def _backfill_missing_klines(assets: List[CmcAsset], timeframe: str) -> bool:
+    """
+    数据库中没有K线的资产一次性从CMC拉取24小时历史。
+    每个资产用Redis锁防止并发重复调用，已有请求正在拉取的资产跳过。返回是否写入了新的K线。
+    """
+    lock_keys = {asset.cmc_id: f"klines_fetch_lock:{asset.cmc_id}:{timeframe}" for asset in assets}
+    cmc_ids = []
+    try:
+        # 外部用户请求K线数据，使用外部专用Key
+        service = await get_cmc_service(client_type="external")
+
+        # 设置锁，防止并发重复请求（5分钟过期）
+        async with service.cmc_redis.pipeline(transaction=False) as pipe:
+            for key in lock_keys.values():
+                pipe.set(key, "fetching", ex=300, nx=True)
+            acquired = await pipe.execute()
+        cmc_ids = [cmc_id for cmc_id, locked in zip(lock_keys, acquired) if locked]
+        if len(cmc_ids) < len(lock_keys):
+            logger.info(f"Klines fetch already in progress for {len(lock_keys) - len(cmc_ids)} assets, "
+                        f"skipping duplicate requests")
+        if not cmc_ids:
+            return False
+
+        logger.info(f"No klines found for {len(cmc_ids)} assets, attempting to fetch from CMC")
+        # 获取24小时的历史数据用于初始化
+        result = await service.fetch_and_store_klines_batch(cmc_ids, count=24)
+        if result['success'] > 0:
+            logger.info(f"Successfully fetched and stored {result['total_klines']} klines "
+                        f"for {result['success']} assets")
+        else:
+            logger.warning(f"Failed to fetch klines for {len(cmc_ids)} assets from CMC API")
+        return result['success'] > 0
+
+    except Exception as e:
+        logger.error(f"Error fetching klines for {len(assets)} assets: {e}", exc_info=True)
+        return False
+    finally:
+        # 清除锁，出错时也要清除
+        if cmc_ids:
             try:
-                service = await get_cmc_service(client_type="external")
-                await service.cmc_redis.delete(cache_key)
-            except:
+                await service.cmc_redis.delete(*(lock_keys[cmc_id] for cmc_id in cmc_ids))
+            except Exception:
                 pass
 
-    high_24h, low_24h = KlineDataProcessor.calculate_high_low_24h(klines, start_time_24h)
 
-    return {
-        'klines': klines,
-        'high_24h': high_24h,
-        'low_24h': low_24h,
-    }
+async def get_klines_for_assets(assets: List[CmcAsset], timeframe: str, start_time: datetime, end_time: datetime,
+                                start_time_24h: datetime) -> Dict[int, Dict[str, Any]]:
+    """
+    批量获取一页资产的K线数据：一次按 (asset, timestamp) 排序的窗口查询，在Python中按资产分组。
+    数据库中没有K线的资产一起从CMC拉取一次，再用一次查询重新读取，查询次数与资产数量无关。
+
+    Returns:
+        {asset.id: {'klines', 'high_24h', 'low_24h'}}
+    """
+    if not assets:
+        return {}
+
+    def window(asset_ids):
+        return CmcKline.objects.filter(
+            asset_id__in=asset_ids,
+            timeframe=timeframe,
+            timestamp__gte=start_time,
+            timestamp__lte=end_time
+        ).order_by('asset_id', 'timestamp')
+
+    grouped = await KlineDataProcessor.serialize_klines_by_asset(window([asset.id for asset in assets]))
+
+    missing = [asset for asset in assets if not grouped.get(asset.id)]
+    if missing and await _backfill_missing_klines(missing, timeframe):
+        # 重新查询数据库获取刚存储的K线数据
+        grouped.update(await KlineDataProcessor.serialize_klines_by_asset(window([asset.id for asset in missing])))
+
+    results = {}
+    for asset in assets:
+        klines = grouped.get(asset.id) or []
+        high_24h, low_24h = KlineDataProcessor.calculate_high_low_24h(klines, start_time_24h)
+        results[asset.id] = {
+            'klines': klines,
+            'high_24h': high_24h,
+            'low_24h': low_24h,
+        }
+    return results
 
 
 async def get_latest_market_data(cmc_id: int) -> Optional[Dict[str, Any]]:
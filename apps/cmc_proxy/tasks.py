@@ -1,5 +1,5 @@
 import asyncio
-import json
+import hashlib
 
 from celery import shared_task
 from django.conf import settings
@@ -7,6 +7,7 @@ from django_celery_beat.models import PeriodicTask
 
 from apps.cmc_proxy import consts
 from apps.cmc_proxy.models import CmcAsset, CmcKline, CmcMarketData
+from apps.cmc_proxy.quote_codec import decode_quote
 from apps.cmc_proxy.services import CoinMarketCapClient, get_cmc_service
 from apps.cmc_proxy.utils import CMCRedisClient, acquire_lock, release_lock
 from common.helpers import getLogger
@@ -87,44 +88,26 @@ async def _process_pending_cmc_batch_requests_with_lock(task_lock_key):
             logger.warning("Failed to acquire batch processing lock, another process might be running")
             return
 
-        # 从Redis列表中获取待处理请求
+        # 从待处理队列中取出请求最多（以及等待过久）的ID
         batch_size = consts.CMC_N2_BATCH_TARGET_SIZE
-        pending_ids = []
-
-        # 使用 LPOP 获取多个元素（Redis 6.2+）
-        try:
-            pending_ids_bytes = await cmc_redis.lpop(consts.CMC_BATCH_REQUESTS_PENDING_KEY, batch_size)
-            if pending_ids_bytes:
-                # 如果返回的是单个元素而不是列表，将其包装为列表
-                if not isinstance(pending_ids_bytes, list):
-                    pending_ids = [pending_ids_bytes]
-                else:
-                    pending_ids = pending_ids_bytes
-        except Exception as e:
-            logger.error(f"Error getting pending requests from Redis list: {e}", exc_info=True)
-            # 如果上面的方法失败，尝试使用LRANGE和LTRIM组合来模拟批量LPOP
-            pending_ids_bytes = await cmc_redis.lrange(consts.CMC_BATCH_REQUESTS_PENDING_KEY, 0, batch_size - 1)
-            if pending_ids_bytes:
-                pending_ids = [id_bytes for id_bytes in pending_ids_bytes]
-                # 删除已获取的元素
-                await cmc_redis.ltrim(consts.CMC_BATCH_REQUESTS_PENDING_KEY, len(pending_ids), -1)
-
-        # 去重
-        unique_ids = list(set(pending_ids))
+        unique_ids = await cmc_redis.pop_batch_requests(batch_size)
         logger.info(f"Got {len(unique_ids)} unique IDs from pending requests")
 
-        # 只有在有实际待处理请求时才从数据库获取热门ID补充，避免无限重复请求
-        if len(unique_ids) > 0 and len(unique_ids) < batch_size:
+        # 只有在有实际待处理请求时才补充热门ID，避免无限重复请求
+        if 0 < len(unique_ids) < batch_size:
             supplement_count = batch_size - len(unique_ids)
-            supplement_ids = await _get_top_market_cap_ids_from_db(supplement_count, exclude_ids=unique_ids)
-
-            # 确保不重复（双重保护）
-            supplement_ids = [_id for _id in supplement_ids if _id not in unique_ids]
+            # 优先使用每日全量同步缓存的补充池，补充池为空时才回退到数据库
+            pool_ids = await cmc_redis.get_from_supplement_pool(batch_size)
+            supplement_ids = [_id for _id in pool_ids if _id not in unique_ids][:supplement_count]
+            source = "supplement pool"
+            if not supplement_ids:
+                supplement_ids = await _get_top_market_cap_ids_from_db(supplement_count, exclude_ids=unique_ids)
+                source = "database (top market cap)"
             unique_ids.extend(supplement_ids)
 
-            logger.info(f"Added {len(supplement_ids)} IDs from database (top market cap)")
+            logger.info(f"Added {len(supplement_ids)} IDs from {source}")
         elif len(unique_ids) == 0:
-            logger.info("No pending requests found, skipping database supplement to avoid infinite requests")
+            logger.info("No pending requests found, skipping supplement to avoid infinite requests")
 
         if not unique_ids:
             logger.info("No IDs to process in this batch")
@@ -136,6 +119,7 @@ async def _process_pending_cmc_batch_requests_with_lock(task_lock_key):
             response_data = await client.get_quotes_latest(ids=unique_ids)
             quotes_data = response_data.get('data', {})
 
+            valid_tokens = []
             for cmc_id_str, token_data in quotes_data.items():
                 cmc_id = token_data.get('id')
                 if not cmc_id:
@@ -147,12 +131,18 @@ async def _process_pending_cmc_batch_requests_with_lock(task_lock_key):
                     logger.warning(f"Token data missing symbol for id: {cmc_id}")
                     continue
 
-                await cmc_redis.cache_token_quote_data(str(cmc_id), token_data, consts.CMC_TTL_WARM_COLD)
+                valid_tokens.append(token_data)
+
+            await cmc_redis.cache_token_quotes(valid_tokens, consts.CMC_TTL_WARM_COLD)
 
             logger.info(f"Successfully processed {len(quotes_data)} tokens in this batch")
 
         except Exception as e:
             logger.error(f"Error fetching quotes from CMC API: {e}", exc_info=True)
+        finally:
+            # 唤醒等待这些ID的请求（包括CMC未返回数据的ID，让它们尽快得到空结果）
+            await cmc_redis.publish_quote_ready(unique_ids)
+            await client.close()
 
     except Exception as e:
         logger.error(f"Critical error during batch processing: {e}", exc_info=True)
@@ -225,6 +215,7 @@ async def _daily_full_data_sync_implementation(cmc_redis):
                 all_tokens_data.extend(tokens_page)
                 logger.info(f"Fetched {len(tokens_page)} tokens, total so far: {len(all_tokens_data)}")
 
+                valid_tokens = []
                 for token_item in tokens_page:
                     cmc_id = token_item.get('id')
                     symbol = token_item.get('symbol')
@@ -232,7 +223,10 @@ async def _daily_full_data_sync_implementation(cmc_redis):
                         logger.warning(f"Token item missing id or symbol: {token_item.get('slug')}")
                         continue
 
-                    await cmc_redis.cache_token_quote_data(str(cmc_id), token_item, consts.CMC_TTL_BASE)
+                    valid_tokens.append(token_item)
+
+                # 整页报价通过一个 pipeline 写入
+                await cmc_redis.cache_token_quotes(valid_tokens, consts.CMC_TTL_BASE)
 
                 if len(tokens_page) < page_size:
                     break
@@ -268,6 +262,7 @@ async def _daily_full_data_sync_implementation(cmc_redis):
         logger.error(f"Critical error during daily_full_data_sync task: {e}", exc_info=True)
         return 0
     finally:
+        await client.close()
         # 重新启用批量请求任务
         if batch_task and not batch_task.enabled:
             try:
@@ -293,6 +288,8 @@ async def _process_cmc_klines(count: int, only_missing: bool):
                 await cmc_service.process_klines(count=24, only_missing=True)
         # 执行请求的模式更新或初始化
         result = await cmc_service.process_klines(count=count, only_missing=only_missing)
+        if result['total_klines']:
+            await cmc_service.cmc_redis.bump_market_data_generation()
         logger.info(
             f"CMC klines {mode} completed. Success: {result['success']}, Failed: {result['failed']}, Total klines: {result['total_klines']}")
         return result['total_klines']
@@ -355,67 +352,94 @@ async def _sync_cmc_data_with_lock():
 
 
 async def _sync_data_from_redis_implementation(cmc_redis):
-    """直接实现数据同步逻辑，避免 asyncio.run() 冲突"""
-    from apps.cmc_proxy.consts import CMC_QUOTE_DATA_KEY
-
-    # 使用 scan_iter 高效地遍历所有代币数据的键
-    pattern = CMC_QUOTE_DATA_KEY.replace("%(symbol_id)s", "*")
-    keys = [key async for key in cmc_redis.scan_iter(match=pattern)]
+    """
+    直接实现数据同步逻辑，避免 asyncio.run() 冲突。
 
-    if not keys:
+    以流水线方式分批处理：SCAN 一批键 -> MGET 取值 -> 与上次写入的报价哈希比较，
+    只有内容变化的代币才进入批量 upsert，每批对资产和行情各执行一次 INSERT ... ON CONFLICT。
+    """
+    pattern = consts.CMC_QUOTE_DATA_KEY.replace("%(symbol_id)s", "*")
+    stats = {'total': 0, 'unchanged': 0, 'assets_created': 0, 'assets_updated': 0,
+             'market_data_touched': 0, 'failed': 0}
+
+    batch = []
+    async for key in cmc_redis.scan_iter(match=pattern, count=consts.CMC_SYNC_BATCH_SIZE):
+        batch.append(key)
+        if len(batch) >= consts.CMC_SYNC_BATCH_SIZE:
+            await _sync_quote_batch(cmc_redis, batch, stats)
+            batch = []
+    if batch:
+        await _sync_quote_batch(cmc_redis, batch, stats)
+
+    if not stats['total']:
         logger.warning("No CMC data keys found in Redis to sync.")
-        return
+        return stats
 
-    logger.info(f"Found {len(keys)} CMC data keys in Redis.")
+    if stats['assets_created'] or stats['market_data_touched']:
+        await cmc_redis.bump_market_data_generation()
 
-    assets_created_count = 0
-    assets_updated_count = 0
-    market_data_updated_count = 0
-    failed_count = 0
-    total_count = len(keys)
+    # 哈希表只在创建后设置一次过期时间，到期后整体重新写入一次，避免数据库被重置后永远跳过
+    if await cmc_redis.ttl(consts.CMC_SYNC_PAYLOAD_HASH_KEY) == -1:
+        await cmc_redis.expire(consts.CMC_SYNC_PAYLOAD_HASH_KEY, consts.CMC_SYNC_PAYLOAD_HASH_TTL)
 
-    for key in keys:
+    logger.info(f'Successfully synchronized CMC data. '
+                f'Total Processed: {stats["total"]}, '
+                f'Unchanged: {stats["unchanged"]}, '
+                f'Assets Created: {stats["assets_created"]}, '
+                f'Assets Updated: {stats["assets_updated"]}, '
+                f'Market Data Touched: {stats["market_data_touched"]}, '
+                f'Failed: {stats["failed"]}')
+    return stats
+
+
+async def _sync_quote_batch(cmc_redis, keys: list, stats: dict):
+    """同步一批报价键到数据库，结果累加到 stats"""
+    stats['total'] += len(keys)
+    async with cmc_redis.pipeline(transaction=False) as pipe:
+        pipe.mget(keys)
+        pipe.hmget(consts.CMC_SYNC_PAYLOAD_HASH_KEY, [key.rsplit(':', 1)[-1] for key in keys])
+        raw_values, synced_hashes = await pipe.execute()
+
+    changed = []
+    for key, raw_data, synced_hash in zip(keys, raw_values, synced_hashes):
+        if not raw_data:
+            stats['failed'] += 1
+            continue
         try:
-            raw_data = await cmc_redis.get(key)
-            if not raw_data:
-                failed_count += 1
-                continue
-
-            api_data = json.loads(raw_data)
-            cmc_id = api_data.get('id')
-            if not cmc_id:
-                logger.warning(f"Skipping key {key} due to missing 'id' field.")
-                failed_count += 1
-                continue
-
-            # 1. 同步 CmcAsset (资产元数据)
-            asset, created = await CmcAsset.objects.update_or_create_from_api_data(api_data)
-            if not asset:
-                failed_count += 1
-                continue
-
-            if created:
-                assets_created_count += 1
-            else:
-                assets_updated_count += 1
-
-            # 2. 同步 CmcMarketData (最新行情)
-            await CmcMarketData.objects.update_or_create_from_api_data(asset, api_data)
-            market_data_updated_count += 1
-
-        except json.JSONDecodeError:
-            logger.error(f"Failed to decode JSON from key {key}.")
-            failed_count += 1
-        except Exception as e:
-            logger.error(f"Error processing data for key {key}: {e}", exc_info=True)
-            failed_count += 1
+            api_data = decode_quote(raw_data)
+        except ValueError:
+            logger.error(f"Failed to decode quote data from key {key}.")
+            stats['failed'] += 1
+            continue
+
+        cmc_id = api_data.get('id')
+        if not cmc_id or not api_data.get('name') or not api_data.get('symbol'):
+            logger.warning(f"Skipping key {key} due to missing 'id', 'name' or 'symbol' field.")
+            stats['failed'] += 1
+            continue
+
+        digest = hashlib.blake2b(raw_data.encode(), digest_size=16).hexdigest()
+        if synced_hash == digest:
+            stats['unchanged'] += 1
+            continue
+        changed.append((api_data, digest))
+
+    if not changed:
+        return
 
-    logger.info(f'Successfully synchronized CMC data. '
-                f'Total Processed: {total_count}, '
-                f'Assets Created: {assets_created_count}, '
-                f'Assets Updated: {assets_updated_count}, '
-                f'Market Data Touched: {market_data_updated_count}, '
-                f'Failed: {failed_count}')
+    try:
+        assets, created = await CmcAsset.objects.abulk_upsert_from_api_data([d for d, _ in changed])
+        stats['market_data_touched'] += await CmcMarketData.objects.abulk_upsert_from_api_data(
+            [(assets[d['id']], d) for d, _ in changed])
+        stats['assets_created'] += created
+        stats['assets_updated'] += len(assets) - created
+    except Exception as e:
+        logger.error(f"Error syncing batch of {len(changed)} CMC quotes: {e}", exc_info=True)
+        stats['failed'] += len(changed)
+        return
+
+    # 写库成功后才记录哈希，失败的批次下次会重新写入
+    await cmc_redis.hset(consts.CMC_SYNC_PAYLOAD_HASH_KEY, mapping={str(d['id']): digest for d, digest in changed})
 
 
 # Celery任务包装器
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase
+from django.utils import timezone
+
+from apps.cmc_proxy.models import CmcAsset, CmcKline
+from apps.cmc_proxy.services import CoinMarketCapService
+
+START = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _ohlcv_quote(hour, close):
+    return {
+        'time_open': (START + timedelta(hours=hour)).isoformat(),
+        'quote': {'USD': {'open': 1, 'high': 2, 'low': 0.5, 'close': close, 'volume': 100}},
+    }
+
+
+class ProcessKlinesResponseTestCase(TestCase):
+    """K线响应批量入库"""
+
+    ASSET_COUNT = 5
+    HOURS = 24
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.assets = {
+            100 + i: CmcAsset.objects.create(cmc_id=100 + i, name=f'Token {i}', symbol=f'TK{i}')
+            for i in range(cls.ASSET_COUNT)
+        }
+
+    def _response(self, close):
+        return {'data': {
+            str(cmc_id): {'id': cmc_id, 'quotes': [_ohlcv_quote(h, close) for h in range(self.HOURS)]}
+            for cmc_id in self.assets
+        }}
+
+    def test_batch_is_written_with_a_single_statement(self):
+        service = CoinMarketCapService()
+        with self.assertNumQueries(1):
+            result = async_to_sync(service._process_klines_response)(self._response(1.5), self.assets)
+
+        self.assertEqual(result, {'success': self.ASSET_COUNT, 'failed': 0,
+                                  'total_klines': self.ASSET_COUNT * self.HOURS})
+        self.assertEqual(CmcKline.objects.count(), self.ASSET_COUNT * self.HOURS)
+
+        # 重复写入同一批开盘时间时更新已有K线
+        async_to_sync(service._process_klines_response)(self._response(1.75), self.assets)
+        self.assertEqual(CmcKline.objects.count(), self.ASSET_COUNT * self.HOURS)
+        kline = CmcKline.objects.get(asset=self.assets[100], timeframe='1h', timestamp=START)
+        self.assertEqual(kline.close, Decimal('1.75'))
+        self.assertEqual(kline.volume_token_count, Decimal('57.14285714'))
+
+
+class MissingKlineDetectionTestCase(TestCase):
+    """K线缺口检测与按深度分组回补"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.end_time = timezone.now().replace(minute=0, second=0, microsecond=0)
+        # cmc_id -> 缺失的小时（距 end_time），None 表示没有任何K线
+        gaps = {1: None, 2: (), 3: (3,), 4: (2, 20)}
+        cls.assets = {}
+        for cmc_id, missing in gaps.items():
+            asset = CmcAsset.objects.create(cmc_id=cmc_id, name=f'Token {cmc_id}', symbol=f'TK{cmc_id}')
+            cls.assets[cmc_id] = asset
+            if missing is None:
+                continue
+            for hours in range(1, 25):
+                if hours not in missing:
+                    CmcKline.objects.create(
+                        asset=asset, timeframe='1h', timestamp=cls.end_time - timedelta(hours=hours),
+                        open=Decimal('1'), high=Decimal('1'), low=Decimal('1'), close=Decimal('1'),
+                    )
+
+    def test_missing_depths_in_one_query(self):
+        asset_ids = [asset.id for asset in self.assets.values()]
+        with self.assertNumQueries(1):
+            depths = async_to_sync(CmcKline.objects.amissing_depths)(asset_ids, 24, end_time=self.end_time)
+        self.assertEqual(depths, {self.assets[1].id: 24, self.assets[3].id: 3, self.assets[4].id: 20})
+
+    def test_process_klines_groups_assets_by_backfill_depth(self):
+        service = CoinMarketCapService()
+        fetch = mock.AsyncMock(return_value={'success': 1, 'failed': 0, 'total_klines': 1})
+        with mock.patch.object(service, 'fetch_and_store_klines_batch', fetch), \
+                mock.patch('apps.cmc_proxy.models.timezone.now', return_value=self.end_time):
+            async_to_sync(service.process_klines)(
+                cmc_ids=list(self.assets), count=24, delay_between_calls=0, only_missing=True)
+
+        calls = {call.kwargs['count']: sorted(call.args[0]) for call in fetch.call_args_list}
+        self.assertEqual(calls, {4: [3], 24: [1, 4]})
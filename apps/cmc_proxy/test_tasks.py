@@ -0,0 +1,76 @@
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from django.test import TestCase
+
+from apps.cmc_proxy import consts
+from apps.cmc_proxy.models import CmcAsset, CmcMarketData
+from apps.cmc_proxy.tasks import _sync_data_from_redis_implementation, _sync_quote_batch
+from apps.cmc_proxy.utils import CMCRedisClient
+
+TEST_IDS = [9_100_000 + i for i in range(3)]
+
+
+def _quote(cmc_id, price):
+    return {
+        'id': cmc_id, 'name': f'Sync Token {cmc_id}', 'symbol': f'S{cmc_id % 1000}', 'cmc_rank': 1,
+        'last_updated': '2025-01-01T00:00:00.000Z',
+        'quote': {'USD': {'price': price, 'volume_24h': price * 100, 'market_cap': price * 1000}},
+    }
+
+
+class SyncDataFromRedisTestCase(TestCase):
+    """Redis -> 数据库批量同步"""
+
+    async def _cleanup(self):
+        await self.redis.delete(*[consts.CMC_QUOTE_DATA_KEY % {'symbol_id': i} for i in TEST_IDS])
+        await self.redis.hdel(consts.CMC_SYNC_PAYLOAD_HASH_KEY, *[str(i) for i in TEST_IDS])
+
+    async def _write_quote(self, cmc_id, price):
+        await self.redis.set(consts.CMC_QUOTE_DATA_KEY % {'symbol_id': cmc_id}, json.dumps(_quote(cmc_id, price)))
+
+    async def test_bulk_upsert_skips_unchanged_payloads(self):
+        self.redis = await CMCRedisClient.create(settings.REDIS_CMC_URL)
+        await self._cleanup()
+        try:
+            await self._check_bulk_upsert()
+        finally:
+            await self._cleanup()
+            await self.redis.aclose()
+
+    async def _check_bulk_upsert(self):
+        for cmc_id in TEST_IDS:
+            await self._write_quote(cmc_id, 2.5)
+
+        await _sync_data_from_redis_implementation(self.redis)
+        self.assertEqual(await CmcMarketData.objects.filter(asset__cmc_id__in=TEST_IDS).acount(), len(TEST_IDS))
+
+        # 只有内容变化的报价会被重新写入
+        await self._write_quote(TEST_IDS[0], 4.0)
+        await CmcAsset.objects.filter(cmc_id=TEST_IDS[1]).aupdate(name='renamed')
+        await _sync_data_from_redis_implementation(self.redis)
+
+        market_data = await CmcMarketData.objects.select_related('asset').aget(asset__cmc_id=TEST_IDS[0])
+        self.assertEqual(market_data.price_usd, Decimal('4'))
+        self.assertEqual(market_data.volume_24h_token_count, Decimal('100'))
+        self.assertEqual(market_data.asset.name, f'Sync Token {TEST_IDS[0]}')
+        self.assertEqual((await CmcAsset.objects.aget(cmc_id=TEST_IDS[1])).name, 'renamed')
+
+    async def test_duplicate_keys_in_one_batch(self):
+        self.redis = await CMCRedisClient.create(settings.REDIS_CMC_URL)
+        await self._cleanup()
+        try:
+            # SCAN 可能多次返回同一个键，同一批次内重复的报价只写入一次
+            for cmc_id in TEST_IDS[:2]:
+                await self._write_quote(cmc_id, 2.5)
+            keys = [consts.CMC_QUOTE_DATA_KEY % {'symbol_id': i} for i in (TEST_IDS[0], TEST_IDS[0], TEST_IDS[1])]
+            stats = {'total': 0, 'unchanged': 0, 'assets_created': 0, 'assets_updated': 0,
+                     'market_data_touched': 0, 'failed': 0}
+            await _sync_quote_batch(self.redis, keys, stats)
+            self.assertEqual(stats['failed'], 0)
+            self.assertEqual(stats['assets_created'], 2)
+            self.assertEqual(await CmcMarketData.objects.filter(asset__cmc_id__in=TEST_IDS).acount(), 2)
+        finally:
+            await self._cleanup()
+            await self.redis.aclose()
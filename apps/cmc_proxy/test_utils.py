@@ -0,0 +1,189 @@
+import asyncio
+import json
+from unittest import mock
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from apps.cmc_proxy import consts
+from apps.cmc_proxy.quote_codec import decode_quote, encode_quote
+from apps.cmc_proxy.utils import (
+    CMCCreditBudgetExhausted, CMCRedisClient, CreditBudget, QuoteSingleFlight, cmc_credit_cost,
+)
+from common.redis_client import get_async_redis_client
+
+TEST_BUDGETS = {'klines': {'capacity': 10, 'refill_per_second': 0.001}}
+
+
+class CreditBudgetTestCase(SimpleTestCase):
+    """CMC credit 令牌桶"""
+
+    def test_credit_cost_follows_cmc_pricing(self):
+        base = 'https://pro-api.coinmarketcap.com'
+        ids = ','.join(str(i) for i in range(150))
+        self.assertEqual(cmc_credit_cost(f'{base}/v1/cryptocurrency/listings/latest', {'limit': 5000}), 25)
+        self.assertEqual(cmc_credit_cost(f'{base}/v2/cryptocurrency/quotes/latest', {'id': ids}), 2)
+        self.assertEqual(cmc_credit_cost(f'{base}/v2/cryptocurrency/ohlcv/historical', {'id': ids, 'count': 24}), 36)
+        self.assertEqual(cmc_credit_cost(f'{base}/v2/cryptocurrency/ohlcv/historical', {'id': '1', 'count': 1}), 1)
+
+    @mock.patch('apps.cmc_proxy.utils.CMC_CREDIT_BUDGETS', TEST_BUDGETS)
+    @mock.patch('apps.cmc_proxy.utils.CMC_CREDIT_USER_ACQUIRE_TIMEOUT', 0)
+    @mock.patch('apps.cmc_proxy.utils.CMC_CREDIT_BACKGROUND_ACQUIRE_TIMEOUT', 0)
+    def test_background_jobs_keep_out_of_the_reserve(self):
+        asyncio.run(self._check_reserve())
+
+    async def _check_reserve(self):
+        redis = get_async_redis_client(settings.REDIS_CMC_URL)
+        budget = CreditBudget(redis, 'credit-budget-test-key', 'klines')
+        keys = [consts.CMC_CREDIT_BUCKET_KEY % {'key_id': budget.key_id}]
+        await redis.delete(*keys)
+        try:
+            # 后台任务最多只能用掉 80%，剩下的保留给用户请求
+            await budget.acquire(8, background=True)
+            with self.assertRaises(CMCCreditBudgetExhausted):
+                await budget.acquire(1, background=True)
+            await budget.acquire(2)
+            with self.assertRaises(CMCCreditBudgetExhausted):
+                await budget.acquire(1)
+        finally:
+            await redis.delete(*keys, *await redis.keys(consts.CMC_CREDIT_SPEND_KEY % {
+                'key_id': budget.key_id, 'date': '*'}))
+            await redis.aclose()
+
+
+@mock.patch('apps.cmc_proxy.utils.CMC_BATCH_REQUESTS_PENDING_KEY', 'cmc:test:pending:first_seen')
+@mock.patch('apps.cmc_proxy.utils.CMC_BATCH_REQUESTS_DEMAND_KEY', 'cmc:test:pending:demand')
+class PendingBatchQueueTestCase(SimpleTestCase):
+    """按请求次数排序的待处理批次队列"""
+
+    def test_most_demanded_and_overdue_ids_are_popped_first(self):
+        asyncio.run(self._check_pop_order())
+
+    async def _check_pop_order(self):
+        redis = await CMCRedisClient.create(settings.REDIS_CMC_URL)
+        keys = ['cmc:test:pending:first_seen', 'cmc:test:pending:demand']
+        await redis.delete(*keys)
+        try:
+            for symbol_id, requests in (('1', 1), ('2', 5), ('3', 3), ('4', 1)):
+                for _ in range(requests):
+                    await redis.enqueue_batch_request(symbol_id)
+            self.assertEqual(await redis.zcard(keys[0]), 4)
+            self.assertEqual(await redis.zscore(keys[1], '2'), 5)
+
+            # 等待过久的请求不论次数都先出队
+            await redis.zadd(keys[0], {'4': 0})
+            self.assertEqual(await redis.pop_batch_requests(2), ['4', '2'])
+            self.assertEqual(await redis.pop_batch_requests(5), ['3', '1'])
+            self.assertEqual(await redis.pop_batch_requests(5), [])
+            self.assertFalse(await redis.exists(*keys))
+        finally:
+            await redis.delete(*keys)
+            await redis.aclose()
+
+    def test_every_waiter_counts_as_demand(self):
+        asyncio.run(self._check_waiter_demand())
+
+    async def _check_waiter_demand(self):
+        redis = await CMCRedisClient.create(settings.REDIS_CMC_URL)
+        keys = ['cmc:test:pending:first_seen', 'cmc:test:pending:demand']
+        await redis.delete(*keys)
+        flights = QuoteSingleFlight(redis)
+        try:
+            # 同一ID的并发未命中合并为一个 flight，但每个请求都计入请求次数
+            results = await asyncio.gather(*(
+                flights.wait('42', redis.enqueue_batch_request, 0.2, record_demand=redis.record_batch_demand)
+                for _ in range(5)))
+            self.assertEqual(results, [False] * 5)
+            self.assertEqual(await redis.zcard(keys[0]), 1)
+            self.assertEqual(await redis.zscore(keys[1], '42'), 5)
+            self.assertEqual(await redis.pop_batch_requests(5), ['42'])
+        finally:
+            await flights.close()
+            await redis.delete(*keys)
+            await redis.aclose()
+
+    def test_waiter_after_pop_does_not_requeue(self):
+        asyncio.run(self._check_waiter_after_pop())
+
+    async def _check_waiter_after_pop(self):
+        redis = await CMCRedisClient.create(settings.REDIS_CMC_URL)
+        keys = ['cmc:test:pending:first_seen', 'cmc:test:pending:demand']
+        await redis.delete(*keys)
+        flights = QuoteSingleFlight(redis)
+        try:
+            leader = asyncio.create_task(
+                flights.wait('42', redis.enqueue_batch_request, 0.5, record_demand=redis.record_batch_demand))
+            while not await redis.exists(keys[1]):
+                await asyncio.sleep(0.01)
+            self.assertEqual(await redis.pop_batch_requests(5), ['42'])
+
+            # 批处理已取出该ID，之后合并进来的请求不会让它再次出队
+            joined = await flights.wait('42', redis.enqueue_batch_request, 0.5,
+                                        record_demand=redis.record_batch_demand)
+            self.assertEqual([await leader, joined], [False, False])
+            self.assertFalse(await redis.exists(*keys))
+            self.assertEqual(await redis.pop_batch_requests(5), [])
+        finally:
+            await flights.close()
+            await redis.delete(*keys)
+            await redis.aclose()
+
+
+@mock.patch('apps.cmc_proxy.utils.CMC_SUPPLEMENT_POOL_KEY', 'cmc:test:supplement_pool')
+class SupplementPoolTestCase(SimpleTestCase):
+    """补充池整体替换"""
+
+    def test_rebuild_replaces_pool_atomically(self):
+        asyncio.run(self._check_rebuild())
+
+    async def _check_rebuild(self):
+        redis = await CMCRedisClient.create(settings.REDIS_CMC_URL)
+        try:
+            await redis.update_supplement_pool([
+                {'id': i, 'quote': {'USD': {'market_cap': i * 10}}} for i in range(1, 6)])
+            self.assertEqual(await redis.get_from_supplement_pool(3), ['5', '4', '3'])
+
+            await redis.update_supplement_pool([{'id': 7, 'quote': {'USD': {'market_cap': 1}}}])
+            self.assertEqual(await redis.get_from_supplement_pool(10), ['7'])
+            self.assertEqual(await redis.keys('cmc:test:supplement_pool:rebuild:*'), [])
+        finally:
+            await redis.delete('cmc:test:supplement_pool')
+            await redis.aclose()
+
+
+class QuoteCodecTestCase(SimpleTestCase):
+    """cmc:quote_data 编解码"""
+
+    QUOTE = {
+        'id': 1, 'name': 'Bitcoin', 'symbol': 'BTC', 'slug': 'bitcoin', 'cmc_rank': 1, 'tags': ['mineable'],
+        'circulating_supply': 19_000_000, 'last_updated': '2025-01-01T00:00:00.000Z', 'is_active': 1,
+        'quote': {'USD': {'price': 65000.5, 'market_cap': 1.2e12, 'volume_24h': 3.1e10, 'percent_change_24h': -1.5}},
+    }
+
+    def test_every_version_stays_readable(self):
+        legacy = json.dumps(self.QUOTE)
+        self.assertEqual(decode_quote(legacy), self.QUOTE)
+        self.assertEqual(decode_quote(encode_quote(self.QUOTE, codec='j1').decode()), self.QUOTE)
+
+        projected = decode_quote(encode_quote(self.QUOTE, codec='p1'))
+        self.assertNotIn('is_active', projected)
+        self.assertEqual(projected['symbol'], 'BTC')
+        self.assertEqual(projected['tags'], ['mineable'])
+        self.assertEqual(projected['quote']['USD']['price'], 65000.5)
+        self.assertNotIn('tvl', projected['quote']['USD'])
+
+        with self.assertRaises(ValueError):
+            decode_quote('zz|[]')
+
+    def test_missing_keys_stay_missing(self):
+        quote = {key: value for key, value in self.QUOTE.items() if key not in ('tags', 'infinite_supply')}
+        quote['quote'] = {'USD': {'price': 1.5}}
+        projected = decode_quote(encode_quote(quote, codec='p1'))
+        self.assertNotIn('tags', projected)
+        self.assertNotIn('infinite_supply', projected)
+        self.assertEqual(projected['quote']['USD'], {'price': 1.5})
+        self.assertEqual(decode_quote(encode_quote(self.QUOTE, codec='p1'))['tags'], ['mineable'])
+
+        for malformed in ('p1|1', 'p1|[1]', 'p1|[[1], 2]', 'p1|[[], [], [5], []]', 'p1|{'):
+            with self.assertRaises(ValueError):
+                decode_quote(malformed)
@@ -0,0 +1,152 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from apps.cmc_proxy.helpers import TimeRangeCalculator
+from apps.cmc_proxy.models import CmcAsset, CmcKline, CmcMarketData
+from apps.cmc_proxy.services import CoinMarketCapService
+from apps.cmc_proxy.utils import bump_market_data_generation
+from apps.price_oracle.models import AssetPrice
+
+
+class CmcPagedQueryCountTestCase(TestCase):
+    """分页接口的查询次数应与 page_size 无关"""
+
+    ASSET_COUNT = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        _, end_time, _ = TimeRangeCalculator.calculate_kline_time_range(24)
+        now = timezone.now()
+        for i in range(cls.ASSET_COUNT):
+            asset = CmcAsset.objects.create(cmc_id=100 + i, name=f'Token {i}', symbol=f'TK{i}')
+            CmcMarketData.objects.create(
+                asset=asset, timestamp=now, price_usd=Decimal('1.5'), market_cap=Decimal(1000 + i),
+                volume_24h=Decimal(500 + i), cmc_rank=i + 1,
+            )
+            for hours_ago in (1, 2, 3):
+                CmcKline.objects.create(
+                    asset=asset, timeframe='1h', timestamp=end_time - timedelta(hours=hours_ago),
+                    open=Decimal('1'), high=Decimal('2'), low=Decimal('0.5'), close=Decimal('1.5'),
+                    volume=Decimal('10'),
+                )
+            if i % 2 == 0:
+                AssetPrice.objects.create(
+                    base_asset=f'TK{i}', cmc_asset=asset, symbol=f'TK{i}/USDT', quote_asset='USDT',
+                    exchange='binance', price=Decimal('1.6'), price_timestamp=now,
+                )
+
+    def setUp(self):
+        # 使上一次运行留在 Redis 里的分页缓存失效
+        bump_market_data_generation()
+
+    def _get(self, path, expected_queries):
+        with self.assertNumQueries(expected_queries):
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['result']
+
+    def test_paged_market_data_query_count(self):
+        # count + page + klines + asset prices
+        small = self._get('/api/v1/cmc/market-data?page=1&page_size=5', 4)
+        large = self._get(f'/api/v1/cmc/market-data?page=1&page_size={self.ASSET_COUNT}', 4)
+
+        self.assertEqual(len(small['results']), 5)
+        self.assertEqual(len(large['results']), self.ASSET_COUNT)
+        for item in large['results']:
+            self.assertEqual(len(item['klines']), 3)
+            self.assertEqual(item['high_24h'], 2.0)
+            expected_source = 'ccxt' if (item['cmc_id'] - 100) % 2 == 0 else 'cmc'
+            self.assertEqual(item['price_source'], expected_source)
+
+    def test_paged_market_data_served_from_page_cache(self):
+        path = '/api/v1/cmc/market-data?page=2&page_size=5'
+        first = self._get(path, 4)
+        cached = self._get(path, 0)
+        self.assertEqual(first, cached)
+
+        bump_market_data_generation()
+        rebuilt = self._get(path, 4)
+        self.assertEqual(first, rebuilt)
+
+    def test_multiple_market_data_query_count(self):
+        ids = ','.join(str(100 + i) for i in range(self.ASSET_COUNT))
+        # page + klines + asset prices
+        result = self._get(f'/api/v1/cmc/market-data?cmc_ids={ids}', 3)
+        self.assertEqual(len(result['results']), self.ASSET_COUNT)
+
+    def test_paged_klines_query_count(self):
+        # count + page + klines
+        small = self._get('/api/v1/cmc/klines?page=1&page_size=5', 3)
+        large = self._get(f'/api/v1/cmc/klines?page=1&page_size={self.ASSET_COUNT}', 3)
+
+        self.assertEqual(len(small['results']), 5)
+        self.assertEqual([item['cmc_id'] for item in large['results']], [100 + i for i in range(self.ASSET_COUNT)])
+        self.assertTrue(all(len(item['klines']) == 3 for item in large['results']))
+
+
+class CmcKlinesBackfillQueryCountTestCase(TestCase):
+    """数据库中没有K线的资产一起回填，查询次数仍与 page_size 无关"""
+
+    ASSET_COUNT = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        _, cls.end_time, _ = TimeRangeCalculator.calculate_kline_time_range(24)
+        now = timezone.now()
+        for i in range(cls.ASSET_COUNT):
+            asset = CmcAsset.objects.create(cmc_id=200 + i, name=f'Token {i}', symbol=f'BF{i}')
+            CmcMarketData.objects.create(
+                asset=asset, timestamp=now, price_usd=Decimal('1.5'), market_cap=Decimal(1000 - i), cmc_rank=i + 1,
+            )
+            # 只有前两个资产已有K线
+            if i < 2:
+                CmcKline.objects.create(
+                    asset=asset, timeframe='1h', timestamp=cls.end_time - timedelta(hours=1),
+                    open=Decimal('1'), high=Decimal('2'), low=Decimal('0.5'), close=Decimal('1.5'),
+                    volume=Decimal('10'),
+                )
+
+    def setUp(self):
+        bump_market_data_generation()
+        self.requested = []
+        patcher = mock.patch.object(CoinMarketCapService, 'fetch_and_store_klines_batch', self._fake_fetch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def _fake_fetch(self, cmc_ids, count=1, **kwargs):
+        # 与真实实现相同：一次查询资产，一次批量写入
+        self.requested.append(sorted(cmc_ids))
+        assets = [asset async for asset in CmcAsset.objects.filter(cmc_id__in=cmc_ids)]
+        await CmcKline.objects.abulk_create([
+            CmcKline(asset=asset, timeframe='1h', timestamp=self.end_time - timedelta(hours=2), open=Decimal('1'),
+                     high=Decimal('3'), low=Decimal('0.5'), close=Decimal('1.5'), volume=Decimal('10'))
+            for asset in assets
+        ])
+        return {'success': len(assets), 'failed': 0, 'total_klines': len(assets)}
+
+    def _get(self, path, expected_queries):
+        with self.assertNumQueries(expected_queries):
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['result']
+
+    def test_missing_klines_are_backfilled_in_one_batch(self):
+        # count + page + klines + 回填（资产 + 批量写入） + 重新读取缺失的资产 + asset prices
+        some = self._get('/api/v1/cmc/market-data?page=1&page_size=5', 7)
+        self.assertEqual(self.requested, [[202, 203, 204]])
+        self.assertTrue(all(item['klines'] for item in some['results']))
+
+        # 整页都没有K线
+        none = self._get('/api/v1/cmc/market-data?page=2&page_size=5', 7)
+        self.assertEqual(self.requested[1], [205, 206, 207, 208, 209])
+        self.assertTrue(all(item['klines'][0]['high'] == 3.0 for item in none['results']))
+
+        # 回填后不再请求CMC
+        self._get('/api/v1/cmc/market-data?page=2&page_size=5', 0)
+        bump_market_data_generation()
+        self._get(f'/api/v1/cmc/market-data?page=1&page_size={self.ASSET_COUNT}', 4)
+        self.assertEqual(len(self.requested), 2)
@@ -19,7 +19,7 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "skyeye.settings")
 django.setup()
 from django.conf import settings
 
-from apps.cmc_proxy.consts import CMC_BATCH_REQUESTS_PENDING_KEY
+from apps.cmc_proxy.consts import CMC_BATCH_REQUESTS_PENDING_KEY, CMC_BATCH_REQUESTS_DEMAND_KEY
 from apps.cmc_proxy.services import CoinMarketCapClient, get_cmc_service
 from apps.cmc_proxy.utils import CMCRedisClient
 from common.redis_client import get_async_redis_client
@@ -123,11 +123,11 @@ class CMCServiceTester:
             print(f"Redis 连接状态: {'正常' if ping_result else '异常'}")
 
             # 检查待处理请求队列
-            pending_count = await self.redis_client.llen(CMC_BATCH_REQUESTS_PENDING_KEY)
+            pending_count = await self.redis_client.zcard(CMC_BATCH_REQUESTS_PENDING_KEY)
             print(f"当前待处理请求数量: {pending_count}")
             if pending_count > 0:
-                pending_items = await self.redis_client.lrange(CMC_BATCH_REQUESTS_PENDING_KEY, 0, 5)
-                print(f"前5个待处理请求: {pending_items}")
+                pending_items = await self.redis_client.zrevrange(CMC_BATCH_REQUESTS_DEMAND_KEY, 0, 4, withscores=True)
+                print(f"请求次数最多的5个待处理请求: {pending_items}")
         except Exception as e:
             print(f"Redis操作测试出错: {e}")
 
@@ -1,9 +1,22 @@
-import json
-from typing import Optional, List, Dict, Any
+import asyncio
+import hashlib
+import math
+import time
+import uuid
+import weakref
+from typing import Optional, List, Dict, Any, Iterable, Callable, Awaitable
 
+import redis
 import redis.asyncio as aioredis
+from django.conf import settings
 
-from apps.cmc_proxy.consts import CMC_QUOTE_DATA_KEY, CMC_SUPPLEMENT_POOL_KEY
+from apps.cmc_proxy.consts import CMC_QUOTE_DATA_KEY, CMC_SUPPLEMENT_POOL_KEY, CMC_QUOTE_READY_CHANNEL, \
+    CMC_BATCH_REQUESTS_PENDING_KEY, CMC_BATCH_REQUESTS_DEMAND_KEY, CMC_BATCH_REQUEST_MAX_PENDING_SECONDS, \
+    CMC_T1_MERGE_WINDOW_SECONDS, CMC_MARKET_DATA_GENERATION_KEY, CMC_MARKET_DATA_PAGE_KEY, \
+    CMC_MARKET_DATA_PAGE_LOCK_KEY, CMC_MARKET_DATA_PAGE_TTL, CMC_MARKET_DATA_PAGE_REBUILD_LOCK_TTL, \
+    CMC_MARKET_DATA_PAGE_REBUILD_WAIT_SECONDS, CMC_N1, CMC_CREDIT_BUDGETS, CMC_CREDIT_BACKGROUND_RESERVE_RATIO, \
+    CMC_CREDIT_USER_ACQUIRE_TIMEOUT, CMC_CREDIT_BACKGROUND_ACQUIRE_TIMEOUT, CMC_CREDIT_BUCKET_KEY, CMC_CREDIT_SPEND_KEY
+from apps.cmc_proxy.quote_codec import decode_quote, encode_quote
 from common.helpers import getLogger
 from common.redis_client import get_async_redis_client
 
@@ -13,6 +26,27 @@ logger = getLogger(__name__)
 class CMCRedisClient(aioredis.Redis):
     """CoinMarketCap专用Redis客户端，处理代币数据缓存和检索"""
 
+    # 先取等待过久的ID，再按请求次数从高到低补满，取出的ID同时从两个有序集合中移除
+    POP_BATCH_REQUESTS_SCRIPT = """
+    local count = tonumber(ARGV[1])
+    local picked = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[2], 'LIMIT', 0, count)
+    if #picked < count then
+        local seen = {}
+        for _, id in ipairs(picked) do seen[id] = true end
+        for _, id in ipairs(redis.call('ZREVRANGE', KEYS[2], 0, count + #picked - 1)) do
+            if #picked >= count then break end
+            if not seen[id] then
+                picked[#picked + 1] = id
+            end
+        end
+    end
+    if #picked > 0 then
+        redis.call('ZREM', KEYS[1], unpack(picked))
+        redis.call('ZREM', KEYS[2], unpack(picked))
+    end
+    return picked
+    """
+
     @classmethod
     async def create(cls, redis_url: str):
         """创建CMCRedisClient实例的工厂方法"""
@@ -27,10 +61,25 @@ class CMCRedisClient(aioredis.Redis):
         """缓存代币报价数据"""
         try:
             key = CMC_QUOTE_DATA_KEY % {"symbol_id": symbol_id}
-            await self.set(key, json.dumps(data), ex=ttl)
+            await self.set(key, encode_quote(data), ex=ttl)
         except Exception as e:
             logger.error(f"Failed to cache token quote data for {symbol_id}: {e}", exc_info=True)
 
+    async def cache_token_quotes(self, tokens_data: Iterable[Dict[str, Any]], ttl: int) -> int:
+        """通过一个 pipeline 批量缓存一页代币报价数据（按 CMC_QUOTE_CODEC 编码），返回写入数量"""
+        count = 0
+        try:
+            async with self.pipeline(transaction=False) as pipe:
+                for token_data in tokens_data:
+                    pipe.set(CMC_QUOTE_DATA_KEY % {"symbol_id": token_data['id']}, encode_quote(token_data), ex=ttl)
+                    count += 1
+                if count:
+                    await pipe.execute()
+            return count
+        except Exception as e:
+            logger.error(f"Failed to cache {count} token quotes: {e}", exc_info=True)
+            return 0
+
     async def get_token_quote_data(self, symbol_id: str) -> Optional[Dict[str, Any]]:
         """获取缓存的代币报价数据"""
         if not symbol_id:
@@ -41,14 +90,57 @@ class CMCRedisClient(aioredis.Redis):
             data = await self.get(key)
             if data:
                 try:
-                    return json.loads(data)
-                except json.JSONDecodeError as e:
+                    return decode_quote(data)
+                except ValueError as e:
                     logger.error(f"Failed to decode JSON data for {key}: {e}")
             return None
         except Exception as e:
             logger.error(f"Error getting token quote data for {symbol_id}: {e}", exc_info=True)
             return None
 
+    async def publish_quote_ready(self, symbol_ids: Iterable[str]) -> None:
+        """通知所有订阅者这些代币的报价已写入缓存（或本轮批处理已结束）"""
+        payload = ','.join(str(symbol_id) for symbol_id in symbol_ids)
+        if not payload:
+            return
+
+        try:
+            await self.publish(CMC_QUOTE_READY_CHANNEL, payload)
+        except Exception as e:
+            logger.error(f"Failed to publish quote ready notification: {e}", exc_info=True)
+
+    async def enqueue_batch_request(self, symbol_id: str) -> None:
+        """
+        将代币ID加入待处理批次：首次请求时间只在第一次入队时记录，请求次数每次加一。
+        两个操作都是 O(log N)，与队列长度无关。
+        """
+        async with self.pipeline(transaction=False) as pipe:
+            pipe.zadd(CMC_BATCH_REQUESTS_PENDING_KEY, {symbol_id: time.time()}, nx=True)
+            pipe.zincrby(CMC_BATCH_REQUESTS_DEMAND_KEY, 1, symbol_id)
+            await pipe.execute()
+
+    async def record_batch_demand(self, symbol_id: str) -> None:
+        """
+        合并到已有 flight 的请求只增加请求次数，首次请求时间由 flight 的第一个请求记录。
+        只给仍在队列中的ID计数（XX），已被批处理取出的ID不会重新入队、重复消耗额度。
+        """
+        await self.zadd(CMC_BATCH_REQUESTS_DEMAND_KEY, {symbol_id: 1}, xx=True, incr=True)
+
+    async def pop_batch_requests(self, count: int) -> List[str]:
+        """原子地取出最多 count 个待处理ID：等待过久的优先，其余按请求次数从高到低"""
+        overdue_before = time.time() - CMC_BATCH_REQUEST_MAX_PENDING_SECONDS
+        return await self.eval(
+            self.POP_BATCH_REQUESTS_SCRIPT, 2,
+            CMC_BATCH_REQUESTS_PENDING_KEY, CMC_BATCH_REQUESTS_DEMAND_KEY, count, overdue_before,
+        )
+
+    async def bump_market_data_generation(self) -> None:
+        """使所有已缓存的分页行情响应失效"""
+        try:
+            await self.incr(CMC_MARKET_DATA_GENERATION_KEY)
+        except Exception as e:
+            logger.error(f"Failed to bump market data generation: {e}", exc_info=True)
+
     async def update_supplement_pool(self, tokens_data_list: List[Dict[str, Any]]) -> None:
         """更新补充池"""
         if not tokens_data_list:
@@ -66,17 +158,20 @@ class CMCRedisClient(aioredis.Redis):
                 except (TypeError, ValueError) as e:
                     logger.error(f"Error processing token data for supplement pool: {e}")
 
-            # 清空现有的补充池
-            await self.delete(CMC_SUPPLEMENT_POOL_KEY)
+            if not token_ids_with_market_cap:
+                await self.delete(CMC_SUPPLEMENT_POOL_KEY)
+                return
 
-            # 添加新的数据
-            if token_ids_with_market_cap:
-                # 按市值降序排序
-                token_ids_with_market_cap.sort(key=lambda x: x[1], reverse=True)
+            # 按市值降序排序，以名次作为分数，ZRANGE 从市值最高的开始返回
+            token_ids_with_market_cap.sort(key=lambda x: x[1], reverse=True)
+            mapping = {token_id: i for i, (token_id, _) in enumerate(token_ids_with_market_cap)}
 
-                # 添加到有序集合
-                for i, (token_id, market_cap) in enumerate(token_ids_with_market_cap):
-                    await self.zadd(CMC_SUPPLEMENT_POOL_KEY, {token_id: -i})  # 使用负索引作为分数，确保排序
+            # 先一次性写入临时键再原子替换，读取方不会看到空的或写了一半的补充池
+            temp_key = f"{CMC_SUPPLEMENT_POOL_KEY}:rebuild:{uuid.uuid4().hex}"
+            async with self.pipeline(transaction=True) as pipe:
+                pipe.zadd(temp_key, mapping)
+                pipe.rename(temp_key, CMC_SUPPLEMENT_POOL_KEY)
+                await pipe.execute()
         except Exception as e:
             logger.error(f"Failed to update supplement pool: {e}", exc_info=True)
 
@@ -94,6 +189,373 @@ class CMCRedisClient(aioredis.Redis):
             return []
 
 
+class QuoteSingleFlight:
+    """
+    缓存未命中的单飞（single-flight）合并层：
+    - 进程内：同一 cmc_id 的并发未命中共享一个 Future，只有第一个请求会入队，
+      其余请求只记录请求次数，供批处理按需求排序
+    - 跨进程：批处理任务写入报价后在 CMC_QUOTE_READY_CHANNEL 上发布 cmc_id，
+      每个工作进程的订阅协程收到通知后立即唤醒等待者，无需固定时长轮询
+    """
+
+    def __init__(self, redis_client: aioredis.Redis):
+        self._redis = redis_client
+        self._flights: Dict[str, asyncio.Future] = {}
+        # flight 的第一个请求入队完成前，合并进来的请求在这里等待，之后再记录请求次数
+        self._enqueuing: Dict[str, asyncio.Event] = {}
+        self._listener_task: Optional[asyncio.Task] = None
+        self._subscribed: Optional[asyncio.Event] = None
+
+    async def wait(self, symbol_id: str, enqueue: Callable[[str], Awaitable[None]], timeout: float,
+                   record_demand: Optional[Callable[[str], Awaitable[None]]] = None) -> bool:
+        """
+        等待 symbol_id 的报价写入缓存。
+
+        Args:
+            symbol_id: 代币ID
+            enqueue: 把代币ID加入待处理批次的协程函数，每个 flight 只调用一次
+            timeout: 最长等待时间（秒），由同一 flight 的所有等待者共享
+            record_demand: 合并到已有 flight 的等待者调用的协程函数，记录一次请求
+
+        Returns:
+            收到就绪通知返回 True；超时或回退到固定窗口时返回 False
+        """
+        flight = self._flights.get(symbol_id)
+        if flight is None:
+            loop = asyncio.get_running_loop()
+            flight = loop.create_future()
+            self._flights[symbol_id] = flight
+            loop.call_later(timeout, self._expire, symbol_id, flight)
+            self._enqueuing[symbol_id] = asyncio.Event()
+            try:
+                if await self._ensure_listener():
+                    await self._enqueue(symbol_id, enqueue)
+                    # 订阅之前数据可能已经写入，补查一次避免错过通知
+                    if await self._redis.exists(CMC_QUOTE_DATA_KEY % {"symbol_id": symbol_id}):
+                        self._resolve([symbol_id], True)
+                else:
+                    # 订阅不可用时回退到固定合并窗口
+                    await self._enqueue(symbol_id, enqueue)
+                    await asyncio.sleep(CMC_T1_MERGE_WINDOW_SECONDS)
+                    self._resolve([symbol_id], False)
+            except Exception:
+                self._resolve([symbol_id], False)
+                raise
+            finally:
+                # 入队失败或被取消时也要放行合并进来的请求
+                self._enqueued(symbol_id)
+        elif record_demand is not None:
+            enqueuing = self._enqueuing.get(symbol_id)
+            try:
+                if enqueuing is not None:
+                    await enqueuing.wait()
+                await record_demand(symbol_id)
+            except Exception as e:
+                logger.warning(f"Failed to record batch demand for {symbol_id}: {e}")
+
+        return await asyncio.shield(flight)
+
+    async def _enqueue(self, symbol_id: str, enqueue: Callable[[str], Awaitable[None]]) -> None:
+        try:
+            await enqueue(symbol_id)
+        finally:
+            self._enqueued(symbol_id)
+
+    def _enqueued(self, symbol_id: str) -> None:
+        enqueuing = self._enqueuing.pop(symbol_id, None)
+        if enqueuing is not None:
+            enqueuing.set()
+
+    async def close(self) -> None:
+        """停止订阅协程并唤醒所有等待者"""
+        if self._listener_task and not self._listener_task.done():
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._listener_task = None
+        self._resolve(list(self._flights.keys()), False)
+
+    async def _ensure_listener(self) -> bool:
+        if self._listener_task is None or self._listener_task.done():
+            self._subscribed = asyncio.Event()
+            self._listener_task = asyncio.create_task(self._listen())
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout=CMC_T1_MERGE_WINDOW_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning("Quote ready listener not subscribed in time, falling back to fixed merge window")
+            return False
+        return not self._listener_task.done()
+
+    async def _listen(self) -> None:
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(CMC_QUOTE_READY_CHANNEL)
+            self._subscribed.set()
+            async for message in pubsub.listen():
+                if message.get('type') != 'message':
+                    continue
+                self._resolve(message['data'].split(','), True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Quote ready listener stopped: {e}", exc_info=True)
+        finally:
+            self._subscribed.set()
+            # 监听中断时唤醒所有等待者，让它们直接读取缓存
+            self._resolve(list(self._flights.keys()), False)
+            try:
+                await pubsub.aclose()
+            except Exception as e:
+                logger.debug(f"Error closing quote ready pubsub: {e}")
+
+    def _resolve(self, symbol_ids: Iterable[str], ready: bool) -> None:
+        for symbol_id in symbol_ids:
+            flight = self._flights.pop(symbol_id, None)
+            if flight is not None and not flight.done():
+                flight.set_result(ready)
+
+    def _expire(self, symbol_id: str, flight: asyncio.Future) -> None:
+        if self._flights.get(symbol_id) is flight:
+            del self._flights[symbol_id]
+        if not flight.done():
+            flight.set_result(False)
+
+
+def bump_market_data_generation() -> None:
+    """同步版本的代数递增，供 persist_prices 等同步代码调用"""
+    client = None
+    try:
+        client = redis.Redis.from_url(settings.REDIS_CMC_URL, socket_connect_timeout=5)
+        client.incr(CMC_MARKET_DATA_GENERATION_KEY)
+    except Exception as e:
+        logger.error(f"Failed to bump market data generation: {e}", exc_info=True)
+    finally:
+        if client:
+            client.close()
+
+
+class MarketDataPageCache:
+    """
+    预渲染的分页行情响应缓存。
+
+    页面主体与写入时的代数一起存放在同一个键中（"<generation>\\n<body>"），
+    读取时用一次 MGET 同时取回当前代数和页面，代数一致即命中。
+    同步任务递增代数后旧页面自然失效；只有拿到重建锁的进程会重建页面，
+    其他进程在此期间直接返回上一代的页面，没有旧页面时短暂等待重建结果。
+    """
+
+    def __init__(self, redis_client: aioredis.Redis):
+        self._redis = redis_client
+
+    @staticmethod
+    def page_params(**params) -> str:
+        return ':'.join(f"{name}={params[name]}" for name in sorted(params))
+
+    async def get_or_build(self, params: str, builder: Callable[[], Awaitable[str]]) -> str:
+        page_key = CMC_MARKET_DATA_PAGE_KEY % {"params": params}
+        try:
+            generation, cached = await self._read(page_key)
+        except Exception as e:
+            logger.warning(f"Market data page cache unavailable, building {params} directly: {e}")
+            return await builder()
+
+        cached_generation, body = cached if cached else (None, None)
+        if cached_generation == generation:
+            return body
+
+        lock_key = CMC_MARKET_DATA_PAGE_LOCK_KEY % {"params": params}
+        deadline = time.monotonic() + CMC_MARKET_DATA_PAGE_REBUILD_WAIT_SECONDS
+        while True:
+            lock_value = str(uuid.uuid4())
+            if await self._redis.set(lock_key, lock_value, ex=CMC_MARKET_DATA_PAGE_REBUILD_LOCK_TTL, nx=True):
+                try:
+                    body = await builder()
+                    await self._redis.set(page_key, f"{generation}\n{body}", ex=CMC_MARKET_DATA_PAGE_TTL)
+                    return body
+                finally:
+                    await release_lock(self._redis, lock_key, lock_value)
+
+            # 其他进程正在重建：有旧页面就先返回旧页面
+            if body is not None:
+                return body
+            if time.monotonic() >= deadline:
+                logger.warning(f"Timed out waiting for market data page {params} rebuild, building directly")
+                return await builder()
+
+            await asyncio.sleep(0.05)
+            generation, cached = await self._read(page_key)
+            if cached and cached[0] == generation:
+                return cached[1]
+
+    async def _read(self, page_key: str):
+        generation, raw = await self._redis.mget(CMC_MARKET_DATA_GENERATION_KEY, page_key)
+        generation = generation or '0'
+        if not raw:
+            return generation, None
+        cached_generation, _, body = raw.partition('\n')
+        return generation, (cached_generation, body)
+
+
+_page_caches: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, MarketDataPageCache]" = weakref.WeakKeyDictionary()
+
+
+def get_market_data_page_cache() -> MarketDataPageCache:
+    """获取当前事件循环对应的分页响应缓存实例"""
+    loop = asyncio.get_running_loop()
+    page_cache = _page_caches.get(loop)
+    if page_cache is None:
+        page_cache = MarketDataPageCache(get_async_redis_client(settings.REDIS_CMC_URL))
+        _page_caches[loop] = page_cache
+    return page_cache
+
+
+class CMCCreditBudgetExhausted(Exception):
+    """在等待时间内没有拿到足够的 CMC credit"""
+
+
+def cmc_credit_cost(endpoint: str, params: dict) -> int:
+    """按 CMC 的计费规则估算一次调用消耗的 credit"""
+    ids = [i for i in str(params.get('id', '')).split(',') if i]
+    if endpoint.endswith('/listings/latest'):
+        # 每返回 200 个币种 1 credit
+        return max(1, math.ceil(int(params.get('limit') or CMC_N1) / 200))
+    if endpoint.endswith('/quotes/latest'):
+        # 每 100 个币种 1 credit
+        return max(1, math.ceil(len(ids) / 100))
+    if endpoint.endswith('/ohlcv/historical'):
+        # 每 100 个 OHLCV 数据点 1 credit
+        return max(1, math.ceil(len(ids) * int(params.get('count', 1)) / 100))
+    return 1
+
+
+class CreditBudget:
+    """
+    Redis 令牌桶形式的 CMC credit 预算，同一个 API Key 的所有进程共用一个桶。
+
+    后台任务只能使用桶中高于保留额度的部分，预算紧张时自动让位于用户请求；
+    每日消耗、调用次数和被限流次数记录在按天划分的计数器中。
+    """
+
+    ACQUIRE_SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local cost = tonumber(ARGV[3])
+    local reserve = tonumber(ARGV[4])
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    if tokens - cost >= reserve then
+        tokens = tokens - cost
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+        redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+        redis.call('HINCRBYFLOAT', KEYS[2], 'credits', cost)
+        redis.call('HINCRBY', KEYS[2], 'calls', 1)
+        redis.call('EXPIRE', KEYS[2], 172800)
+        return {1, tostring(tokens)}
+    end
+    if ARGV[5] == '1' then
+        redis.call('HINCRBY', KEYS[2], 'throttled', 1)
+        redis.call('EXPIRE', KEYS[2], 172800)
+    end
+    return {0, tostring((cost + reserve - tokens) / rate)}
+    """
+
+    def __init__(self, redis_client: aioredis.Redis, api_key: str, name: str):
+        self._redis = redis_client
+        self.name = name
+        config = CMC_CREDIT_BUDGETS[name]
+        self.capacity = float(config['capacity'])
+        self.refill_per_second = float(config['refill_per_second'])
+        self.key_id = self.key_id_for(api_key)
+        self._script = redis_client.register_script(self.ACQUIRE_SCRIPT)
+
+    @staticmethod
+    def key_id_for(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+    async def acquire(self, cost: int, background: bool = False) -> float:
+        """
+        扣除 cost 个 credit，不足时等待补充，返回等待的秒数。
+
+        Raises:
+            CMCCreditBudgetExhausted: 超过等待上限仍未拿到 credit
+        """
+        reserve = self.capacity * CMC_CREDIT_BACKGROUND_RESERVE_RATIO if background else 0
+        # 单次消耗超过可用容量时按可用容量扣除，否则永远拿不到
+        cost = min(cost, self.capacity - reserve)
+        timeout = CMC_CREDIT_BACKGROUND_ACQUIRE_TIMEOUT if background else CMC_CREDIT_USER_ACQUIRE_TIMEOUT
+        started = time.monotonic()
+        first_attempt = True
+        while True:
+            try:
+                granted, value = await self._script(
+                    keys=[CMC_CREDIT_BUCKET_KEY % {"key_id": self.key_id},
+                          CMC_CREDIT_SPEND_KEY % {"key_id": self.key_id, "date": time.strftime('%Y%m%d', time.gmtime())}],
+                    args=[self.capacity, self.refill_per_second, cost, reserve, '1' if first_attempt else '0'],
+                )
+            except Exception as e:
+                # 预算服务不可用时不阻塞 CMC 调用
+                logger.error(f"CMC credit budget unavailable, proceeding without it: {e}", exc_info=True)
+                return 0.0
+
+            waited = time.monotonic() - started
+            if int(granted):
+                if waited > 0.5:
+                    logger.info(f"CMC credit budget '{self.name}' granted {cost} credits after waiting {waited:.1f}s")
+                return waited
+
+            first_attempt = False
+            wait = float(value)
+            if waited + wait > timeout:
+                raise CMCCreditBudgetExhausted(
+                    f"CMC credit budget '{self.name}' exhausted: {cost} credits not available within {timeout}s")
+            logger.debug(f"CMC credit budget '{self.name}' tight, waiting {wait:.1f}s for {cost} credits")
+            await asyncio.sleep(wait)
+
+
+def get_cmc_credit_metrics() -> Dict[str, Dict[str, Any]]:
+    """读取各 API Key 的 credit 余量和当日消耗，供健康检查使用"""
+    klines_key = getattr(settings, 'COINMARKETCAP_API_KEY', None)
+    budgets = {'klines': klines_key, 'external': getattr(settings, 'COINMARKETCAP_API_KEY_EXTERNAL', None) or klines_key}
+    metrics = {}
+    client = None
+    try:
+        client = redis.Redis.from_url(settings.REDIS_CMC_URL, decode_responses=True, socket_connect_timeout=5)
+        seconds, microseconds = client.time()
+        now = seconds + microseconds / 1_000_000
+        for name, api_key in budgets.items():
+            if not api_key:
+                continue
+            config = CMC_CREDIT_BUDGETS[name]
+            key_id = CreditBudget.key_id_for(api_key)
+            state = client.hgetall(CMC_CREDIT_BUCKET_KEY % {"key_id": key_id})
+            spend = client.hgetall(CMC_CREDIT_SPEND_KEY % {"key_id": key_id, "date": time.strftime('%Y%m%d', time.gmtime(now))})
+            tokens = float(state.get('tokens', config['capacity']))
+            if state.get('ts'):
+                tokens = min(config['capacity'], tokens + (now - float(state['ts'])) * config['refill_per_second'])
+            metrics[name] = {
+                'key_id': key_id,
+                'capacity': config['capacity'],
+                'refill_per_second': config['refill_per_second'],
+                'available': round(tokens, 2),
+                'headroom_ratio': round(tokens / config['capacity'], 4),
+                'spent_today': float(spend.get('credits', 0)),
+                'calls_today': int(spend.get('calls', 0)),
+                'throttled_today': int(spend.get('throttled', 0)),
+            }
+    except Exception as e:
+        logger.error(f"Failed to read CMC credit metrics: {e}", exc_info=True)
+    finally:
+        if client:
+            client.close()
+    return metrics
+
+
 async def acquire_lock(redis_client, lock_key, timeout=30, retry_count=3, retry_delay=1.0):
     """获取Redis分布式锁，支持重试机制"""
     import uuid
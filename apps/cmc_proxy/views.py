@@ -1,10 +1,13 @@
 import asyncio
 import math
+
+from django.http import HttpResponse
 from django.views import View
 
 from apps.cmc_proxy.models import CmcAsset, CmcMarketData
-from apps.cmc_proxy.services import get_klines_for_asset, get_latest_market_data
+from apps.cmc_proxy.services import get_klines_for_asset, get_klines_for_assets, get_latest_market_data
 from apps.cmc_proxy.helpers import TimeRangeCalculator, MarketDataFormatter, ViewParameterValidator
+from apps.cmc_proxy.utils import get_market_data_page_cache
 from common.helpers import ok_json, error_json, getLogger, parse_int, PAGE_SIZE
 
 logger = getLogger(__name__)
@@ -75,12 +78,12 @@ class CmcKlinesView(View):
         slice_qs = assets_qs[offset:offset + page_size]
         assets = [asset async for asset in slice_qs]
 
+        klines_by_asset = await get_klines_for_assets(assets, timeframe, start_time, end_time, start_time_24h)
         results = []
         for asset in assets:
-            kline_data = await get_klines_for_asset(asset, timeframe, start_time, end_time, start_time_24h)
             results.append({
                 **MarketDataFormatter.format_asset_info(asset),
-                **kline_data
+                **klines_by_asset[asset.id]
             })
 
         pages = math.ceil(total / page_size) if page_size else 1
@@ -102,6 +105,7 @@ class CmcMarketDataView(View):
     缓存策略：
     - CMC基础数据：10分钟缓存（市值、排名等，节省credit）
     - CCXT价格：实时获取（无缓存，保证时效性）
+    - 分页列表：预渲染响应缓存在Redis，CMC同步或价格落库后递增代数使其失效
     """
 
     async def get(self, request):
@@ -174,38 +178,54 @@ class CmcMarketDataView(View):
 
         qs = CmcMarketData.objects.select_related('asset').filter(asset__cmc_id__in=id_list).order_by('-market_cap')
         items = [item async for item in qs]
-        results = []
-        for item in items:
-            kline_data = await get_klines_for_asset(item.asset, **kline_params)
-            result_item = await MarketDataFormatter.format_market_data_item(item)
-            result_item.update(kline_data)
-            results.append(result_item)
+        results = await self._format_market_data_items(items, **kline_params)
         return ok_json({'results': results})
 
     async def _get_paged_market_data(self, request, **kline_params):
         """
-        处理分页的行情数据列表请求。
+        处理分页的行情数据列表请求，响应体经由页面缓存返回。
         """
         # 解析分页参数
         page = max(1, parse_int(request.GET.get('page', 1), 1))
         page_size = max(1, parse_int(request.GET.get('page_size', PAGE_SIZE), PAGE_SIZE))
 
-        # 分页列表
+        page_cache = get_market_data_page_cache()
+        params = page_cache.page_params(
+            page=page, page_size=page_size, timeframe=kline_params['timeframe'],
+            start=int(kline_params['start_time'].timestamp()), end=int(kline_params['end_time'].timestamp()),
+        )
+        body = await page_cache.get_or_build(
+            params, lambda: self._render_paged_market_data(page, page_size, **kline_params))
+        return HttpResponse(body, content_type='application/json')
+
+    async def _render_paged_market_data(self, page, page_size, **kline_params):
+        """
+        查询并渲染一页行情数据，返回JSON响应体。
+        """
         qs = CmcMarketData.objects.select_related('asset').all().order_by('-volume_24h')
         total = await qs.acount()
         offset = (page - 1) * page_size
         slice_qs = qs[offset:offset + page_size]
         items = [item async for item in slice_qs]
         pages = math.ceil(total / page_size) if page_size else 1
-        results = []
-        for item in items:
-            kline_data = await get_klines_for_asset(item.asset, **kline_params)
-            result_item = await MarketDataFormatter.format_market_data_item(item)
-            result_item.update(kline_data)
-            results.append(result_item)
+        results = await self._format_market_data_items(items, **kline_params)
         return ok_json({
             'page': page,
             'pages': pages,
             'total': total,
             'results': results,
-        })
+        }).content.decode()
+
+    async def _format_market_data_items(self, items, **kline_params):
+        """
+        批量格式化行情数据：K线和CCXT价格各一次查询，查询次数与条目数量无关。
+        """
+        assets = [item.asset for item in items]
+        klines_by_asset = await get_klines_for_assets(assets, **kline_params)
+        ccxt_prices = await MarketDataFormatter.get_ccxt_prices_for_cmc_assets(assets)
+        results = []
+        for item in items:
+            result_item = MarketDataFormatter.build_market_data_item(item, ccxt_prices.get(item.asset.id))
+            result_item.update(klines_by_asset[item.asset.id])
+            results.append(result_item)
+        return results
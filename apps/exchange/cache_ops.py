@@ -1,31 +1,49 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import asyncio
 import json
 import time
-from itertools import groupby
+from decimal import Decimal
 from operator import attrgetter
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
 from asgiref.sync import sync_to_async
 from django.conf import settings
 
 from common.helpers import dec, getLogger
-from common.redis_client import global_redis, local_redis
+from common.log_sampling import HotPathLog
+from common.redis_client import global_redis, local_async_redis, local_redis, register_async_script
 from apps.exchange.consts import (
     EXCHANGE_ORDERBOOKS_KEY,
     EXCHANGE_TICKERS_KEY,
     NRDS_EXCHANGE_ORDERBOOKS_KEY,
+    NRDS_EXCHANGE_ORDERBOOKS_LATEST_KEY,
     NRDS_EXCHANGE_TICKERS_KEY,
+    NRDS_EXCHANGE_TICKERS_LATEST_KEY,
     NRDS_SYMBOL_MERGE_ORDERBOOKS_KEY,
+    NRDS_SYMBOL_MERGE_ORDERBOOKS_LATEST_KEY,
     SYMBOL_MERGE_ORDERBOOKS_KEY,
-    EXCHANGE_BLOCKING
+    EXCHANGE_BLOCKING,
+    EXCHANGE_SNAPSHOT_GLOBAL_MIRROR,
+    MERGED_ORDERBOOK_CROSSED_POLICY,
+    MERGED_ORDERBOOK_DEPTH,
+    MERGED_ORDERBOOK_TICKS,
+    SNAPSHOT_HISTORY_DEFAULT_LIMIT,
+    SNAPSHOT_HISTORY_SECONDS,
 )
 from apps.exchange.exceptions import OrderbookNotFound
 from apps.exchange.models import TradingPair
-from apps.exchange.types import Orderbook, OrderEntry
+from apps.exchange.orderbook_history import HistoryEncoder, HistoryEntry, decode_history, keyframes_key
+from apps.exchange.orderbook_merge import (
+    IncrementalOrderbookMerger, merge_exchange_orderbooks, resolve_crossed,
+)
+from apps.exchange.symbol_exchanges import symbol_exchanges
+from apps.exchange.types import ColumnarOrderbook, Orderbook
 
 logger = getLogger(__name__)
+# 快照读写是爬虫热路径：只累计次数和耗时，逐键日志按周期采样
+hot_log = HotPathLog(logger)
 
 EXCHANGE_BLOCKING_PERIOD = 60 * 5
 
@@ -50,11 +68,161 @@ def get_exchange_account_blocking(exg_name: str, api_account: str):
         return False
 
 
-def set_24ticker(
-        exchange_name: str, symbol: str, data: Dict[str, Any], timeout: int = 120
-) -> None:
-    key = EXCHANGE_TICKERS_KEY % (exchange_name, symbol)
-    zkey = NRDS_EXCHANGE_TICKERS_KEY % (exchange_name, symbol)
+# 快照写入：时间戳不落后时更新 latest 哈希（ts/data），无论是否最新都写入历史有序集合并裁剪过期成员。
+# 增量编码的历史（ARGV[8] == '1'）：差值的基准（ARGV[7]）不是当前最新快照时返回 -1，由调用方改写关键帧；
+# 关键帧分数另存到 KEYS[3]，裁剪时保留窗口起点之前最近的一个关键帧，窗口内的差值始终能还原
+SNAPSHOT_WRITE_SCRIPT = """
+local current = tonumber(redis.call('HGET', KEYS[1], 'ts'))
+if ARGV[7] ~= '' and current ~= tonumber(ARGV[7]) then
+    return -1
+end
+local accepted = 0
+if not current or current <= tonumber(ARGV[2]) then
+    redis.call('HSET', KEYS[1], 'ts', ARGV[2], 'data', ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+    accepted = 1
+end
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[6])
+if ARGV[8] == '1' then
+    if ARGV[7] == '' then
+        redis.call('ZADD', KEYS[3], ARGV[3], ARGV[2])
+    end
+    local keep = redis.call('ZREVRANGEBYSCORE', KEYS[3], ARGV[4], '-inf', 'WITHSCORES', 'LIMIT', 0, 1)
+    if #keep > 0 then
+        redis.call('ZREMRANGEBYSCORE', KEYS[2], 0, '(' .. keep[2])
+        redis.call('ZREMRANGEBYSCORE', KEYS[3], 0, '(' .. keep[2])
+    end
+else
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], 0, ARGV[4])
+end
+return accepted
+"""
+_snapshot_write_script = local_redis().register_script(SNAPSHOT_WRITE_SCRIPT)
+_snapshot_write_ascript = register_async_script(SNAPSHOT_WRITE_SCRIPT)
+# 订单簿历史的差值编码状态，按有序集合记录本进程写入的上一个快照
+history_encoder = HistoryEncoder()
+
+
+class SnapshotWrite(NamedTuple):
+    latest_key: str
+    zkey: str
+    global_key: Optional[str]  # 兼容旧读取方的 Django cache 键，为空时不同步
+    payload: str
+    timestamp: int  # 毫秒
+    latest_ttl: int
+    history: Optional[HistoryEntry] = None  # 为空时历史成员即 payload（不做增量编码）
+
+
+def _write_script_args(write: SnapshotWrite) -> Dict[str, Any]:
+    # 分数为带毫秒小数的秒级时间戳，按秒查询的窗口不变，同一秒内的差值也能按顺序重放
+    score = write.timestamp / 1000
+    history = write.history
+    return dict(
+        keys=[write.latest_key, write.zkey, keyframes_key(write.zkey)],
+        args=[write.payload, write.timestamp, score, score - SNAPSHOT_HISTORY_SECONDS, write.latest_ttl,
+              history.member if history else write.payload,
+              "" if history is None or history.is_keyframe else history.base_timestamp,
+              "0" if history is None else "1"],
+    )
+
+
+def _rewrite_rejected(writes: List[SnapshotWrite], results: List[int]) -> List[int]:
+    """基准已不是最新快照的差值改写为关键帧，返回需要重新写入的下标"""
+    rejected = [i for i, result in enumerate(results) if result == -1]
+    if rejected:
+        hot_log.record("history_delta_rejected")
+    for i in rejected:
+        history_encoder.reset(writes[i].zkey)
+        writes[i] = writes[i]._replace(history=HistoryEncoder.as_keyframe(writes[i].history, writes[i].payload))
+    return rejected
+
+
+def _finish_writes(writes: List[SnapshotWrite], results: List[int]) -> Tuple[List[bool], Dict[str, str]]:
+    """记录差值基准，返回每个快照是否成为最新快照，以及需要同步到 Django cache 的键值"""
+    accepted = [result == 1 for result in results]
+    for write, ok in zip(writes, accepted):
+        if ok and write.history is not None:
+            history_encoder.commit(write.zkey, write.history)
+    mirrored = {}
+    if EXCHANGE_SNAPSHOT_GLOBAL_MIRROR:
+        mirrored = {write.global_key: write.payload for write, ok in zip(writes, accepted) if ok and write.global_key}
+    return accepted, mirrored
+
+
+def _mirror_global(mirrored: Dict[str, str], global_timeout: Optional[int]) -> None:
+    # 未指定 global_timeout 时沿用缓存的默认过期时间
+    kwargs = {} if global_timeout is None else {"timeout": global_timeout}
+    if len(mirrored) == 1:
+        global_redis().set(*next(iter(mirrored.items())), **kwargs)
+    elif mirrored:
+        global_redis().set_many(mirrored, **kwargs)
+
+
+def write_snapshots(writes: List[SnapshotWrite], global_timeout: Optional[int] = None) -> List[bool]:
+    """
+    执行快照写入脚本，多个快照放进同一个 pipeline。
+
+    Returns:
+        每个快照是否成为最新快照
+    """
+    if not writes:
+        return []
+
+    def execute(batch: List[SnapshotWrite]) -> List[int]:
+        redis = local_redis()
+        if len(batch) == 1:
+            return [_snapshot_write_script(**_write_script_args(batch[0]), client=redis)]
+        pipe = redis.pipeline(transaction=False)
+        for write in batch:
+            _snapshot_write_script(**_write_script_args(write), client=pipe)
+        return pipe.execute()
+
+    results = execute(writes)
+    rejected = _rewrite_rejected(writes, results)
+    if rejected:
+        for i, result in zip(rejected, execute([writes[i] for i in rejected])):
+            results[i] = result
+    accepted, mirrored = _finish_writes(writes, results)
+    _mirror_global(mirrored, global_timeout)
+    return accepted
+
+
+async def awrite_snapshots(writes: List[SnapshotWrite], global_timeout: Optional[int] = None) -> List[bool]:
+    """write_snapshots 的异步版本，走 redis.asyncio 连接池；Django cache 的同步写入放到线程池"""
+    if not writes:
+        return []
+
+    async def execute(batch: List[SnapshotWrite]) -> List[int]:
+        redis = local_async_redis()
+        if len(batch) == 1:
+            return [await _snapshot_write_ascript(**_write_script_args(batch[0]), client=redis)]
+        async with redis.pipeline(transaction=False) as pipe:
+            for write in batch:
+                await _snapshot_write_ascript(**_write_script_args(write), client=pipe)
+            return await pipe.execute()
+
+    results = await execute(writes)
+    rejected = _rewrite_rejected(writes, results)
+    if rejected:
+        for i, result in zip(rejected, await execute([writes[i] for i in rejected])):
+            results[i] = result
+    accepted, mirrored = _finish_writes(writes, results)
+    if mirrored:
+        await sync_to_async(_mirror_global, thread_sensitive=False)(mirrored, global_timeout)
+    return accepted
+
+
+def _get_latest_payload(latest_key: str) -> Optional[Dict[str, Any]]:
+    data = local_redis().hget(latest_key, "data")
+    return json.loads(data) if data else None
+
+
+async def _aget_latest_payload(latest_key: str) -> Optional[Dict[str, Any]]:
+    data = await local_async_redis().hget(latest_key, "data")
+    return json.loads(data) if data else None
+
+
+def _ticker_write(exchange_name: str, symbol: str, data: Dict[str, Any], timeout: int) -> SnapshotWrite:
     if "timestamp" not in data or data["timestamp"] is None:
         tmstp = int(time.time() * 1000)
         data["timestamp"] = tmstp
@@ -66,45 +234,69 @@ def set_24ticker(
     assert current_time_seconds - 300 < tmstp_seconds < current_time_seconds + 300, \
         f"incorrect timestamp {tmstp} (seconds: {tmstp_seconds}), current time {current_time_seconds}"
 
-    tsmp_score = int(tmstp_seconds)
-    ticker_json = json.dumps(data)
-    tiker_map = {ticker_json: tsmp_score}
+    return SnapshotWrite(
+        latest_key=NRDS_EXCHANGE_TICKERS_LATEST_KEY % (exchange_name, symbol),
+        zkey=NRDS_EXCHANGE_TICKERS_KEY % (exchange_name, symbol),
+        global_key=EXCHANGE_TICKERS_KEY % (exchange_name, symbol),
+        payload=json.dumps(data),
+        timestamp=tmstp,
+        latest_ttl=timeout,
+    )
 
-    redis_local = local_redis()
-    redis_global = global_redis()
 
-    logger.info(
-        f"Attempting to ZADD to local Redis (DB 2). Key: {zkey}, Score: {tsmp_score}, Member: {ticker_json[:100]}...")
+def set_24ticker(
+        exchange_name: str, symbol: str, data: Dict[str, Any], timeout: int = 120
+) -> None:
+    start = time.perf_counter()
+    write = _ticker_write(exchange_name, symbol, data, timeout)
     try:
-        zadd_result = redis_local.zadd(zkey, tiker_map)
-        logger.info(f"ZADD result for key {zkey}: {zadd_result} (1 means new element added)")
-    except Exception as e:
-        logger.error(f"Error during ZADD to key {zkey}", exc_info=True)
+        accepted = write_snapshots([write], global_timeout=timeout)[0]
+    except Exception:
+        logger.error(f"Error writing ticker snapshot {write.zkey}", exc_info=True)
         return
+    _record_ticker_write(exchange_name, symbol, write, accepted, start)
 
-    remove_until_score = tsmp_score - 1200
-    logger.info(f"Attempting to ZREMRANGEBYSCORE for key {zkey}. Removing scores from 0 to {remove_until_score}")
-    try:
-        removed_count = redis_local.zremrangebyscore(zkey, 0, remove_until_score)
-        logger.info(f"ZREMRANGEBYSCORE result for key {zkey}: removed {removed_count} elements.")
-    except Exception as e:
-        logger.error(f"Error during ZREMRANGEBYSCORE for key {zkey}", exc_info=True)
 
-    logger.info(f"Attempting to SET key in global_redis (Django Cache): {key}")
+async def aset_24ticker(
+        exchange_name: str, symbol: str, data: Dict[str, Any], timeout: int = 120
+) -> None:
+    """set_24ticker 的异步版本"""
+    start = time.perf_counter()
+    write = _ticker_write(exchange_name, symbol, data, timeout)
     try:
-        redis_global.set(key, ticker_json, timeout=timeout)
-        logger.info(f"SET completed for key {key} in global_redis (Django Cache)")
-    except Exception as e:
-        logger.error(f"Error during SET to key {key} in global_redis (Django Cache)", exc_info=True)
+        accepted = (await awrite_snapshots([write], global_timeout=timeout))[0]
+    except Exception:
+        logger.error(f"Error writing ticker snapshot {write.zkey}", exc_info=True)
+        return
+    _record_ticker_write(exchange_name, symbol, write, accepted, start)
+
+
+def _record_ticker_write(exchange_name: str, symbol: str, write: SnapshotWrite, accepted: bool, start: float) -> None:
+    hot_log.record("set_24ticker" if accepted else "set_24ticker_delayed", time.perf_counter() - start)
+    if not accepted and hot_log.sample(write.zkey):
+        logger.info(f"{exchange_name}.{symbol}: ticker older than the latest one, kept in history only.")
+
+
+def set_24tickers(exchange_name: str, tickers: Dict[str, Dict[str, Any]], timeout: int = 120) -> Dict[str, bool]:
+    """
+    批量写入一个交易所多个交易对的 24h ticker，所有交易对共用一次 pipeline。
+
+    Returns:
+        交易对 -> 是否成为最新 ticker
+    """
+    writes = {symbol: _ticker_write(exchange_name, symbol, data, timeout) for symbol, data in tickers.items()}
+    results = write_snapshots(list(writes.values()), global_timeout=timeout)
+    return dict(zip(writes, results))
 
 
 def get_24ticker(
         exchange_name: str, symbol: str, timeout: int = 120
 ) -> Optional[Dict[str, Any]]:
-    key = EXCHANGE_TICKERS_KEY % (exchange_name, symbol)
-    data = global_redis().get(key)
-    if data:
-        ticker = json.loads(data)
+    ticker = _get_latest_payload(NRDS_EXCHANGE_TICKERS_LATEST_KEY % (exchange_name, symbol))
+    if ticker is None:
+        data = global_redis().get(EXCHANGE_TICKERS_KEY % (exchange_name, symbol))
+        ticker = json.loads(data) if data else None
+    if ticker:
         if time.time() - ticker["timestamp"] < timeout:
             return ticker
         else:
@@ -113,15 +305,111 @@ def get_24ticker(
         return None
 
 
+# 读取历史：ARGV[4] 大于 0 时先把起点 ARGV[1]（秒）收紧到 [ARGV[1], ARGV[2]] 内倒数第 ARGV[4] 个成员，
+# 返回从起点之前最近的关键帧到 ARGV[2] 的全部成员；起点之前没有关键帧时从之后第一个开始。
+# 没有关键帧的有序集合（ticker、旧格式）：ARGV[4] 为 0 时返回 [ARGV[3], ARGV[2]] 内最新一秒的成员，
+# 否则返回 [ARGV[1], ARGV[2]] 内最新的 ARGV[4] 个成员（-1 表示不限数量）
+SNAPSHOT_HISTORY_SCRIPT = """
+local start = ARGV[1]
+if tonumber(ARGV[4]) > 0 then
+    local nth = redis.call('ZREVRANGEBYSCORE', KEYS[1], ARGV[2], start, 'WITHSCORES', 'LIMIT', ARGV[4] - 1, 1)
+    if #nth > 0 then
+        start = nth[2]
+    end
+end
+local kf = redis.call('ZREVRANGEBYSCORE', KEYS[2], start, '-inf', 'WITHSCORES', 'LIMIT', 0, 1)
+if #kf == 0 then
+    kf = redis.call('ZRANGEBYSCORE', KEYS[2], start, ARGV[2], 'WITHSCORES', 'LIMIT', 0, 1)
+end
+if #kf > 0 then
+    return redis.call('ZRANGEBYSCORE', KEYS[1], kf[2], ARGV[2])
+end
+if tonumber(ARGV[4]) == 0 then
+    local top = redis.call('ZREVRANGEBYSCORE', KEYS[1], ARGV[2], ARGV[3], 'WITHSCORES', 'LIMIT', 0, 1)
+    if #top == 0 then
+        return {}
+    end
+    return redis.call('ZRANGEBYSCORE', KEYS[1], math.floor(tonumber(top[2])), ARGV[2])
+end
+return redis.call('ZREVRANGEBYSCORE', KEYS[1], ARGV[2], ARGV[1], 'LIMIT', 0, ARGV[4])
+"""
+_snapshot_history_script = local_redis().register_script(SNAPSHOT_HISTORY_SCRIPT)
+_snapshot_history_ascript = register_async_script(SNAPSHOT_HISTORY_SCRIPT)
+
+
+def _snapshot_timestamp(snapshot: Dict[str, Any]):
+    return snapshot.get("timestamp") or 0
+
+
+def _latest_snapshot_window(timestamp: int) -> Tuple[int, int]:
+    """最新快照的查找窗口 (起点, 终点)，单位秒"""
+    score_end = timestamp or int(time.time())
+    return score_end - SNAPSHOT_HISTORY_SECONDS, score_end
+
+
+def _latest_snapshot_args(zkey: str, score_start: int, score_end: int) -> Dict[str, Any]:
+    # 分数带毫秒小数，上界取到 score_end 这一秒结束
+    score_max = f"({score_end + 1}"
+    return dict(keys=[zkey, keyframes_key(zkey)], args=[score_max, score_max, score_start, 0])
+
+
+def _pick_latest(members, score_start: int) -> Optional[Dict[str, Any]]:
+    # 关键帧分支返回的是最近关键帧之后的全部成员，不受窗口起点限制；
+    # 交易所停止写入后历史不会被裁剪，这里排除窗口之前的快照
+    snapshots = [
+        snapshot for snapshot in decode_history(members) if _snapshot_timestamp(snapshot) >= score_start * 1000
+    ]
+    if not snapshots:
+        return None
+    return max(snapshots, key=_snapshot_timestamp)
+
+
+def get_latest_snapshot(zkey: str, timestamp: int = 0) -> Optional[Dict[str, Any]]:
+    """
+    读取快照有序集合中 timestamp（秒，默认当前时间）之前 20 分钟内最新的一个快照。
+
+    增量编码的历史只传输最近一个关键帧之后的成员，其余只传输最新一秒内的成员，而不是整个 20 分钟窗口。
+    """
+    score_start, score_end = _latest_snapshot_window(timestamp)
+    return _pick_latest(_snapshot_history_script(**_latest_snapshot_args(zkey, score_start, score_end)), score_start)
+
+
+async def aget_latest_snapshot(zkey: str, timestamp: int = 0) -> Optional[Dict[str, Any]]:
+    """get_latest_snapshot 的异步版本"""
+    score_start, score_end = _latest_snapshot_window(timestamp)
+    members = await _snapshot_history_ascript(
+        **_latest_snapshot_args(zkey, score_start, score_end), client=local_async_redis(),
+    )
+    return _pick_latest(members, score_start)
+
+
+def get_snapshot_history(
+        zkey: str, start: Optional[int] = None, end: Optional[int] = None,
+        limit: Optional[int] = SNAPSHOT_HISTORY_DEFAULT_LIMIT
+) -> List[Dict[str, Any]]:
+    """读取 [start, end]（秒）内最新的至多 limit 个快照（None 表示全部），按时间从旧到新排列"""
+    score_end = end or int(time.time())
+    score_start = start if start is not None else score_end - SNAPSHOT_HISTORY_SECONDS
+    members = _snapshot_history_script(
+        keys=[zkey, keyframes_key(zkey)],
+        args=[score_start, f"({score_end + 1}", score_start, -1 if limit is None else limit],
+    )
+    snapshots = [
+        snapshot for snapshot in decode_history(members)
+        if score_start * 1000 <= _snapshot_timestamp(snapshot) < (score_end + 1) * 1000
+    ]
+    snapshots.sort(key=_snapshot_timestamp)
+    if limit is None:
+        return snapshots
+    return snapshots[-limit:] if limit else []
+
+
 def get_history_24ticker(
         exchange_name: str, symbol: str, timestamp: int = 0, timeout: int = 120
 ):
     zkey = NRDS_EXCHANGE_TICKERS_KEY % (exchange_name, symbol)
-    score_end = timestamp or int(time.time())
-    score_start = score_end - 1200
-    data = local_redis().zrevrangebyscore(zkey, score_end, score_start)
-    if len(data) > 0:
-        ticker = json.loads(data[-1].decode())
+    ticker = get_latest_snapshot(zkey, timestamp)
+    if ticker is not None:
         if time.time() - ticker["timestamp"] < timeout:
             return ticker
         else:
@@ -130,46 +418,81 @@ def get_history_24ticker(
         return None
 
 
-def get_orderbook(exchange_name: str, symbol_name: str) -> Orderbook:
+def _get_orderbook_data(exchange_name: str, symbol_name: str) -> Dict[str, Any]:
     key = NRDS_EXCHANGE_ORDERBOOKS_KEY % (exchange_name, symbol_name)
     # key = EXCHANGE_ORDERBOOKS_KEY % (exchange_name, symbol_name)
     # data = global_redis().get(key)
 
-    logger.info(f"get_orderbook_key: {key}")
-    score_end = int(time.time())
-    score_start = score_end - 1200
-    data = local_redis().zrevrangebyscore(key, score_end, score_start)
-    if not data:
+    hot_log.record("get_orderbook")
+    p = _get_latest_payload(NRDS_EXCHANGE_ORDERBOOKS_LATEST_KEY % (exchange_name, symbol_name))
+    if p is None:
+        p = get_latest_snapshot(key)
+    if p is None:
+        raise OrderbookNotFound(f"{exchange_name} {symbol_name}")
+    p.setdefault("exchange", exchange_name)
+    return p
+
+
+async def _aget_orderbook_data(exchange_name: str, symbol_name: str) -> Dict[str, Any]:
+    hot_log.record("get_orderbook")
+    p = await _aget_latest_payload(NRDS_EXCHANGE_ORDERBOOKS_LATEST_KEY % (exchange_name, symbol_name))
+    if p is None:
+        p = await aget_latest_snapshot(NRDS_EXCHANGE_ORDERBOOKS_KEY % (exchange_name, symbol_name))
+    if p is None:
         raise OrderbookNotFound(f"{exchange_name} {symbol_name}")
-    p = json.loads(data[-1].decode())
     p.setdefault("exchange", exchange_name)
-    return Orderbook.from_json(p)
+    return p
+
+
+def get_orderbook(exchange_name: str, symbol_name: str) -> Orderbook:
+    return Orderbook.from_json(_get_orderbook_data(exchange_name, symbol_name))
+
+
+async def aget_orderbook(exchange_name: str, symbol_name: str) -> Orderbook:
+    """get_orderbook 的异步版本"""
+    return Orderbook.from_json(await _aget_orderbook_data(exchange_name, symbol_name))
+
+
+def get_columnar_orderbook(exchange_name: str, symbol_name: str) -> ColumnarOrderbook:
+    """与 get_orderbook 相同，但返回列式订单簿，合并等只读路径不必逐档解析 Decimal"""
+    return ColumnarOrderbook.from_json(_get_orderbook_data(exchange_name, symbol_name))
+
+
+async def aget_columnar_orderbook(exchange_name: str, symbol_name: str) -> ColumnarOrderbook:
+    """get_columnar_orderbook 的异步版本"""
+    return ColumnarOrderbook.from_json(await _aget_orderbook_data(exchange_name, symbol_name))
 
 
 def get_history_orderbook(
         exchange_name: str, symbol: str, timestamp: int = 0
 ) -> Orderbook:
-    return get_history_orderbook_lst(exchange_name, symbol, timestamp)[-1]
+    """timestamp（秒，默认当前时间）之前最新的订单簿"""
+    key = NRDS_EXCHANGE_ORDERBOOKS_KEY % (exchange_name, symbol)
+    data = get_latest_snapshot(key, timestamp)
+    if data is None:
+        raise OrderbookNotFound(f"{exchange_name}.{symbol}")
+    data.setdefault("exchange", exchange_name)
+    return Orderbook.from_json(data)
 
 
 def get_history_orderbook_lst(
-        exchange_name: str, symbol: str, timestamp: Optional[int] = None
+        exchange_name: str, symbol: str, timestamp: Optional[int] = None,
+        limit: Optional[int] = None
 ) -> List[Orderbook]:
+    """从 timestamp - 20 分钟到当前时间内的订单簿（默认全部，给出 limit 时取最新的 limit 个），按时间从旧到新排列"""
     key = NRDS_EXCHANGE_ORDERBOOKS_KEY % (exchange_name, symbol)
-    score_start = (timestamp or int(time.time())) - 1200
-    score_end = int(time.time())
-    data = local_redis().zrangebyscore(key, score_start, score_end)
+    score_start = (timestamp or int(time.time())) - SNAPSHOT_HISTORY_SECONDS
+    data = get_snapshot_history(key, start=score_start, limit=limit)
     if not data:
         raise OrderbookNotFound(f"{exchange_name}.{symbol}")
-    data2ob = lambda _data: Orderbook.from_json(dict(exchange=exchange_name, **json.loads(_data.decode())))
-    return list(map(data2ob, data))
+    return [Orderbook.from_json(dict(exchange=exchange_name, **_data)) for _data in data]
 
 
 class OrderbookDelayError(Exception):
     pass
 
 
-def set_orderbook(exchange_name: str, symbol: str, data: Dict[str, Any]) -> None:
+def _orderbook_write(exchange_name: str, symbol: str, data: Dict[str, Any]) -> Optional[SnapshotWrite]:
     assert all(key in data for key in ("source", "bids", "asks", "timestamp")), \
         f'{data} must have attribute ' \
         f'("source", "bids", "asks", "timestamp")'
@@ -179,32 +502,66 @@ def set_orderbook(exchange_name: str, symbol: str, data: Dict[str, Any]) -> None
         ts_new = int(data["timestamp"])
     except (ValueError, TypeError):
         logger.error(f"Invalid timestamp format for {exchange_name}.{symbol}: {data['timestamp']}. Rejecting orderbook.")
-        return
-
-    key = EXCHANGE_ORDERBOOKS_KEY % (exchange_name, symbol)
-    logger.info(f"global_redis_key: {key}")
+        return None
 
-    try:
-        existing = global_redis().get(key)
-        if existing:
-            ob_data = json.loads(existing)
-            ts_cur = ob_data.get("timestamp", None)
-            if ts_cur and ts_new and ts_cur > ts_new:
-                raise OrderbookDelayError
-    except OrderbookDelayError:
-        logger.info(f"{exchange_name}.{symbol}: {data['source']} data rejected.")
-    else:
-        ts_lag = time.time() * 1000 - ts_new
-        logger.info(f"{exchange_name}.{symbol}: {data['source']} data accepted. ts_lag {ts_lag:.4f} ms")
-        global_redis().set(key, json.dumps(data))  # timeout=None)
-    zkey = NRDS_EXCHANGE_ORDERBOOKS_KEY % (exchange_name, symbol)
-    tsmp = int(int(data["timestamp"]) / 1000)  # milliseconds to seconds
+    tsmp = int(ts_new / 1000)  # milliseconds to seconds
     current = int(time.time())
     assert current - 300 < tsmp < current + 300, f"incorrect tsmp {tsmp}, current {current}"
-    orderbook_map = {json.dumps(data): tsmp}
-    logger.debug(f"orderbook_map: {orderbook_map}")
-    local_redis().zadd(zkey, orderbook_map)
-    local_redis().zremrangebyscore(zkey, 0, tsmp - 1200)
+    zkey = NRDS_EXCHANGE_ORDERBOOKS_KEY % (exchange_name, symbol)
+    payload = json.dumps(data)
+    return SnapshotWrite(
+        latest_key=NRDS_EXCHANGE_ORDERBOOKS_LATEST_KEY % (exchange_name, symbol),
+        zkey=zkey,
+        global_key=EXCHANGE_ORDERBOOKS_KEY % (exchange_name, symbol),
+        payload=payload,
+        timestamp=ts_new,
+        latest_ttl=SNAPSHOT_HISTORY_SECONDS,
+        history=history_encoder.encode(zkey, data, payload),
+    )
+
+
+def set_orderbook(exchange_name: str, symbol: str, data: Dict[str, Any]) -> None:
+    start = time.perf_counter()
+    write = _orderbook_write(exchange_name, symbol, data)
+    if write is None:
+        return
+    accepted = write_snapshots([write])[0]
+    _record_orderbook_write(exchange_name, symbol, data, write, accepted, start)
+
+
+async def aset_orderbook(exchange_name: str, symbol: str, data: Dict[str, Any]) -> None:
+    """set_orderbook 的异步版本"""
+    start = time.perf_counter()
+    write = _orderbook_write(exchange_name, symbol, data)
+    if write is None:
+        return
+    accepted = (await awrite_snapshots([write]))[0]
+    _record_orderbook_write(exchange_name, symbol, data, write, accepted, start)
+
+
+def _record_orderbook_write(exchange_name: str, symbol: str, data: Dict[str, Any], write: SnapshotWrite,
+                            accepted: bool, start: float) -> None:
+    hot_log.record("set_orderbook" if accepted else "set_orderbook_rejected", time.perf_counter() - start)
+    if hot_log.sample(write.zkey):
+        ts_lag = time.time() * 1000 - write.timestamp
+        logger.info(f"{exchange_name}.{symbol}: {data['source']} data {'accepted' if accepted else 'rejected'}. "
+                    f"ts_lag {ts_lag:.4f} ms")
+
+
+def set_orderbooks(exchange_name: str, orderbooks: Dict[str, Dict[str, Any]]) -> Dict[str, bool]:
+    """
+    批量写入一个交易所多个交易对的订单簿快照，所有交易对共用一次 pipeline。
+
+    Returns:
+        交易对 -> 是否成为最新快照（时间戳落后的快照只进入历史）
+    """
+    writes = {}
+    for symbol, data in orderbooks.items():
+        write = _orderbook_write(exchange_name, symbol, data)
+        if write is not None:
+            writes[symbol] = write
+    results = write_snapshots(list(writes.values()))
+    return dict(zip(writes, results))
 
 
 def get_merged_orderbook(symbol_name: str) -> Orderbook:
@@ -216,30 +573,49 @@ def get_merged_orderbook(symbol_name: str) -> Orderbook:
     return Orderbook.from_json(data)
 
 
-def set_merged_orderbook(symbol_name: str, orderbook: Orderbook) -> None:
-    logger.info(f"set_merged_orderbook: {symbol_name}")
-    key = SYMBOL_MERGE_ORDERBOOKS_KEY % symbol_name
-    global_redis().set(key, json.dumps(orderbook.as_json()))
-    zkey = NRDS_SYMBOL_MERGE_ORDERBOOKS_KEY % symbol_name
-    if orderbook.timestamp is None:
-        tsmp = int(time.time())
-    else:
-        tsmp = int(int(orderbook.timestamp) / 1000)
+def _merged_write(symbol_name: str, orderbook: Orderbook) -> SnapshotWrite:
+    data = orderbook.as_json()
+    if data["timestamp"] is None:
+        # 历史差值以时间戳为基准，合并盘口没有时间戳时用写入时间
+        data["timestamp"] = int(time.time() * 1000)
+    tsmp = int(int(data["timestamp"]) / 1000)
     assert int(time.time()) - 300 < tsmp < int(time.time()) + 300, f"incorrect tsmp {tsmp}"
-    merged_orderbook_map = {json.dumps(orderbook.as_json()): tsmp}
-    logger.debug(f"merged_orderbook_map: {merged_orderbook_map}")
-    local_redis().zadd(zkey, merged_orderbook_map)
-    local_redis().zremrangebyscore(zkey, 0, tsmp - 1200)  # remove expired data
+    payload = json.dumps(data)
+    zkey = NRDS_SYMBOL_MERGE_ORDERBOOKS_KEY % symbol_name
+    return SnapshotWrite(
+        latest_key=NRDS_SYMBOL_MERGE_ORDERBOOKS_LATEST_KEY % symbol_name,
+        zkey=zkey,
+        global_key=None,
+        payload=payload,
+        timestamp=int(data["timestamp"]),
+        latest_ttl=SNAPSHOT_HISTORY_SECONDS,
+        history=history_encoder.encode(zkey, data, payload),
+    )
+
+
+def set_merged_orderbook(symbol_name: str, orderbook: Orderbook) -> None:
+    start = time.perf_counter()
+    write = _merged_write(symbol_name, orderbook)
+    global_redis().set(SYMBOL_MERGE_ORDERBOOKS_KEY % symbol_name, write.payload)
+    write_snapshots([write])
+    hot_log.record("set_merged_orderbook", time.perf_counter() - start)
+
+
+async def aset_merged_orderbook(symbol_name: str, orderbook: Orderbook) -> None:
+    """set_merged_orderbook 的异步版本"""
+    start = time.perf_counter()
+    write = _merged_write(symbol_name, orderbook)
+    await sync_to_async(global_redis().set, thread_sensitive=False)(SYMBOL_MERGE_ORDERBOOKS_KEY % symbol_name,
+                                                                     write.payload)
+    await awrite_snapshots([write])
+    hot_log.record("set_merged_orderbook", time.perf_counter() - start)
 
 
 def get_history_merged_orderbook(symbol_name: str, timestamp: int = 0) -> Orderbook:
     zkey = NRDS_SYMBOL_MERGE_ORDERBOOKS_KEY % symbol_name
-    score_end = timestamp or int(time.time())
-    score_start = score_end - 1200
-    dbdata = local_redis().zrevrangebyscore(zkey, score_end, score_start)
-    if len(dbdata) == 0:
+    data = get_latest_snapshot(zkey, timestamp)
+    if data is None:
         raise OrderbookNotFound(f"merged {symbol_name}")
-    data: Dict[str, Any] = json.loads(dbdata[-1].decode())
     return Orderbook.from_json(data)
 
 
@@ -256,135 +632,186 @@ def get_perpetual_orderbook() -> Orderbook:
     raise OrderbookNotFound(f"{ex_name} {symbol_name}")
 
 
-def merge_order_list(old: List[OrderEntry], new: List[OrderEntry], reverse=False):
-    output: List[OrderEntry] = []
-    mixed = sorted(old + new, key=lambda ent: ent.price)
-    for k, _ents in groupby(mixed, key=lambda ent: ent.price_str):
-        ents = list(_ents)
-        order = OrderEntry()
-        order.price = dec(k)
-        order.amount = dec(sum(e.amount for e in ents))
-        output.append(order)
-    return sorted(output, key=attrgetter("price"), reverse=reverse)
+def merge_symbol_orderbooks(symbol_display: str, orderbooks: List[ColumnarOrderbook]) -> Orderbook:
+    # 不在这里截断深度，_uncrossed_orderbook 隐藏交叉档位之后再按 MERGED_ORDERBOOK_DEPTH 截断
+    return merge_exchange_orderbooks(orderbooks, tick=_merge_tick(symbol_display))
 
 
-def save_merged_ob(symbol, orderbook, messages):
-    toggle = True
-    bids, asks = orderbook.bids, orderbook.asks
+def _merge_tick(symbol_display: str) -> Optional[Decimal]:
+    tick = MERGED_ORDERBOOK_TICKS.get(symbol_display)
+    return dec(tick) if tick else None
+
+
+def _record_hidden_layers(symbol, messages, bids_hidden: int, asks_hidden: int) -> None:
+    if not bids_hidden and not asks_hidden:
+        return
+    hot_log.record("crossed_book")
+    if hot_log.sample(f"crossed_book:{symbol.symbol_display}"):
+        logger.warning(f"{symbol.symbol_display}: merged orderbook crossed, {MERGED_ORDERBOOK_CROSSED_POLICY} policy "
+                       f"hides {bids_hidden} bid and {asks_hidden} ask layers.")
+    messages['bids_hidden'] = bids_hidden
+    messages['asks_hidden'] = asks_hidden
+    messages['crossed_policy'] = MERGED_ORDERBOOK_CROSSED_POLICY
+
+
+def _uncrossed_orderbook(symbol, orderbook, messages) -> Orderbook:
     # 交叉盘/锁定盘处理。正常的单一交易所订单簿中，最高买价 应该永远低于 最低卖价
-    while bids and asks and bids[0].price >= asks[0].price:
-        bids, asks = (bids[1:], asks[:]) if toggle else (bids[:], asks[1:])
-        toggle = not toggle
-    bids_hidden = len(orderbook.bids) - len(bids)
-    if bids_hidden:
-        logger.warning(f"{symbol.symbol_display}.{symbol.exchanges.name}: {bids_hidden} layers are hidden from bid-side merged orderbook.")
-        messages['bids_hidden'] = bids_hidden
-        orderbook.bids = bids
-    asks_hidden = len(orderbook.asks) - len(asks)
-    if asks_hidden:
-        logger.warning(f"{symbol.symbol_display}.{symbol.exchanges.name}: {asks_hidden} layers are hidden from ask-side merged orderbook.")
-        messages['asks_hidden'] = asks_hidden
-        orderbook.asks = asks
+    groups = messages.get('groups') or []
+    bids_hidden, asks_hidden = resolve_crossed(
+        orderbook.bids, orderbook.asks, MERGED_ORDERBOOK_CROSSED_POLICY,
+        price=attrgetter("price"), amount=lambda side, i: side[i].amount,
+        venues=lambda reverse: [(group['timestamp'], [level[0] for level in group['detail']['bids' if reverse else 'asks']])
+                                for group in groups],
+        tick=_merge_tick(symbol.symbol_display),
+    )
+    _record_hidden_layers(symbol, messages, bids_hidden, asks_hidden)
+    # 先隐藏交叉档位再按 MERGED_ORDERBOOK_DEPTH 截断，与 _incremental_orderbook 相同
+    depth = MERGED_ORDERBOOK_DEPTH
+    orderbook.bids = orderbook.bids[bids_hidden:None if depth is None else bids_hidden + depth]
+    orderbook.asks = orderbook.asks[asks_hidden:None if depth is None else asks_hidden + depth]
     # if bids_hidden or asks_hidden:
     #     logger.warning(messages)
     # else:
     #     logger.debug(messages)
-    set_merged_orderbook(symbol.symbol_display, orderbook)
+    return orderbook
 
 
-def merge_usds_orderbooks(symbol: TradingPair):
-    orderbook = Orderbook()
-    symbols_dict = settings.EXCHANGE_FUTURES_SYMBOLS[symbol.quote_asset.name]
+def save_merged_ob(symbol, orderbook, messages):
+    set_merged_orderbook(symbol.symbol_display, _uncrossed_orderbook(symbol, orderbook, messages))
 
-    # TODO: what if symbols_dict is empty
-    groups = []
-    for exchange_name, symbols in symbols_dict.items():
-        try:
-            ob = get_orderbook(exchange_name, symbols[0])
-        except OrderbookNotFound:
-            continue
-        groups.append({
-            'symbol': symbols[0],
-            'timestamp': ob.timestamp,
-            'source': ob.source,
-            'exchange': ob.exchange,
-            'detail': ob.as_json()
-        })
-        orderbook.bids = merge_order_list(orderbook.bids, ob.bids, reverse=True)
-        orderbook.asks = merge_order_list(orderbook.asks, ob.asks)
-    messages = {
+
+def _incremental_orderbook(symbol, merger: IncrementalOrderbookMerger, messages) -> Orderbook:
+    """与 _uncrossed_orderbook 相同的交叉盘处理，直接在增量合并盘口的有序价格上计算，只生成最终输出的档位"""
+    bids_hidden, asks_hidden = resolve_crossed(
+        merger.bids, merger.asks, MERGED_ORDERBOOK_CROSSED_POLICY,
+        amount=lambda side, i: side.totals[side[i]], venues=merger.venues, tick=merger.tick,
+    )
+    _record_hidden_layers(symbol, messages, bids_hidden, asks_hidden)
+    return merger.orderbook(bids_hidden, asks_hidden, depth=MERGED_ORDERBOOK_DEPTH)
+
+
+def save_incremental_merged_ob(symbol, merger: IncrementalOrderbookMerger, messages):
+    set_merged_orderbook(symbol.symbol_display, _incremental_orderbook(symbol, merger, messages))
+
+
+def _orderbook_messages(sources: List[Tuple[str, ColumnarOrderbook]], orderbook: Orderbook):
+    groups = [{
+        'symbol': symbol_name,
+        'timestamp': ob.timestamp,
+        'source': ob.source,
+        'exchange': ob.exchange,
+        'detail': ob.as_json()
+    } for symbol_name, ob in sources]
+    return {
         'groups': groups,
         'bids': [bid.as_json() for bid in orderbook.bids],
         'asks': [ask.as_json() for ask in orderbook.asks],
         'asks_hidden': 0,
         'bids_hidden': 0,
     }
-    return orderbook, messages
 
 
-async def merge_orderbooks(symbol: TradingPair):
-    if symbol.symbol_display in ['BTC/USDS', 'ETH/USDS']:
-        orderbook, messages = merge_usds_orderbooks(symbol)
-    else:
-        orderbook, messages = await merge_usdt_orderbooks(symbol)
-    save_merged_ob(symbol, orderbook, messages)
+async def _aget_columnar_orderbooks(targets: List[Tuple[str, str]]) -> List[Optional[ColumnarOrderbook]]:
+    """并发读取多个 (交易所, 交易对) 的订单簿，不存在的返回 None"""
 
+    async def read(exchange_name: str, symbol_name: str) -> Optional[ColumnarOrderbook]:
+        try:
+            return await aget_columnar_orderbook(exchange_name, symbol_name)
+        except OrderbookNotFound:
+            return None
 
-SPOT_EXG: Dict[str, Tuple[List, int]] = {}
-SPOT_EXG_UPDATE_INTERVAL = 60
+    return await asyncio.gather(*(read(exchange_name, symbol_name) for exchange_name, symbol_name in targets))
 
 
-async def merge_usdt_orderbooks(symbol: TradingPair):
-    global SPOT_EXG, SPOT_EXG_UPDATE_INTERVAL
+def get_usds_orderbooks(symbol: TradingPair) -> List[Tuple[str, ColumnarOrderbook]]:
+    symbols_dict = settings.EXCHANGE_FUTURES_SYMBOLS[symbol.quote_asset.name]
+
+    # TODO: what if symbols_dict is empty
+    sources = []
+    for exchange_name, symbols in symbols_dict.items():
+        try:
+            ob = get_columnar_orderbook(exchange_name, symbols[0])
+        except OrderbookNotFound:
+            continue
+        sources.append((symbols[0], ob))
+    return sources
 
-    @sync_to_async
-    def get_active_cex_exchanges(sym):
-        return list(sym.exchanges.filter(market_type="Cex", status="Active")[:])
 
-    if symbol.symbol_display not in SPOT_EXG or SPOT_EXG[symbol.symbol_display][1] + SPOT_EXG_UPDATE_INTERVAL < time.time():
-        exchanges = await get_active_cex_exchanges(symbol)
-        last_update = int(time.time())
-        SPOT_EXG[symbol.symbol_display] = exchanges, last_update
+async def aget_usds_orderbooks(symbol: TradingPair) -> List[Tuple[str, ColumnarOrderbook]]:
+    """get_usds_orderbooks 的异步版本，各交易所的订单簿并发读取"""
+    symbols_dict = settings.EXCHANGE_FUTURES_SYMBOLS[symbol.quote_asset.name]
+    targets = [(exchange_name, symbols[0]) for exchange_name, symbols in symbols_dict.items()]
+    orderbooks = await _aget_columnar_orderbooks(targets)
+    return [(symbol_name, ob) for (_, symbol_name), ob in zip(targets, orderbooks) if ob is not None]
 
-    groups = []
-    orderbook = Orderbook()
 
+def merge_usds_orderbooks(symbol: TradingPair):
+    sources = get_usds_orderbooks(symbol)
+    orderbook = merge_symbol_orderbooks(symbol.symbol_display, [ob for _, ob in sources])
+    return orderbook, _orderbook_messages(sources, orderbook)
+
+
+async def amerge_orderbooks(symbol: TradingPair, merger: Optional[IncrementalOrderbookMerger] = None):
+    """
+    合并交易对在各交易所的订单簿并保存，Redis 读写全部走 redis.asyncio，多个交易对可以并发合并。
+
+    传入 merger 时使用增量模式：只把快照有变化的交易所的档位差值应用到 merger 维护的合并盘口。
+    """
+    if symbol.symbol_display in ['BTC/USDS', 'ETH/USDS']:
+        sources = await aget_usds_orderbooks(symbol)
+    else:
+        sources = await get_usdt_orderbooks(symbol)
+
+    if merger is not None:
+        changed = merger.sync({ob.exchange: ob for _, ob in sources or []})
+        logger.debug('%s: %d merged levels changed', symbol.symbol_display, changed)
+        orderbook = _incremental_orderbook(symbol, merger, {'asks_hidden': 0, 'bids_hidden': 0})
+    elif sources is None:
+        orderbook = _uncrossed_orderbook(symbol, Orderbook(), {})
+    else:
+        orderbook = merge_symbol_orderbooks(symbol.symbol_display, [ob for _, ob in sources])
+        orderbook = _uncrossed_orderbook(symbol, orderbook, _orderbook_messages(sources, orderbook))
+    await aset_merged_orderbook(symbol.symbol_display, orderbook)
+
+
+# 旧名称，爬虫和其他异步调用方继续可用
+merge_orderbooks = amerge_orderbooks
+
+
+def new_orderbook_merger(symbol: TradingPair) -> IncrementalOrderbookMerger:
+    return IncrementalOrderbookMerger(tick=_merge_tick(symbol.symbol_display))
+
+
+async def get_usdt_orderbooks(symbol: TradingPair) -> Optional[List[Tuple[str, ColumnarOrderbook]]]:
     try:
         exchange_names = list(settings.MERGE_SYMBOL_CONFIG[symbol.symbol_display].keys())
     except KeyError:
-        logger.warning(f"Symbol {symbol.symbol_display} not found in MERGE_SYMBOL_CONFIG. Skipping merge.")
-        return orderbook, {}  # Return empty orderbook and messages
-
-    @sync_to_async
-    def get_filtered_exchanges(sym, names):
-        return list(sym.exchanges.filter(market_type="Cex", status="Active", name__in=names))
+        if hot_log.sample(f"merge_config:{symbol.symbol_display}"):
+            logger.warning(f"Symbol {symbol.symbol_display} not found in MERGE_SYMBOL_CONFIG. Skipping merge.")
+        return None
 
-    filtered_exchanges = await get_filtered_exchanges(symbol, exchange_names)
-    for exchange in filtered_exchanges:
-        try:
-            ob = get_orderbook(exchange.name, symbol.symbol_display)
-        except OrderbookNotFound:
-            logger.warning(f"Orderbook not found for {exchange.name} {symbol.symbol_display}. Skipping.")
+    if symbol.category != "Spot":
+        return []
+    # 活跃交易所来自进程内缓存，稳态下合并不访问数据库
+    active_exchanges = await symbol_exchanges.aget(symbol.id)
+    exchange_names = [exchange_name for exchange_name in exchange_names if exchange_name in active_exchanges]
+    orderbooks = await _aget_columnar_orderbooks([(name, symbol.symbol_display) for name in exchange_names])
+    sources = []
+    for exchange_name, ob in zip(exchange_names, orderbooks):
+        if ob is None:
+            if hot_log.sample(f"orderbook_missing:{exchange_name}:{symbol.symbol_display}"):
+                logger.warning(f"Orderbook not found for {exchange_name} {symbol.symbol_display}. Skipping.")
             continue
+        sources.append((symbol.symbol_display, ob))
+    return sources
 
-        if symbol.category == "Spot":
-            groups.append({
-                'symbol': symbol.symbol_display,
-                'timestamp': ob.timestamp,
-                'source': ob.source,
-                'exchange': ob.exchange,
-                'detail': ob.as_json()
-            })
-            orderbook.bids = merge_order_list(orderbook.bids, ob.bids, reverse=True)
-            orderbook.asks = merge_order_list(orderbook.asks, ob.asks)
-    messages = {
-        'groups': groups,
-        'bids': [bid.as_json() for bid in orderbook.bids],
-        'asks': [ask.as_json() for ask in orderbook.asks],
-        'asks_hidden': 0,
-        'bids_hidden': 0,
-    }
-    return orderbook, messages
+
+async def merge_usdt_orderbooks(symbol: TradingPair):
+    sources = await get_usdt_orderbooks(symbol)
+    if sources is None:
+        return Orderbook(), {}  # Return empty orderbook and messages
+    orderbook = merge_symbol_orderbooks(symbol.symbol_display, [ob for _, ob in sources])
+    return orderbook, _orderbook_messages(sources, orderbook)
 
 
 def set_ohlcv(exchange_name, symbol_name, timeframe, data: list) -> None:
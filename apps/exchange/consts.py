@@ -8,14 +8,25 @@ EXCHANGE_MARKETS_KEY = 'crawler:%s:markets'
 
 EXCHANGE_TICKERS_KEY = 'crawler:%s:%s:tickers'
 NRDS_EXCHANGE_TICKERS_KEY = 'new:redis:crawler:%s:%s:tickers'
+NRDS_EXCHANGE_TICKERS_LATEST_KEY = 'new:redis:crawler:%s:%s:tickers:latest'
 
 EXCHANGE_ORDERBOOKS_KEY = 'crawler:%s:%s:orderbooks'
 NRDS_EXCHANGE_ORDERBOOKS_KEY = 'new:redis:crawler:%s:%s:orderbooks'
+NRDS_EXCHANGE_ORDERBOOKS_LATEST_KEY = 'new:redis:crawler:%s:%s:orderbooks:latest'
 
 HIST_VOLA_KEY = 'crawler:%s:histvolatilti'
 
 SYMBOL_MERGE_ORDERBOOKS_KEY = 'crawler:%s:merge_orderbooks'
 NRDS_SYMBOL_MERGE_ORDERBOOKS_KEY = 'new:redis:crawler:%s:merge_orderbooks'
+NRDS_SYMBOL_MERGE_ORDERBOOKS_LATEST_KEY = 'new:redis:crawler:%s:merge_orderbooks:latest'
+
+# new:redis:* 快照有序集合保留的时间窗口（秒），以及历史查询默认返回的最大快照数
+SNAPSHOT_HISTORY_SECONDS = 1200
+SNAPSHOT_HISTORY_DEFAULT_LIMIT = 100
+# 快照写入后是否继续把最新快照同步写到 Django cache（crawler:* 键），供尚未改读 latest 键的读取方使用
+EXCHANGE_SNAPSHOT_GLOBAL_MIRROR = getattr(settings, 'EXCHANGE_SNAPSHOT_GLOBAL_MIRROR', True)
+# 订单簿历史每隔多少个快照写一次完整关键帧，其余写相对上一个快照的档位差值；不大于 1 时每个快照都是关键帧
+ORDERBOOK_HISTORY_KEYFRAME_INTERVAL = getattr(settings, 'ORDERBOOK_HISTORY_KEYFRAME_INTERVAL', 20)
 
 SYMBOL_PRICE_KEY = 'crawler:%s:%s:price'
 API_RESPONSE_KEY = 'crawler:%s:api_name'
@@ -150,4 +161,16 @@ EXCHANGE_SPECIFIC_INTERVALS = {
     'latoken': 10,  # 10秒钟
     'bitmart': 10,  # 10秒钟
     'ascendex': 10,  # 10秒钟
-}
\ No newline at end of file
+}
+
+# 合并订单簿：交易对 -> 价格档位（如 {'BTC/USDT': '0.1'}），未配置的交易对按原始价格合并
+MERGED_ORDERBOOK_TICKS = getattr(settings, 'MERGED_ORDERBOOK_TICKS', {})
+# 合并订单簿每侧保留的最大档数，None 表示不截断
+MERGED_ORDERBOOK_DEPTH = getattr(settings, 'MERGED_ORDERBOOK_DEPTH', None)
+# 常驻合并进程是否增量维护合并订单簿（只应用有变化的交易所的档位差值）
+MERGED_ORDERBOOK_INCREMENTAL = getattr(settings, 'MERGED_ORDERBOOK_INCREMENTAL', True)
+# 合并订单簿交叉时隐藏档位的策略：alternating 买卖交替、stale_first 先隐藏报价交易所快照较旧的一侧、
+# volume 先隐藏数量较小的一侧
+MERGED_ORDERBOOK_CROSSED_POLICY = getattr(settings, 'MERGED_ORDERBOOK_CROSSED_POLICY', 'alternating')
+# 交易对 -> 活跃交易所缓存的有效期（秒）
+SYMBOL_EXCHANGES_TTL = getattr(settings, 'SYMBOL_EXCHANGES_TTL', 60)
@@ -0,0 +1,565 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import time
+import tracemalloc
+from decimal import Decimal
+from itertools import groupby
+from operator import attrgetter
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from redis.connection import Connection
+
+from common.helpers import dec
+from apps.exchange.orderbook_merge import (
+    CROSSED_POLICIES, IncrementalOrderbookMerger, crossed_levels, merge_exchange_orderbooks, resolve_crossed,
+)
+from apps.exchange.cache_ops import (
+    SnapshotWrite, aget_orderbook, aset_orderbook, get_latest_snapshot, get_orderbook, get_snapshot_history,
+    history_encoder, set_orderbook, set_orderbooks, write_snapshots,
+)
+from apps.exchange.orderbook_history import keyframes_key
+from apps.exchange.types import ColumnarOrderbook, Orderbook, OrderEntry
+from apps.exchange.consts import (
+    EXCHANGE_ORDERBOOKS_KEY, NRDS_EXCHANGE_ORDERBOOKS_KEY, NRDS_EXCHANGE_ORDERBOOKS_LATEST_KEY,
+)
+from common.helpers import CustomJsonFormatter
+from common.log_sampling import HotPathLog
+from common.redis_client import close_async_redis, global_redis, local_redis
+
+BENCH_SNAPSHOT_KEY = 'new:redis:crawler:benchmark:BENCH/USDT:orderbooks'
+BENCH_EXCHANGE = 'benchmark'
+
+
+def _fake_orderbook_json(exchange: str, levels: int, mid: float = 30000.0, step: float = 0.5) -> dict:
+    """构造与 ccxt fetch_order_book 结果一致的有序盘口，各交易所价位部分重叠"""
+    offset = random.randint(0, 20) * step
+    return {
+        'exchange': exchange,
+        'timestamp': int(time.time() * 1000),
+        'bids': [[round(mid - offset - i * step, 2), round(random.uniform(0.01, 5), 4)] for i in range(levels)],
+        'asks': [[round(mid + offset + (i + 1) * step, 2), round(random.uniform(0.01, 5), 4)] for i in range(levels)],
+    }
+
+
+def _fake_orderbook(exchange: str, levels: int) -> Orderbook:
+    return Orderbook.from_json(_fake_orderbook_json(exchange, levels))
+
+
+def _legacy_merge_order_list(old, new, reverse=False):
+    """旧实现：每加入一个交易所就整体排序、按 price_str 分组、再排序一次"""
+    output = []
+    mixed = sorted(old + new, key=lambda ent: ent.price)
+    for k, _ents in groupby(mixed, key=lambda ent: ent.price_str):
+        ents = list(_ents)
+        order = OrderEntry()
+        order.price = dec(k)
+        order.amount = dec(sum(e.amount for e in ents))
+        output.append(order)
+    return sorted(output, key=attrgetter("price"), reverse=reverse)
+
+
+def _legacy_merge(orderbooks):
+    orderbook = Orderbook()
+    for ob in orderbooks:
+        orderbook.bids = _legacy_merge_order_list(orderbook.bids, ob.bids, reverse=True)
+        orderbook.asks = _legacy_merge_order_list(orderbook.asks, ob.asks)
+    return orderbook
+
+
+def _legacy_set_orderbook(exchange_name, symbol, data):
+    """旧实现：GET + SET 全局缓存，ZADD + ZREMRANGEBYSCORE 本地有序集合，共四次往返"""
+    key = EXCHANGE_ORDERBOOKS_KEY % (exchange_name, symbol)
+    existing = global_redis().get(key)
+    if not existing or json.loads(existing).get("timestamp", 0) <= int(data["timestamp"]):
+        global_redis().set(key, json.dumps(data))
+    zkey = NRDS_EXCHANGE_ORDERBOOKS_KEY % (exchange_name, symbol)
+    tsmp = int(int(data["timestamp"]) / 1000)
+    local_redis().zadd(zkey, {json.dumps(data): tsmp})
+    local_redis().zremrangebyscore(zkey, 0, tsmp - 1200)
+
+
+def _legacy_uncross(orderbook):
+    """旧实现：每隐藏一档就复制两侧列表"""
+    toggle = True
+    bids, asks = orderbook.bids, orderbook.asks
+    while bids and asks and bids[0].price >= asks[0].price:
+        bids, asks = (bids[1:], asks[:]) if toggle else (bids[:], asks[1:])
+        toggle = not toggle
+    return len(orderbook.bids) - len(bids), len(orderbook.asks) - len(asks)
+
+
+def _percentile(values, pct):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks exchange orderbook hot paths on synthetic data.'
+
+    SCENARIOS = ('merge', 'parse', 'incremental', 'latest', 'write', 'logging', 'history', 'async', 'crossed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=self.SCENARIOS, help='Benchmark scenario to run.')
+        parser.add_argument('--exchanges', type=int, default=20, help='Number of exchanges per symbol.')
+        parser.add_argument('--levels', type=int, default=None,
+                            help='Orderbook depth per exchange and side (merge: 500, parse: 1000, history: 100).')
+        parser.add_argument('--rounds', type=int, default=20, help='Number of timed rounds.')
+        parser.add_argument('--tick', type=str, default=None, help='Price tick used for bucketing.')
+        parser.add_argument('--depth', type=int, default=None, help='Merged depth to keep per side.')
+        parser.add_argument('--changed-exchanges', type=int, default=2,
+                            help='Exchanges whose snapshot changes between merge cycles (incremental).')
+        parser.add_argument('--changed-levels', type=int, default=20,
+                            help='Levels per side that change in each updated snapshot (incremental).')
+        parser.add_argument('--snapshots', type=int, default=400,
+                            help='Snapshots kept in the 20 minute window (latest; 400 = one every 3s).')
+        parser.add_argument('--replay-seconds', type=int, default=3600,
+                            help='Length of the replayed snapshot stream per symbol (history).')
+        parser.add_argument('--interval', type=float, default=3,
+                            help='Seconds between replayed snapshots (history).')
+        parser.add_argument('--lag-steps', type=int, default=200,
+                            help='Price steps the lagging exchange is shifted by (crossed).')
+        parser.add_argument('--calls', type=int, default=20000, help='Logged calls per mode (logging).')
+        parser.add_argument('--formatter', choices=('json', 'verbose'), default='json',
+                            help='Log formatter attached to the benchmark handler (logging).')
+        parser.add_argument('--mode', choices=('legacy', 'current', 'both'), default='both',
+                            help='Run the legacy implementation, the current one, or both.')
+
+    def handle(self, *args, **options):
+        if options['scenario'] in ('latest', 'write', 'history', 'async'):
+            self.stdout.write(self.style.WARNING(
+                "Benchmarks write to the configured Redis; run them against a development instance."))
+        getattr(self, f"_bench_{options['scenario']}")(options)
+
+    def _report(self, label, latencies, extra=''):
+        self.stdout.write(
+            f"{label:>12}: n={len(latencies)} "
+            f"p50={_percentile(latencies, 50) * 1000:.1f}ms "
+            f"p99={_percentile(latencies, 99) * 1000:.1f}ms "
+            f"max={max(latencies) * 1000:.1f}ms {extra}"
+        )
+
+    def _bench_merge(self, options):
+        """E 个交易所 × D 档：逐个交易所两两合并 vs 一次 k 路堆合并"""
+        modes = ['legacy', 'current'] if options['mode'] == 'both' else [options['mode']]
+        tick = Decimal(options['tick']) if options['tick'] else None
+        orderbooks = [_fake_orderbook(f'ex{i}', options['levels'] or 500) for i in range(options['exchanges'])]
+        merge_funcs = {
+            'legacy': _legacy_merge,
+            'current': lambda obs: merge_exchange_orderbooks(obs, tick=tick, depth=options['depth']),
+        }
+
+        results = {}
+        for mode in modes:
+            latencies = []
+            for _ in range(options['rounds']):
+                start = time.perf_counter()
+                results[mode] = merge_funcs[mode](orderbooks)
+                latencies.append(time.perf_counter() - start)
+            merged = results[mode]
+            self._report(mode, latencies, f"bids={len(merged.bids)} asks={len(merged.asks)}")
+
+        if len(results) == 2 and tick is None and options['depth'] is None:
+            same = results['legacy'].as_json()['bids'] == results['current'].as_json()['bids'] \
+                and results['legacy'].as_json()['asks'] == results['current'].as_json()['asks']
+            self.stdout.write(f"identical output: {same}")
+
+    def _bench_parse(self, options):
+        """从 Redis 快照解析单个订单簿：逐档 Decimal 的 Orderbook vs 列式 ColumnarOrderbook"""
+        raw = json.dumps(_fake_orderbook_json('ex0', options['levels'] or 1000))
+        parsers = {'legacy': Orderbook.from_json, 'current': ColumnarOrderbook.from_json}
+        modes = ['legacy', 'current'] if options['mode'] == 'both' else [options['mode']]
+
+        for mode in modes:
+            parse = parsers[mode]
+            latencies = []
+            for _ in range(options['rounds']):
+                start = time.perf_counter()
+                orderbook = parse(json.loads(raw))
+                latencies.append(time.perf_counter() - start)
+
+            # 只统计解析结果本身占用的内存，JSON 中间结构不计入
+            data = json.loads(raw)
+            tracemalloc.start()
+            orderbook = parse(data)
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            self._report(mode, latencies, f"memory={memory / 1024:.1f}KiB mid={orderbook.mid_price():f}")
+
+    def _bench_incremental(self, options):
+        """常驻合并循环：每轮全量 k 路合并 vs 只应用变化交易所的档位差值"""
+        levels = options['levels'] or 500
+        books = {f'ex{i}': ColumnarOrderbook.from_json(_fake_orderbook_json(f'ex{i}', levels))
+                 for i in range(options['exchanges'])}
+
+        def mutate(timestamp):
+            """模拟交易所推送新快照：靠近盘口的若干档数量变化"""
+            for name in random.sample(sorted(books), options['changed_exchanges']):
+                data = books[name].as_json()
+                for side in ('bids', 'asks'):
+                    for level in data[side][:options['changed_levels']]:
+                        level[1] = round(random.uniform(0.01, 5), 4)
+                data['timestamp'] = timestamp
+                books[name] = ColumnarOrderbook.from_json(data)
+
+        def full_merge():
+            orderbook = merge_exchange_orderbooks(list(books.values()), depth=options['depth'])
+            bids_hidden, asks_hidden = crossed_levels(orderbook.bids, orderbook.asks, key=attrgetter("price"))
+            orderbook.bids, orderbook.asks = orderbook.bids[bids_hidden:], orderbook.asks[asks_hidden:]
+            return orderbook
+
+        merger = IncrementalOrderbookMerger()
+        merger.sync(books)
+
+        def incremental_merge():
+            merger.sync(books)
+            return merger.orderbook(*crossed_levels(merger.bids, merger.asks), depth=options['depth'])
+
+        merge_funcs = {'legacy': full_merge, 'current': incremental_merge}
+        modes = ['legacy', 'current'] if options['mode'] == 'both' else [options['mode']]
+        latencies = {mode: [] for mode in modes}
+        results = {}
+        for round_no in range(options['rounds']):
+            mutate(int(time.time() * 1000) + round_no + 1)
+            for mode in modes:
+                start = time.perf_counter()
+                results[mode] = merge_funcs[mode]()
+                latencies[mode].append(time.perf_counter() - start)
+        for mode in modes:
+            self._report(mode, latencies[mode], f"bids={len(results[mode].bids)} asks={len(results[mode].asks)}")
+
+        if len(results) == 2:
+            same = all(results['legacy'].as_json()[side] == results['current'].as_json()[side]
+                       for side in ('bids', 'asks'))
+            self.stdout.write(f"identical output: {same}")
+
+    def _bench_latest(self, options):
+        """读取最新快照：旧的整窗口 ZREVRANGEBYSCORE vs 只取最新一秒"""
+        redis = local_redis()
+        now = int(time.time())
+        count = options['snapshots']
+        redis.delete(BENCH_SNAPSHOT_KEY)
+        try:
+            members = {}
+            for i in range(count):
+                data = _fake_orderbook_json('bench', options['levels'] or 15)
+                data['timestamp'] = (now - (count - i) * 1200 // count) * 1000
+                members[json.dumps(data)] = data['timestamp'] // 1000
+            redis.zadd(BENCH_SNAPSHOT_KEY, members)
+
+            def legacy():
+                data = redis.zrevrangebyscore(BENCH_SNAPSHOT_KEY, now, now - 1200)
+                return sum(len(member) for member in data), json.loads(data[-1])
+
+            def current():
+                # 统计与 Lua 脚本实际返回相同的成员
+                snapshot = get_latest_snapshot(BENCH_SNAPSHOT_KEY, now)
+                return len(json.dumps(snapshot)), snapshot
+
+            modes = ['legacy', 'current'] if options['mode'] == 'both' else [options['mode']]
+            for mode in modes:
+                read = legacy if mode == 'legacy' else current
+                latencies = []
+                for _ in range(options['rounds']):
+                    start = time.perf_counter()
+                    transferred, snapshot = read()
+                    latencies.append(time.perf_counter() - start)
+                age = now - snapshot['timestamp'] // 1000
+                self._report(mode, latencies, f"bytes/call={transferred} snapshot_age={age}s")
+        finally:
+            redis.delete(BENCH_SNAPSHOT_KEY)
+
+    def _bench_write(self, options):
+        """订单簿快照写入：旧的四次往返 vs 单脚本，以及多个交易对共用一次 pipeline"""
+        symbols = [f'BENCH{i}/USDT' for i in range(options['exchanges'])]
+        levels = options['levels'] or 15
+        sent = []
+        original_send = Connection.send_packed_command
+
+        def counting_send(connection, command, check_health=True):
+            sent.append(1)
+            return original_send(connection, command, check_health)
+
+        def write_round(mode, timestamp):
+            books = {}
+            for symbol in symbols:
+                data = _fake_orderbook_json(BENCH_EXCHANGE, levels)
+                data.update(source='benchmark', timestamp=timestamp)
+                books[symbol] = data
+            if mode == 'legacy':
+                for symbol, data in books.items():
+                    _legacy_set_orderbook(BENCH_EXCHANGE, symbol, data)
+            elif mode == 'current':
+                for symbol, data in books.items():
+                    set_orderbook(BENCH_EXCHANGE, symbol, data)
+            else:
+                set_orderbooks(BENCH_EXCHANGE, books)
+
+        modes = ['legacy', 'current'] if options['mode'] == 'both' else [options['mode']]
+        if 'current' in modes:
+            modes.append('batch')
+        try:
+            for mode in modes:
+                write_round(mode, int(time.time() * 1000))  # 预热连接和脚本缓存
+                latencies = []
+                sent.clear()
+                with mock.patch.object(Connection, 'send_packed_command', counting_send):
+                    for round_no in range(options['rounds']):
+                        start = time.perf_counter()
+                        write_round(mode, int(time.time() * 1000) + round_no)
+                        latencies.append(time.perf_counter() - start)
+                per_symbol = len(sent) / options['rounds'] / len(symbols)
+                self._report(mode, latencies, f"symbols={len(symbols)} round_trips/symbol={per_symbol:.2f}")
+        finally:
+            for symbol in symbols:
+                zkey = NRDS_EXCHANGE_ORDERBOOKS_KEY % (BENCH_EXCHANGE, symbol)
+                local_redis().delete(zkey, keyframes_key(zkey), NRDS_EXCHANGE_ORDERBOOKS_LATEST_KEY % (BENCH_EXCHANGE, symbol))
+                global_redis().delete(EXCHANGE_ORDERBOOKS_KEY % (BENCH_EXCHANGE, symbol))
+
+    def _bench_logging(self, options):
+        """每次写入的日志开销：旧的逐次 INFO + 载荷片段 vs 计数聚合 + 按键采样"""
+        if options['formatter'] == 'json':
+            formatter = CustomJsonFormatter()
+        else:
+            formatter = logging.Formatter('%(asctime)s %(name)s [%(module)s:%(levelname)s] %(message)s')
+        bench_logger = logging.getLogger('benchmark.hot_path')
+        bench_logger.propagate = False
+        bench_logger.setLevel(logging.INFO)
+        devnull = open(os.devnull, 'w')
+        handler = logging.StreamHandler(devnull)
+        handler.setFormatter(formatter)
+        bench_logger.addHandler(handler)
+
+        payload = json.dumps(_fake_orderbook_json(BENCH_EXCHANGE, 15))
+        zkeys = [NRDS_EXCHANGE_ORDERBOOKS_KEY % (BENCH_EXCHANGE, f'BENCH{i}/USDT') for i in range(50)]
+        hot_log = HotPathLog(bench_logger)
+
+        def legacy(i):
+            zkey = zkeys[i % len(zkeys)]
+            bench_logger.info(f"Attempting to ZADD to local Redis (DB 2). Key: {zkey}, Score: {i}, Member: {payload[:100]}...")
+            bench_logger.info(f"ZADD result for key {zkey}: 1 (1 means new element added)")
+            bench_logger.info(f"Attempting to ZREMRANGEBYSCORE for key {zkey}. Removing scores from 0 to {i}")
+            bench_logger.info(f"ZREMRANGEBYSCORE result for key {zkey}: removed 0 elements.")
+
+        def current(i):
+            zkey = zkeys[i % len(zkeys)]
+            hot_log.record("set_24ticker", 0.001)
+            if hot_log.sample(zkey):
+                bench_logger.info(f"{zkey}: ticker older than the latest one, kept in history only.")
+
+        modes = ['legacy', 'current'] if options['mode'] == 'both' else [options['mode']]
+        timezone_override = {} if hasattr(settings, 'CELERY_TIMEZONE') else {'CELERY_TIMEZONE': 'UTC'}
+        try:
+            with override_settings(**timezone_override):
+                for mode in modes:
+                    log_call = legacy if mode == 'legacy' else current
+                    start = time.perf_counter()
+                    for i in range(options['calls']):
+                        log_call(i)
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(f"{mode:>12}: calls={options['calls']} "
+                                      f"per_call={elapsed / options['calls'] * 1e6:.2f}us")
+        finally:
+            bench_logger.removeHandler(handler)
+            devnull.close()
+
+    def _bench_history(self, options):
+        """
+        订单簿历史内存：按 --interval 回放 --replay-seconds 的快照流，
+        旧的每个快照一个完整 json 成员 vs 关键帧 + 档位差值，最后统计各有序集合的 MEMORY USAGE。
+        """
+        redis = local_redis()
+        symbols = [f'BENCH{i}/USDT' for i in range(options['exchanges'])]
+        levels = options['levels'] or 100
+        count = int(options['replay_seconds'] / options['interval'])
+        # 时间轴整体平移到当前时间之前，保证回放结束时窗口内的快照都在读取范围内
+        start_ms = int((time.time() - options['replay_seconds']) * 1000)
+        modes = ['legacy', 'current'] if options['mode'] == 'both' else [options['mode']]
+
+        def zkeys(mode, symbol):
+            zkey = NRDS_EXCHANGE_ORDERBOOKS_KEY % (f'{BENCH_EXCHANGE}-{mode}', symbol)
+            return zkey, keyframes_key(zkey), NRDS_EXCHANGE_ORDERBOOKS_LATEST_KEY % (f'{BENCH_EXCHANGE}-{mode}', symbol)
+
+        def snapshots(symbol):
+            """盘口随时间演化：每个快照若干档数量变化，偶尔成交吃掉一侧最优档、另一侧挂出新的最优档"""
+            data = _fake_orderbook_json(BENCH_EXCHANGE, levels)
+            data['source'] = 'benchmark'
+            step = 0.5
+            for i in range(count):
+                bids, asks = [list(level) for level in data['bids']], [list(level) for level in data['asks']]
+                for side in (bids, asks):
+                    for level in random.sample(side, min(options['changed_levels'], len(side))):
+                        level[1] = round(random.uniform(0.01, 5), 4)
+                if random.random() < 0.2:
+                    if random.random() < 0.5:
+                        asks.pop(0)
+                        bids.insert(0, [round(bids[0][0] + step, 2), round(random.uniform(0.01, 5), 4)])
+                        asks.append([round(asks[-1][0] + step, 2), round(random.uniform(0.01, 5), 4)])
+                        bids.pop()
+                    else:
+                        bids.pop(0)
+                        asks.insert(0, [round(asks[0][0] - step, 2), round(random.uniform(0.01, 5), 4)])
+                        bids.append([round(bids[-1][0] - step, 2), round(random.uniform(0.01, 5), 4)])
+                        asks.pop()
+                data = dict(data, timestamp=start_ms + int(i * options['interval'] * 1000), bids=bids, asks=asks)
+                yield data
+
+        def cleanup():
+            for mode in modes:
+                for symbol in symbols:
+                    redis.delete(*zkeys(mode, symbol))
+
+        cleanup()
+        try:
+            latest = {}
+            for mode in modes:
+                write_latencies = []
+                for symbol in symbols:
+                    zkey, _, latest_key = zkeys(mode, symbol)
+                    for data in snapshots(symbol):
+                        payload = json.dumps(data)
+                        start = time.perf_counter()
+                        if mode == 'legacy':
+                            score = data['timestamp'] // 1000
+                            redis.zadd(zkey, {payload: score})
+                            redis.zremrangebyscore(zkey, 0, score - 1200)
+                        else:
+                            write_snapshots([SnapshotWrite(
+                                latest_key=latest_key, zkey=zkey, global_key=None, payload=payload,
+                                timestamp=data['timestamp'], latest_ttl=1200,
+                                history=history_encoder.encode(zkey, data, payload),
+                            )])
+                        write_latencies.append(time.perf_counter() - start)
+                        latest[mode, symbol] = data
+
+                memory = members = 0
+                for symbol in symbols:
+                    zkey, kkey, _ = zkeys(mode, symbol)
+                    for key in (zkey, kkey):
+                        memory += redis.memory_usage(key, samples=0) or 0
+                    members += redis.zcard(zkey)
+
+                read_latencies = []
+                same = True
+                for symbol in symbols:
+                    zkey = zkeys(mode, symbol)[0]
+                    start = time.perf_counter()
+                    if mode == 'legacy':
+                        history = [json.loads(m) for m in redis.zrevrangebyscore(zkey, '+inf', '-inf', start=0, num=100)]
+                        history.reverse()
+                    else:
+                        history = get_snapshot_history(zkey, start=0, limit=100)
+                    read_latencies.append(time.perf_counter() - start)
+                    same = same and history[-1]['bids'] == latest[mode, symbol]['bids']
+
+                self._report(f'{mode} write', write_latencies)
+                self._report(f'{mode} read', read_latencies,
+                             f"history_memory={memory / 1024 / 1024:.2f}MiB members={members} "
+                             f"latest_reconstructed={same}")
+        finally:
+            cleanup()
+
+    def _bench_async(self, options):
+        """
+        协程中写入并读回 --exchanges 个交易对的订单簿：同步客户端逐个调用（阻塞事件循环）
+        vs redis.asyncio 并发调用。同时运行一个每 1ms 唤醒一次的协程，统计事件循环的最大停顿。
+        """
+        symbols = [f'BENCH{i}/USDT' for i in range(options['exchanges'])]
+        levels = options['levels'] or 15
+
+        async def legacy(books):
+            for symbol, data in books.items():
+                set_orderbook(BENCH_EXCHANGE, symbol, data)
+            return [get_orderbook(BENCH_EXCHANGE, symbol) for symbol in books]
+
+        async def current(books):
+            await asyncio.gather(*(aset_orderbook(BENCH_EXCHANGE, symbol, data) for symbol, data in books.items()))
+            return await asyncio.gather(*(aget_orderbook(BENCH_EXCHANGE, symbol) for symbol in books))
+
+        async def run(mode):
+            cycle = legacy if mode == 'legacy' else current
+            latencies, stalls = [], []
+            for round_no in range(options['rounds'] + 1):
+                books = {}
+                for symbol in symbols:
+                    data = _fake_orderbook_json(BENCH_EXCHANGE, levels)
+                    data.update(source='benchmark', timestamp=int(time.time() * 1000) + round_no)
+                    books[symbol] = data
+                stall = 0.0
+                done = False
+
+                async def heartbeat():
+                    nonlocal stall
+                    last = time.perf_counter()
+                    while not done:
+                        await asyncio.sleep(0.001)
+                        now = time.perf_counter()
+                        stall = max(stall, now - last - 0.001)
+                        last = now
+
+                beat = asyncio.ensure_future(heartbeat())
+                await asyncio.sleep(0)
+                start = time.perf_counter()
+                orderbooks = await cycle(books)
+                elapsed = time.perf_counter() - start
+                done = True
+                await beat
+                assert len(orderbooks) == len(symbols)
+                if round_no:  # 第一轮用于预热连接和脚本缓存
+                    latencies.append(elapsed)
+                    stalls.append(stall)
+            await close_async_redis()
+            return latencies, stalls
+
+        modes = ['legacy', 'current'] if options['mode'] == 'both' else [options['mode']]
+        try:
+            for mode in modes:
+                latencies, stalls = asyncio.run(run(mode))
+                self._report(mode, latencies, f"symbols={len(symbols)} max_loop_stall={max(stalls) * 1000:.1f}ms")
+        finally:
+            for symbol in symbols:
+                zkey = NRDS_EXCHANGE_ORDERBOOKS_KEY % (BENCH_EXCHANGE, symbol)
+                local_redis().delete(zkey, keyframes_key(zkey), NRDS_EXCHANGE_ORDERBOOKS_LATEST_KEY % (BENCH_EXCHANGE, symbol))
+                global_redis().delete(EXCHANGE_ORDERBOOKS_KEY % (BENCH_EXCHANGE, symbol))
+
+    def _bench_crossed(self, options):
+        """一个交易所行情落后、报价整体偏移 lag-steps 档时的交叉盘处理：逐档复制列表 vs 按下标计算各策略"""
+        levels = options['levels'] or 500
+        step = 0.5
+        books = {f'ex{i}': ColumnarOrderbook.from_json(_fake_orderbook_json(f'ex{i}', levels, step=step))
+                 for i in range(options['exchanges'])}
+        lagging = _fake_orderbook_json('lagging', levels, mid=30000.0 + options['lag_steps'] * step, step=step)
+        lagging['timestamp'] -= 60 * 1000
+        books['lagging'] = ColumnarOrderbook.from_json(lagging)
+        orderbook = merge_exchange_orderbooks(list(books.values()))
+        merger = IncrementalOrderbookMerger()
+        merger.sync(books)
+
+        def venues(reverse):
+            return [(book.timestamp, (book.bids if reverse else book.asks).prices) for book in books.values()]
+
+        funcs = {'legacy': lambda: _legacy_uncross(orderbook)}
+        for policy in CROSSED_POLICIES:
+            funcs[policy] = lambda policy=policy: resolve_crossed(
+                orderbook.bids, orderbook.asks, policy, price=attrgetter("price"),
+                amount=lambda side, i: side[i].amount, venues=venues)
+            funcs[f'{policy}/inc'] = lambda policy=policy: resolve_crossed(
+                merger.bids, merger.asks, policy, amount=lambda side, i: side.totals[side[i]], venues=merger.venues)
+
+        modes = list(funcs) if options['mode'] == 'both' else \
+            [mode for mode in funcs if (mode == 'legacy') == (options['mode'] == 'legacy')]
+        for mode in modes:
+            latencies = []
+            for _ in range(options['rounds']):
+                start = time.perf_counter()
+                bids_hidden, asks_hidden = funcs[mode]()
+                latencies.append(time.perf_counter() - start)
+            self._report(mode, latencies, f"bids_hidden={bids_hidden} asks_hidden={asks_hidden} "
+                                          f"total={bids_hidden + asks_hidden}")
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+订单簿历史快照的增量编码。
+
+new:redis:* 订单簿有序集合里相邻快照通常只有少数档位变化。每个有序集合每隔
+ORDERBOOK_HISTORY_KEYFRAME_INTERVAL 个快照写一次完整关键帧，其余只写相对上一个快照的差值：
+
+    K|<快照 json>
+    D|{"p": 基准快照时间戳, "f": 买卖盘以外的字段, "b"/"a": 新增或变化的档位, "rb"/"ra": 删除的价格}
+
+关键帧的分数另存到 <zkey>:keyframes，读取时从目标时间之前最近的关键帧开始按分数顺序重放差值。
+没有前缀的旧格式成员按关键帧处理。重放得到的买盘按价格从高到低、卖盘从低到高排列。
+"""
+
+import json
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from apps.exchange.consts import ORDERBOOK_HISTORY_KEYFRAME_INTERVAL
+
+KEYFRAME_PREFIX = "K|"
+DELTA_PREFIX = "D|"
+KEYFRAMES_KEY_SUFFIX = ":keyframes"
+
+# 价格 -> 原始档位（[price, amount, ...]），价格保留 json 中的原始类型
+Levels = Dict[Any, List[Any]]
+
+
+def keyframes_key(zkey: str) -> str:
+    return zkey + KEYFRAMES_KEY_SUFFIX
+
+
+def _levels(side: Iterable[List[Any]]) -> Levels:
+    return {level[0]: list(level) for level in side}
+
+
+def _sorted_levels(levels: Levels, reverse: bool) -> List[List[Any]]:
+    return [levels[price] for price in sorted(levels, key=float, reverse=reverse)]
+
+
+def _diff(old: Levels, new: Levels) -> Tuple[List[List[Any]], List[Any]]:
+    changed = [level for price, level in new.items() if old.get(price) != level]
+    removed = [price for price in old if price not in new]
+    return changed, removed
+
+
+class HistoryEntry(NamedTuple):
+    member: str  # 写入历史有序集合的成员
+    base_timestamp: Optional[int]  # 差值的基准快照时间戳（毫秒），关键帧为 None
+    timestamp: int
+    bids: Levels
+    asks: Levels
+
+    @property
+    def is_keyframe(self) -> bool:
+        return self.base_timestamp is None
+
+
+class _Chain:
+    __slots__ = ("timestamp", "since_keyframe", "bids", "asks")
+
+    def __init__(self, entry: HistoryEntry, since_keyframe: int):
+        self.timestamp = entry.timestamp
+        self.since_keyframe = since_keyframe
+        self.bids = entry.bids
+        self.asks = entry.asks
+
+
+class HistoryEncoder:
+    """
+    记录本进程写入每个有序集合的上一个快照，据此生成差值。
+
+    差值只在基准快照仍是 Redis 中的最新快照时才能写入（由写入脚本检查），
+    进程重启、多个进程交替写同一个键或快照乱序时退回关键帧。
+    """
+
+    def __init__(self, keyframe_interval: int = ORDERBOOK_HISTORY_KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self._chains: Dict[str, _Chain] = {}
+
+    def encode(self, zkey: str, data: Dict[str, Any], payload: str) -> HistoryEntry:
+        """data 为快照，payload 为它的 json；返回应写入历史的成员"""
+        timestamp = int(data["timestamp"])
+        bids, asks = _levels(data["bids"]), _levels(data["asks"])
+        chain = self._chains.get(zkey)
+        # 时间戳不晚于基准的快照与基准分数相同，按成员字典序 D| 会排在 K| 之前重放，只能写关键帧
+        if chain is None or self.keyframe_interval <= 1 or timestamp <= chain.timestamp \
+                or chain.since_keyframe + 1 >= self.keyframe_interval:
+            return HistoryEntry(KEYFRAME_PREFIX + payload, None, timestamp, bids, asks)
+
+        changed_bids, removed_bids = _diff(chain.bids, bids)
+        changed_asks, removed_asks = _diff(chain.asks, asks)
+        delta: Dict[str, Any] = {
+            "p": chain.timestamp,
+            "f": {key: value for key, value in data.items() if key not in ("bids", "asks")},
+        }
+        for key, value in (("b", changed_bids), ("rb", removed_bids), ("a", changed_asks), ("ra", removed_asks)):
+            if value:
+                delta[key] = value
+        member = DELTA_PREFIX + json.dumps(delta, separators=(",", ":"))
+        return HistoryEntry(member, chain.timestamp, timestamp, bids, asks)
+
+    @staticmethod
+    def as_keyframe(entry: HistoryEntry, payload: str) -> HistoryEntry:
+        """差值被写入脚本拒绝（基准已不是最新快照）时改写为关键帧"""
+        return entry._replace(member=KEYFRAME_PREFIX + payload, base_timestamp=None)
+
+    def commit(self, zkey: str, entry: HistoryEntry) -> None:
+        """快照成为最新快照后，作为下一个差值的基准"""
+        chain = self._chains.get(zkey)
+        if chain is not None and entry.timestamp == chain.timestamp:
+            # 同一时间戳已有快照，差值的基准 "p" 无法区分两者，下一个快照重新从关键帧开始
+            self.reset(zkey)
+            return
+        since_keyframe = 0 if entry.is_keyframe or chain is None else chain.since_keyframe + 1
+        self._chains[zkey] = _Chain(entry, since_keyframe)
+
+    def reset(self, zkey: str) -> None:
+        self._chains.pop(zkey, None)
+
+
+def decode_history(members: Iterable[Union[str, bytes]]) -> List[Dict[str, Any]]:
+    """
+    按分数顺序重放历史成员，返回能还原的全部快照（从旧到新）。
+
+    找不到基准快照的差值（基准已过期或被其他进程的写入打断）被跳过。
+    """
+    snapshots: List[Dict[str, Any]] = []
+    # 时间戳 -> (买卖盘以外的字段, 买盘, 卖盘)
+    states: Dict[Any, Tuple[Dict[str, Any], Levels, Levels]] = {}
+    for member in members:
+        if isinstance(member, bytes):
+            member = member.decode()
+        if member.startswith(DELTA_PREFIX):
+            delta = json.loads(member[len(DELTA_PREFIX):])
+            base = states.get(delta["p"])
+            if base is None:
+                continue
+            fields, bids, asks = delta["f"], dict(base[1]), dict(base[2])
+            for levels, changed, removed in ((bids, "b", "rb"), (asks, "a", "ra")):
+                for price in delta.get(removed, ()):
+                    levels.pop(price, None)
+                for level in delta.get(changed, ()):
+                    levels[level[0]] = level
+            snapshot = dict(fields, bids=_sorted_levels(bids, True), asks=_sorted_levels(asks, False))
+        else:
+            if member.startswith(KEYFRAME_PREFIX):
+                member = member[len(KEYFRAME_PREFIX):]
+            snapshot = json.loads(member)
+            fields = {key: value for key, value in snapshot.items() if key not in ("bids", "asks")}
+            bids, asks = _levels(snapshot.get("bids") or ()), _levels(snapshot.get("asks") or ())
+        states[snapshot.get("timestamp")] = (fields, bids, asks)
+        snapshots.append(snapshot)
+    return snapshots
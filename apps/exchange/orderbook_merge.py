@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多交易所订单簿合并。
+
+各交易所的买卖盘本身已按价格排好序，这里对所有交易所的同一侧做一次 k 路堆合并，
+相同价位（或同一价格档位）的数量相加，达到指定深度后立即停止。
+合并 E 个交易所、每个深度 D 的代价为 O(E·D·log E)，取代原先每加入一个交易所就整体重排一次的做法。
+
+常驻进程（CrawlerService）可以改用 IncrementalOrderbookMerger，只把有变化的交易所的档位差值
+应用到持续维护的合并盘口上。
+"""
+
+import bisect
+import heapq
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR
+from operator import attrgetter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from common.helpers import dec
+from apps.exchange.types import ColumnarOrderbook, Orderbook, OrderEntry, OrderSide
+
+_price = attrgetter("price")
+
+
+def _sorted_side(entries: Sequence[OrderEntry], reverse: bool) -> Sequence[OrderEntry]:
+    """交易所返回的盘口通常已有序，只有顺序被破坏时才重新排序"""
+    if isinstance(entries, OrderSide):
+        # 列式盘口直接在 float 数组上检查，避免提前生成 Decimal
+        return entries if entries.is_sorted(reverse) else sorted(entries, key=_price, reverse=reverse)
+    for prev, cur in zip(entries, entries[1:]):
+        if (cur.price > prev.price) if reverse else (cur.price < prev.price):
+            return sorted(entries, key=_price, reverse=reverse)
+    return entries
+
+
+def bucket_price(price: Decimal, tick: Decimal, reverse: bool) -> Decimal:
+    """
+    把价格归入 tick 档位。
+
+    买盘（reverse=True）向下取整、卖盘向上取整，合并后的盘口不会比真实报价更优。
+    """
+    rounding = ROUND_FLOOR if reverse else ROUND_CEILING
+    return dec((price / tick).to_integral_value(rounding=rounding) * tick)
+
+
+def merge_order_sides(
+        sides: Iterable[Sequence[OrderEntry]],
+        reverse: bool = False,
+        tick: Optional[Decimal] = None,
+        depth: Optional[int] = None,
+) -> List[OrderEntry]:
+    """
+    合并多个交易所同一侧的盘口。
+
+    Args:
+        sides: 各交易所的买盘或卖盘
+        reverse: True 表示买盘（价格从高到低），False 表示卖盘（价格从低到高）
+        tick: 价格档位，为空时按原始价格合并
+        depth: 合并后保留的最大档数，为空时不截断
+
+    Returns:
+        合并后的盘口，同一价位只保留一档，数量为各交易所之和
+    """
+    output: List[OrderEntry] = []
+    if depth is not None and depth <= 0:
+        return output
+
+    merged = heapq.merge(*(_sorted_side(side, reverse) for side in sides if side), key=_price, reverse=reverse)
+    current_price: Optional[Decimal] = None
+    current_amount = Decimal(0)
+    for entry in merged:
+        price = entry.price
+        if current_price is not None and (
+                price == current_price
+                # 价格单调，仍落在当前档位内时不必重新计算档位
+                or (tick and ((price >= current_price) if reverse else (price <= current_price)))
+        ):
+            current_amount += entry.amount
+            continue
+        if tick:
+            price = bucket_price(price, tick, reverse)
+        if current_price is not None:
+            output.append(_order_entry(current_price, current_amount))
+            if depth is not None and len(output) >= depth:
+                return output
+        current_price, current_amount = price, entry.amount
+    if current_price is not None:
+        output.append(_order_entry(current_price, current_amount))
+    return output
+
+
+def merge_exchange_orderbooks(
+        orderbooks: Sequence[Union[Orderbook, ColumnarOrderbook]],
+        tick: Optional[Decimal] = None,
+        depth: Optional[int] = None,
+) -> Orderbook:
+    """合并多个交易所的订单簿，返回新的 Orderbook"""
+    orderbook = Orderbook()
+    orderbook.bids = merge_order_sides((ob.bids for ob in orderbooks), reverse=True, tick=tick, depth=depth)
+    orderbook.asks = merge_order_sides((ob.asks for ob in orderbooks), tick=tick, depth=depth)
+    return orderbook
+
+
+def _order_entry(price: Decimal, amount: Decimal) -> OrderEntry:
+    order = OrderEntry()
+    order.price = dec(price)
+    order.amount = dec(amount)
+    return order
+
+
+CROSSED_POLICIES = ("alternating", "stale_first", "volume")
+
+
+def crossed_levels(
+        bids: Sequence, asks: Sequence, key: Optional[Callable] = None,
+        bid_weight: Optional[Callable[[int], Any]] = None, ask_weight: Optional[Callable[[int], Any]] = None,
+) -> Tuple[int, int]:
+    """
+    计算交叉盘/锁定盘需要隐藏的档数。
+
+    最高买价不低于最低卖价时隐藏一侧的最优档，直到盘口不再交叉。未给出权重时从买盘开始交替隐藏；
+    给出 bid_weight/ask_weight（档位下标 -> 权重）时每一步隐藏权重较小的一侧，权重相等时交替。
+    只移动下标，不复制盘口，代价与隐藏的档数成正比。
+
+    Returns:
+        (买盘隐藏档数, 卖盘隐藏档数)
+    """
+    key = key or (lambda price: price)
+    bids_hidden = asks_hidden = 0
+    toggle = True
+    while bids_hidden < len(bids) and asks_hidden < len(asks) \
+            and key(bids[bids_hidden]) >= key(asks[asks_hidden]):
+        hide_bid = toggle
+        if bid_weight is not None and ask_weight is not None:
+            bid_w, ask_w = bid_weight(bids_hidden), ask_weight(asks_hidden)
+            if bid_w != ask_w:
+                hide_bid = bid_w < ask_w
+        if hide_bid:
+            bids_hidden += 1
+        else:
+            asks_hidden += 1
+        toggle = not toggle
+    return bids_hidden, asks_hidden
+
+
+def level_timestamps(
+        venues: Iterable[Tuple[Any, Iterable[Any]]], reverse: bool, threshold: float, tick: Optional[Decimal] = None,
+) -> Dict[Union[float, Decimal], Any]:
+    """
+    合并盘口价位 -> 报出该价位的交易所中最新的快照时间戳，供 stale_first 策略使用。
+
+    只统计可能处于交叉区间的档位：买盘价格不低于 threshold（最低卖价）、卖盘价格不高于 threshold（最高买价）。
+    不分档时以 float 价格为键，避免逐档转换 Decimal；分档时以 bucket_price 后的 Decimal 为键。
+
+    Args:
+        venues: (交易所快照时间戳, 该侧各档价格) 列表，价格可以是 float、str 或 Decimal
+        reverse: True 表示买盘
+    """
+    timestamps: Dict[Union[float, Decimal], Any] = {}
+    for timestamp, prices in venues:
+        for price in prices:
+            value = float(price)
+            if (value < threshold) if reverse else (value > threshold):
+                continue
+            key = bucket_price(dec(repr(value)), tick, reverse) if tick else value
+            if key not in timestamps or timestamps[key] < timestamp:
+                timestamps[key] = timestamp
+    return timestamps
+
+
+def resolve_crossed(
+        bids: Sequence, asks: Sequence, policy: str = "alternating",
+        price: Optional[Callable] = None,
+        amount: Optional[Callable[[Sequence, int], Any]] = None,
+        venues: Optional[Callable[[bool], List[Tuple[Any, Iterable[Any]]]]] = None,
+        tick: Optional[Decimal] = None,
+) -> Tuple[int, int]:
+    """
+    按策略计算合并盘口交叉时需要隐藏的档数，策略见 CROSSED_POLICIES：
+
+    - alternating: 从买盘开始交替隐藏
+    - stale_first: 先隐藏报价交易所快照较旧的一侧，落后的交易所最先被剔除
+    - volume: 先隐藏数量较小的一侧，尽量少丢弃流动性
+
+    Args:
+        price: 档位 -> 价格，默认档位本身就是价格（AggregateSide）
+        amount: (盘口一侧, 下标) -> 数量，volume 策略需要
+        venues: 是否买盘 -> 各交易所 (快照时间戳, 该侧价格)，stale_first 策略需要
+        tick: 合并时使用的价格档位
+    """
+    price = price or (lambda level: level)
+    if not bids or not asks or price(bids[0]) < price(asks[0]):
+        return 0, 0
+    bid_weight = ask_weight = None
+    if policy == "volume" and amount is not None:
+        bid_weight, ask_weight = (lambda i: amount(bids, i)), (lambda i: amount(asks, i))
+    elif policy == "stale_first" and venues is not None:
+        bid_ts = level_timestamps(venues(True), True, float(price(asks[0])), tick)
+        ask_ts = level_timestamps(venues(False), False, float(price(bids[0])), tick)
+        level_key = price if tick else (lambda level: float(price(level)))
+        bid_weight = lambda i: bid_ts.get(level_key(bids[i]), 0)
+        ask_weight = lambda i: ask_ts.get(level_key(asks[i]), 0)
+    return crossed_levels(bids, asks, key=price, bid_weight=bid_weight, ask_weight=ask_weight)
+
+
+class AggregateSide(Sequence[Decimal]):
+    """
+    合并盘口的一侧：价格 -> 各交易所数量之和，另维护一个有序价格列表。
+
+    作为序列按从优到劣的顺序返回价格；买盘在列表中存负价格，使两侧都按升序即从优到劣排列。
+    """
+
+    def __init__(self, reverse: bool = False):
+        self.reverse = reverse
+        self.totals: Dict[Decimal, Decimal] = {}
+        self._keys: List[Decimal] = []
+
+    def apply(self, price: Decimal, delta: Decimal) -> None:
+        total = self.totals.get(price)
+        sort_key = -price if self.reverse else price
+        if total is None:
+            if not delta:
+                return
+            self.totals[price] = delta
+            bisect.insort(self._keys, sort_key)
+            return
+        total += delta
+        if total:
+            self.totals[price] = total
+        else:
+            del self.totals[price]
+            del self._keys[bisect.bisect_left(self._keys, sort_key)]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [-k for k in self._keys[index]] if self.reverse else self._keys[index]
+        sort_key = self._keys[index]
+        return -sort_key if self.reverse else sort_key
+
+    def entries(self, start: int = 0, depth: Optional[int] = None) -> List[OrderEntry]:
+        end = None if depth is None else start + depth
+        return [_order_entry(price, self.totals[price]) for price in self[start:end]]
+
+
+class IncrementalOrderbookMerger:
+    """
+    增量维护单个交易对的合并订单簿。
+
+    记录每个交易所上一次参与合并的快照（时间戳和各档位），新快照到来时只把变化的档位差值
+    累加到 AggregateSide；时间戳未变的交易所直接跳过。合并成本与变化的档位数成正比，而不是总深度。
+    """
+
+    def __init__(self, tick: Optional[Decimal] = None):
+        self.tick = tick
+        self.bids = AggregateSide(reverse=True)
+        self.asks = AggregateSide()
+        # exchange -> (timestamp, {price: amount} 买盘, {price: amount} 卖盘)
+        self._books: Dict[str, Tuple[Any, Dict[float, float], Dict[float, float]]] = {}
+
+    def _side_levels(self, entries) -> Dict[float, float]:
+        if isinstance(entries, OrderSide):
+            return dict(zip(entries.prices, entries.amounts))
+        return {float(e.price): float(e.amount) for e in entries}
+
+    def _apply_diff(self, side: AggregateSide, old: Dict[float, float], new: Dict[float, float]) -> int:
+        changed = 0
+        for price, amount in new.items():
+            old_amount = old.get(price)
+            if old_amount != amount:
+                delta = dec(repr(amount)) - (dec(repr(old_amount)) if old_amount is not None else 0)
+                side.apply(self._price_key(price, side.reverse), delta)
+                changed += 1
+        for price, old_amount in old.items():
+            if price not in new:
+                side.apply(self._price_key(price, side.reverse), -dec(repr(old_amount)))
+                changed += 1
+        return changed
+
+    def _price_key(self, price: float, reverse: bool) -> Decimal:
+        price = dec(repr(price))
+        return bucket_price(price, self.tick, reverse) if self.tick else price
+
+    def update(self, exchange: str, orderbook: Union[Orderbook, ColumnarOrderbook]) -> int:
+        """用交易所的最新快照更新合并盘口，返回变化的档位数；时间戳未变时返回 0"""
+        previous = self._books.get(exchange)
+        if previous is not None and previous[0] == orderbook.timestamp:
+            return 0
+        old_bids, old_asks = (previous[1], previous[2]) if previous is not None else ({}, {})
+        new_bids, new_asks = self._side_levels(orderbook.bids), self._side_levels(orderbook.asks)
+        changed = self._apply_diff(self.bids, old_bids, new_bids) + self._apply_diff(self.asks, old_asks, new_asks)
+        self._books[exchange] = (orderbook.timestamp, new_bids, new_asks)
+        return changed
+
+    def remove(self, exchange: str) -> int:
+        """交易所不再参与合并（下线或快照过期）时，扣除它的全部档位"""
+        previous = self._books.pop(exchange, None)
+        if previous is None:
+            return 0
+        return self._apply_diff(self.bids, previous[1], {}) + self._apply_diff(self.asks, previous[2], {})
+
+    def sync(self, orderbooks: Dict[str, Union[Orderbook, ColumnarOrderbook]]) -> int:
+        """以本轮读到的全部交易所快照为准更新，缺席的交易所被移除；返回变化的档位数"""
+        changed = sum(self.remove(exchange) for exchange in list(self._books) if exchange not in orderbooks)
+        for exchange, orderbook in orderbooks.items():
+            changed += self.update(exchange, orderbook)
+        return changed
+
+    def venues(self, reverse: bool) -> List[Tuple[Any, Iterable[float]]]:
+        """各交易所 (快照时间戳, 该侧价格)，供 level_timestamps 使用"""
+        return [(book[0], book[1] if reverse else book[2]) for book in self._books.values()]
+
+    def orderbook(self, bids_start: int = 0, asks_start: int = 0, depth: Optional[int] = None) -> Orderbook:
+        """从指定档位开始生成合并后的 Orderbook，只为输出的档位创建 OrderEntry"""
+        orderbook = Orderbook()
+        orderbook.bids = self.bids.entries(bids_start, depth)
+        orderbook.asks = self.asks.entries(asks_start, depth)
+        return orderbook
@@ -5,15 +5,18 @@ import asyncio
 import socket
 import sys
 import time
-from typing import Iterable, Optional, Set, List
+from typing import Dict, Iterable, Optional, Set, List
 
 from django.conf import settings
 
 from common.decorators import retry_on
 from common.helpers import search_limit, getLogger
-from apps.exchange.consts import SLEEP_CONFIG
-from apps.exchange.cache_ops import merge_orderbooks, set_24ticker, set_orderbook
+from common.log_sampling import HotPathLog
+from common.redis_client import close_async_redis
+from apps.exchange.consts import MERGED_ORDERBOOK_INCREMENTAL, SLEEP_CONFIG
+from apps.exchange.cache_ops import amerge_orderbooks, aset_24ticker, aset_orderbook, new_orderbook_merger
 from apps.exchange.models import Exchange, TradingPair
+from apps.exchange.orderbook_merge import IncrementalOrderbookMerger
 from apps.exchange.types import Orderbook
 from apps.exchange.ccxt_client import get_client
 
@@ -37,8 +40,12 @@ class CrawlerService(object):
         self.exchange_client = None
         self._initialize_client()
         self.logger = getLogger(f'crawler.service.{self.exchange_slug}')
+        # 抓取/合并循环按周期输出次数和耗时汇总，不逐次打印
+        self.hot_log = HotPathLog(self.logger)
         self.symbols: List[TradingPair] = []
         self.symbol_names: Set[str] = set()
+        # 增量合并模式下每个交易对持续维护的合并盘口
+        self.orderbook_mergers: Dict[str, IncrementalOrderbookMerger] = {}
 
     def _initialize_client(self):
         try:
@@ -83,18 +90,20 @@ class CrawlerService(object):
         self.init_symbols_of_exchange()
         loop = asyncio.get_event_loop()
         func = getattr(self, action_func)
-        loop.run_until_complete(func())
+        try:
+            loop.run_until_complete(func())
+        finally:
+            loop.run_until_complete(close_async_redis())
 
     @retry_on()
     async def fetch_24ticker(self, symbol: TradingPair) -> None:
-        self.logger.debug(f"Attempting fetch_24ticker for {symbol.symbol_display}")
         assert self.exchange_client is not None, f'{self} attribute exchange_client is None'
         try:
+            start = time.perf_counter()
             ticker = await self.exchange_client.fetch_ticker(symbol.symbol_display)
-            self.logger.debug(f"API call successful for {symbol.symbol_display}. Ticker data: {ticker}")
+            self.hot_log.record("fetch_ticker", time.perf_counter() - start)
             ticker["timestamp"] = time.time() * 1000
-            set_24ticker(self.exchange_slug, symbol.symbol_display, ticker)
-            self.logger.debug(f"set_24ticker completed for {symbol.symbol_display}")
+            await aset_24ticker(self.exchange_slug, symbol.symbol_display, ticker)
         except Exception as e:
             self.logger.error(f"Error during fetch_ticker API call or processing for {symbol.symbol_display}", exc_info=True)
             raise
@@ -110,12 +119,14 @@ class CrawlerService(object):
         else:
             slimit = search_limit(limit)
             assert slimit >= limit, f'slimit {slimit} must be greater than limit {limit}'
+            start = time.perf_counter()
             data = await self.exchange_client.fetch_order_book(symbol.symbol_display, limit=slimit)
+            self.hot_log.record("fetch_order_book", time.perf_counter() - start)
         ob = Orderbook.from_json(data)
         ob.bids = ob.bids[:limit]
         ob.asks = ob.asks[:limit]
         ob.source = "crawler@{HOSTNAME}"
-        set_orderbook(self.exchange_slug, symbol.symbol_display, ob.as_json())
+        await aset_orderbook(self.exchange_slug, symbol.symbol_display, ob.as_json())
 
     @retry_on()
     async def fetch_markets(self):
@@ -140,9 +151,7 @@ class CrawlerService(object):
             self.logger.warning("Symbols list is empty, crawler loop will not run.")
             return
         while True:
-            self.logger.debug(f"Starting new ticker fetch cycle for symbols: {self.symbol_names}")
             for symbol in self.symbols:
-                self.logger.debug(f"Processing symbol: {symbol.symbol_display}")
                 try:
                     await self.fetch_24ticker(symbol)
                 except Exception as e:
@@ -152,7 +161,7 @@ class CrawlerService(object):
             except KeyError:
                 self.logger.warning("'crawler_fetch_24tickers' not found in SLEEP_CONFIG, using default 60s")
                 sleep_time = 60
-            self.logger.debug(f"Ticker fetch cycle complete. Sleeping for {sleep_time} seconds.")
+            self.hot_log.record("ticker_cycle")
             await asyncio.sleep(sleep_time)
 
     async def crawler_fetch_orderbooks(self, limit: int = 15):
@@ -172,11 +181,6 @@ class CrawlerService(object):
         for symbol in self.symbols:
             try:
                 await self.fetch_orderbook(symbol, limit)
-                self.logger.debug(
-                    'Crawler %s %s fetch orderbooks succeed',
-                    self.exchange_slug,
-                    symbol.symbol_display
-                )
             except Exception as e:
                 self.logger.error(
                     'Crawler %s %s fetch orderbooks fail',
@@ -186,14 +190,28 @@ class CrawlerService(object):
                 sys.exit(1)
 
     async def merge_orderbooks(self, symbol: TradingPair):
-        await merge_orderbooks(symbol)
+        if not MERGED_ORDERBOOK_INCREMENTAL:
+            await amerge_orderbooks(symbol)
+            return
+        merger = self.orderbook_mergers.get(symbol.symbol_display)
+        if merger is None:
+            merger = self.orderbook_mergers[symbol.symbol_display] = new_orderbook_merger(symbol)
+        await amerge_orderbooks(symbol, merger)
+
+    async def _merge_symbol_orderbooks(self, symbol: TradingPair):
+        try:
+            start = time.perf_counter()
+            await self.merge_orderbooks(symbol)
+            self.hot_log.record("merge_orderbooks", time.perf_counter() - start)
+        except Exception as e:
+            # 合并中途失败时增量状态可能不完整，下一轮从头重建
+            self.orderbook_mergers.pop(symbol.symbol_display, None)
+            self.logger.error('%s orderbook merging failed' % symbol.symbol_display, exc_info=True)
 
     async def crawler_merge_orderbooks(self):
         while True:
-            for symbol in self.symbols:
-                try:
-                    await self.merge_orderbooks(symbol)
-                    self.logger.debug('%s orderbook is merged' % symbol.symbol_display)
-                except Exception as e:
-                    self.logger.error('%s orderbook merging failed' % symbol.symbol_display, exc_info=True)
+            # 各交易对的 Redis 读写互不依赖，一轮内并发进行；并发数受异步连接池大小限制
+            start = time.perf_counter()
+            await asyncio.gather(*(self._merge_symbol_orderbooks(symbol) for symbol in self.symbols))
+            self.hot_log.record("merge_cycle", time.perf_counter() - start)
             await asyncio.sleep(SLEEP_CONFIG['crawler_merge_orderbooks'])
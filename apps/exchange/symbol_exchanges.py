@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+交易对 -> 活跃中心化交易所名称的进程内缓存。
+
+合并订单簿每轮要为每个交易对确认哪些交易所参与合并。这里用一次联表查询取出全部交易对的
+活跃 Cex 市场，TTL 内和失效前不再访问数据库；Exchange、Market、TradingPair 在本进程内
+保存或删除时通过信号立即失效，其他进程的修改在 TTL 到期后生效。
+"""
+
+import threading
+import time
+from typing import Dict, FrozenSet, Optional
+
+from asgiref.sync import sync_to_async
+from django.db.models.signals import post_delete, post_save
+
+from apps.exchange.consts import SYMBOL_EXCHANGES_TTL
+from apps.exchange.models import CommonStatus, Exchange, ExchangeCate, Market, TradingPair
+
+
+class SymbolExchangeRegistry:
+    def __init__(self, ttl: float = SYMBOL_EXCHANGES_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._exchanges: Dict[int, FrozenSet[str]] = {}
+        self._loaded_at: Optional[float] = None
+
+    def _expired(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl
+
+    def _load(self) -> None:
+        exchanges: Dict[int, set] = {}
+        rows = Market.objects.filter(
+            exchange__exchange_category=ExchangeCate.CEX, exchange__status=CommonStatus.ACTIVE,
+        ).values_list("trading_pair_id", "exchange__name")
+        for trading_pair_id, exchange_name in rows:
+            exchanges.setdefault(trading_pair_id, set()).add(exchange_name)
+        self._exchanges = {pair_id: frozenset(names) for pair_id, names in exchanges.items()}
+        self._loaded_at = time.monotonic()
+
+    def refresh(self) -> None:
+        """缓存过期时重新加载全部交易对"""
+        with self._lock:
+            if self._expired():
+                self._load()
+
+    def get(self, trading_pair_id: int) -> FrozenSet[str]:
+        """交易对上活跃的中心化交易所名称"""
+        if self._expired():
+            self.refresh()
+        return self._exchanges.get(trading_pair_id, frozenset())
+
+    async def aget(self, trading_pair_id: int) -> FrozenSet[str]:
+        """get 的异步版本，只有需要重新加载时才切换到同步线程查询数据库"""
+        if self._expired():
+            await sync_to_async(self.refresh)()
+        return self._exchanges.get(trading_pair_id, frozenset())
+
+    def invalidate(self, **kwargs) -> None:
+        self._loaded_at = None
+
+
+symbol_exchanges = SymbolExchangeRegistry()
+
+for _model in (Exchange, Market, TradingPair):
+    post_save.connect(symbol_exchanges.invalidate, sender=_model, dispatch_uid=f"symbol_exchanges_{_model.__name__}")
+    post_delete.connect(symbol_exchanges.invalidate, sender=_model, dispatch_uid=f"symbol_exchanges_{_model.__name__}")
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from apps.exchange.cache_ops import (
+    OrderbookNotFound, aget_orderbook, aset_24ticker, aset_orderbook, get_24ticker, get_history_orderbook,
+    get_history_orderbook_lst, get_orderbook, get_snapshot_history, history_encoder, set_24ticker, set_orderbook,
+    set_orderbooks,
+)
+from apps.exchange.consts import (
+    EXCHANGE_ORDERBOOKS_KEY, EXCHANGE_TICKERS_KEY, NRDS_EXCHANGE_ORDERBOOKS_KEY, NRDS_EXCHANGE_ORDERBOOKS_LATEST_KEY,
+    NRDS_EXCHANGE_TICKERS_KEY, NRDS_EXCHANGE_TICKERS_LATEST_KEY, SNAPSHOT_HISTORY_DEFAULT_LIMIT,
+    SNAPSHOT_HISTORY_SECONDS,
+)
+from apps.exchange.orderbook_history import DELTA_PREFIX, KEYFRAME_PREFIX, HistoryEncoder, keyframes_key
+from apps.exchange.types import Orderbook
+from common.redis_client import close_async_redis, global_redis, local_redis
+
+EXCHANGE = 'test-exchange'
+SYMBOL = 'TEST/USDT'
+OTHER_SYMBOL = 'TEST2/USDT'
+
+
+class SnapshotTestCase(SimpleTestCase):
+    def setUp(self):
+        self.now = int(time.time())
+        self._cleanup()
+        self.addCleanup(self._cleanup)
+
+    def _cleanup(self):
+        for symbol in (SYMBOL, OTHER_SYMBOL):
+            local_redis().delete(*[key % (EXCHANGE, symbol) for key in (
+                NRDS_EXCHANGE_ORDERBOOKS_KEY, NRDS_EXCHANGE_ORDERBOOKS_LATEST_KEY,
+                NRDS_EXCHANGE_TICKERS_KEY, NRDS_EXCHANGE_TICKERS_LATEST_KEY,
+            )], keyframes_key(NRDS_EXCHANGE_ORDERBOOKS_KEY % (EXCHANGE, symbol)))
+            global_redis().delete(EXCHANGE_ORDERBOOKS_KEY % (EXCHANGE, symbol))
+            global_redis().delete(EXCHANGE_TICKERS_KEY % (EXCHANGE, symbol))
+
+
+class LatestSnapshotTests(SnapshotTestCase):
+    def _orderbook(self, seconds_ago, bid, offset_ms=0):
+        return {
+            'source': 'test',
+            'timestamp': (self.now - seconds_ago) * 1000 + offset_ms,
+            'bids': [[bid, 1]],
+            'asks': [[bid + 1, 1]],
+        }
+
+    def _set(self, seconds_ago, bid, offset_ms=0):
+        set_orderbook(EXCHANGE, SYMBOL, self._orderbook(seconds_ago, bid, offset_ms))
+
+    def test_newest_snapshot_is_returned(self):
+        for seconds_ago, bid in ((120, 100), (60, 101), (0, 102)):
+            self._set(seconds_ago, bid)
+        # 同一秒内的两个快照按毫秒时间戳取最新
+        self._set(0, 103, offset_ms=500)
+
+        self.assertEqual(get_orderbook(EXCHANGE, SYMBOL).bids[0].price, 103)
+        self.assertEqual(get_history_orderbook(EXCHANGE, SYMBOL, self.now - 30).bids[0].price, 101)
+
+        history = get_history_orderbook_lst(EXCHANGE, SYMBOL, limit=2)
+        self.assertEqual([ob.bids[0].price for ob in history], [102, 103])
+        self.assertEqual([ob.bids[0].price for ob in get_history_orderbook_lst(EXCHANGE, SYMBOL)],
+                         [100, 101, 102, 103])
+
+    def test_history_list_returns_whole_window(self):
+        count = SNAPSHOT_HISTORY_DEFAULT_LIMIT + 10
+        for i in range(count):
+            self._set(count - i, 100 + i)
+        history = get_history_orderbook_lst(EXCHANGE, SYMBOL)
+        self.assertEqual([ob.bids[0].price for ob in history], [100 + i for i in range(count)])
+        zkey = NRDS_EXCHANGE_ORDERBOOKS_KEY % (EXCHANGE, SYMBOL)
+        self.assertEqual(len(get_snapshot_history(zkey)), SNAPSHOT_HISTORY_DEFAULT_LIMIT)
+
+    def test_delayed_snapshot_only_enters_history(self):
+        self._set(0, 102)
+        self._set(30, 101)
+
+        self.assertEqual(get_orderbook(EXCHANGE, SYMBOL).bids[0].price, 102)
+        mirrored = json.loads(global_redis().get(EXCHANGE_ORDERBOOKS_KEY % (EXCHANGE, SYMBOL)))
+        self.assertEqual(mirrored['bids'], [[102, 1]])
+        self.assertEqual(len(get_history_orderbook_lst(EXCHANGE, SYMBOL)), 2)
+
+    def test_batch_write(self):
+        self._set(0, 102)
+        accepted = set_orderbooks(EXCHANGE, {SYMBOL: self._orderbook(10, 100), OTHER_SYMBOL: self._orderbook(0, 200)})
+
+        self.assertEqual(accepted, {SYMBOL: False, OTHER_SYMBOL: True})
+        self.assertEqual(get_orderbook(EXCHANGE, SYMBOL).bids[0].price, 102)
+        self.assertEqual(get_orderbook(EXCHANGE, OTHER_SYMBOL).bids[0].price, 200)
+
+    def test_stale_orderbook_beyond_window(self):
+        self._set(0, 102)
+        self.assertEqual(get_history_orderbook(EXCHANGE, SYMBOL, self.now + 5).bids[0].price, 102)
+        with self.assertRaises(OrderbookNotFound):
+            get_history_orderbook(EXCHANGE, SYMBOL, self.now + SNAPSHOT_HISTORY_SECONDS + 5)
+
+        # 交易所停止写入、最新快照的 hash 过期后，历史中超出窗口的快照不再作为当前订单簿
+        local_redis().delete(NRDS_EXCHANGE_ORDERBOOKS_LATEST_KEY % (EXCHANGE, SYMBOL))
+        self.assertEqual(get_orderbook(EXCHANGE, SYMBOL).bids[0].price, 102)
+        with mock.patch('time.time', return_value=self.now + SNAPSHOT_HISTORY_SECONDS + 60):
+            with self.assertRaises(OrderbookNotFound):
+                get_orderbook(EXCHANGE, SYMBOL)
+
+    def test_ticker_latest_key(self):
+        set_24ticker(EXCHANGE, SYMBOL, {'timestamp': self.now * 1000, 'last': 1.5})
+        set_24ticker(EXCHANGE, SYMBOL, {'timestamp': (self.now - 5) * 1000, 'last': 1.4})
+        self.assertEqual(get_24ticker(EXCHANGE, SYMBOL)['last'], 1.5)
+
+
+
+def _as_orderbook_json(data):
+    return Orderbook.from_json(dict(data, exchange=EXCHANGE)).as_json()
+
+
+class HistoryDeltaTests(SnapshotTestCase):
+    zkey = NRDS_EXCHANGE_ORDERBOOKS_KEY % (EXCHANGE, SYMBOL)
+
+    def _snapshot(self, i):
+        # 每个快照改动买一的数量，并轮换最差一档卖盘
+        return {
+            'source': 'test',
+            'timestamp': (self.now - 60) * 1000 + i * 100,
+            'bids': [[100, 1 + i], [99, 2], [98, 3]],
+            'asks': [[101, 1], [102, 2], [103 + i % 2, 3]],
+        }
+
+    def test_history_is_reconstructed_from_deltas(self):
+        count = history_encoder.keyframe_interval + 5
+        for i in range(count):
+            set_orderbook(EXCHANGE, SYMBOL, self._snapshot(i))
+
+        members = [member.decode() for member in local_redis().zrange(self.zkey, 0, -1)]
+        self.assertEqual(local_redis().zcard(keyframes_key(self.zkey)), 2)
+        self.assertEqual(sum(member.startswith(DELTA_PREFIX) for member in members), count - 2)
+
+        history = get_history_orderbook_lst(EXCHANGE, SYMBOL)
+        self.assertEqual([ob.as_json() for ob in history], [_as_orderbook_json(self._snapshot(i)) for i in range(count)])
+        # now - 59 这一秒内最后一个快照是第 19 个，位于第二个关键帧之前，从第一个关键帧重放
+        self.assertEqual(get_history_orderbook(EXCHANGE, SYMBOL, self.now - 59).as_json(),
+                         _as_orderbook_json(self._snapshot(19)))
+
+    def test_foreign_write_falls_back_to_keyframe(self):
+        set_orderbook(EXCHANGE, SYMBOL, self._snapshot(0))
+        # 另一个进程写入了更新的快照，本进程下一个差值的基准不再是最新快照
+        with mock.patch('apps.exchange.cache_ops.history_encoder', HistoryEncoder()):
+            set_orderbook(EXCHANGE, SYMBOL, self._snapshot(1))
+        set_orderbook(EXCHANGE, SYMBOL, self._snapshot(2))
+
+        members = [member.decode() for member in local_redis().zrange(self.zkey, 0, -1)]
+        self.assertTrue(all(member.startswith(KEYFRAME_PREFIX) for member in members))
+        history = get_history_orderbook_lst(EXCHANGE, SYMBOL)
+        self.assertEqual([ob.as_json() for ob in history], [_as_orderbook_json(self._snapshot(i)) for i in range(3)])
+
+
+    def test_equal_timestamp_is_keyframe(self):
+        set_orderbook(EXCHANGE, SYMBOL, self._snapshot(0))
+        same_timestamp = dict(self._snapshot(1), timestamp=self._snapshot(0)['timestamp'])
+        set_orderbook(EXCHANGE, SYMBOL, same_timestamp)
+        set_orderbook(EXCHANGE, SYMBOL, self._snapshot(2))
+        set_orderbook(EXCHANGE, SYMBOL, self._snapshot(3))
+
+        members = [member.decode() for member in local_redis().zrange(self.zkey, 0, -1)]
+        self.assertEqual([member[:2] for member in members], [KEYFRAME_PREFIX] * 3 + [DELTA_PREFIX])
+        history = get_history_orderbook_lst(EXCHANGE, SYMBOL)
+        self.assertEqual(len(history), 4)
+        self.assertEqual([ob.as_json() for ob in history[2:]],
+                         [_as_orderbook_json(self._snapshot(i)) for i in (2, 3)])
+
+
+class AsyncCacheOpsTests(SnapshotTestCase):
+    def _orderbook(self, bid, offset_ms=0):
+        return {'source': 'test', 'timestamp': self.now * 1000 + offset_ms, 'bids': [[bid, 1]], 'asks': [[bid + 1, 1]]}
+
+    async def test_async_api_matches_sync_api(self):
+        try:
+            await self._check_async_api()
+        finally:
+            await close_async_redis()
+
+    async def _check_async_api(self):
+        # 两个交易对的写入并发进行
+        await asyncio.gather(aset_orderbook(EXCHANGE, SYMBOL, self._orderbook(100)),
+                             aset_orderbook(EXCHANGE, OTHER_SYMBOL, self._orderbook(200)))
+        await aset_orderbook(EXCHANGE, SYMBOL, self._orderbook(101, offset_ms=10))
+        await aset_24ticker(EXCHANGE, SYMBOL, {'timestamp': self.now * 1000, 'last': 1.5})
+
+        orderbooks = await asyncio.gather(aget_orderbook(EXCHANGE, SYMBOL), aget_orderbook(EXCHANGE, OTHER_SYMBOL))
+        self.assertEqual([ob.bids[0].price for ob in orderbooks], [101, 200])
+        self.assertEqual(orderbooks[0].as_json(), get_orderbook(EXCHANGE, SYMBOL).as_json())
+        self.assertEqual(get_24ticker(EXCHANGE, SYMBOL)['last'], 1.5)
+        # 异步写入与同步写入共用差值编码状态和历史格式
+        self.assertEqual([ob.bids[0].price for ob in get_history_orderbook_lst(EXCHANGE, SYMBOL)], [100, 101])
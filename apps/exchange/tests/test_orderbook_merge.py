@@ -0,0 +1,158 @@
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from apps.exchange.cache_ops import _incremental_orderbook, _uncrossed_orderbook, merge_symbol_orderbooks
+from apps.exchange.orderbook_merge import (
+    IncrementalOrderbookMerger, crossed_levels, merge_exchange_orderbooks, merge_order_sides, resolve_crossed
+)
+from apps.exchange.types import ColumnarOrderbook, Orderbook
+
+
+def _orderbook(bids, asks):
+    return Orderbook.from_json({'timestamp': 1, 'bids': bids, 'asks': asks})
+
+
+class OrderbookMergeTests(SimpleTestCase):
+    def setUp(self):
+        self.orderbooks = [
+            _orderbook([[101, 1], [100, 2], [99, 1]], [[102, 1], [103, 2]]),
+            _orderbook([[100.5, 1], [100, 3]], [[102, 2], [102.5, 1], [104, 1]]),
+            _orderbook([], [[103, 0.5]]),
+        ]
+
+    def test_same_price_levels_are_summed(self):
+        merged = merge_exchange_orderbooks(self.orderbooks)
+        self.assertEqual(merged.as_json()['bids'], [['101.000000000000000000', 1.0], ['100.500000000000000000', 1.0],
+                                                    ['100.000000000000000000', 5.0], ['99.000000000000000000', 1.0]])
+        self.assertEqual([order.price for order in merged.asks], [Decimal(p) for p in ('102', '102.5', '103', '104')])
+        self.assertEqual([order.amount for order in merged.asks], [Decimal(a) for a in ('3', '1', '2.5', '1')])
+
+    def test_tick_bucketing_and_depth(self):
+        merged = merge_exchange_orderbooks(self.orderbooks, tick=Decimal('2'), depth=2)
+        # 买盘向下取整、卖盘向上取整
+        self.assertEqual([(order.price, order.amount) for order in merged.bids],
+                         [(Decimal('100'), Decimal('7')), (Decimal('98'), Decimal('1'))])
+        self.assertEqual([(order.price, order.amount) for order in merged.asks],
+                         [(Decimal('102'), Decimal('3')), (Decimal('104'), Decimal('4.5'))])
+
+    def test_unsorted_side_is_sorted_first(self):
+        side = _orderbook([], [[105, 1], [101, 1]]).asks
+        merged = merge_order_sides([side, self.orderbooks[0].asks])
+        self.assertEqual([order.price for order in merged], [Decimal(p) for p in ('101', '102', '103', '105')])
+
+
+def _levels(orderbook):
+    asj = orderbook.as_json()
+    return asj['bids'], asj['asks']
+
+
+class IncrementalOrderbookMergerTests(SimpleTestCase):
+    def _columnar(self, bids, asks, timestamp):
+        return ColumnarOrderbook.from_json({'timestamp': timestamp, 'bids': bids, 'asks': asks})
+
+    def test_matches_full_merge_after_updates(self):
+        merger = IncrementalOrderbookMerger()
+        books = {
+            'a': self._columnar([[101, 1], [100, 2]], [[102, 1], [103, 2]], 1),
+            'b': self._columnar([[100, 3], [99, 1]], [[102, 2], [104, 1]], 1),
+        }
+        self.assertEqual(merger.sync(books), 8)
+        # 时间戳不变的交易所被跳过
+        self.assertEqual(merger.sync(books), 0)
+
+        books['a'] = self._columnar([[101, 1], [100.5, 4]], [[102, 0.5], [103, 2]], 2)
+        self.assertEqual(merger.sync(books), 3)
+        self.assertEqual(_levels(merger.orderbook()), _levels(merge_exchange_orderbooks(list(books.values()))))
+
+        del books['b']
+        merger.sync(books)
+        self.assertEqual(_levels(merger.orderbook()), _levels(books['a']))
+
+    def test_tick_bucketing(self):
+        merger = IncrementalOrderbookMerger(tick=Decimal('2'))
+        books = {'a': self._columnar([[101, 1], [100.5, 2], [99, 1]], [[102.5, 1]], 1)}
+        merger.sync(books)
+        self.assertEqual(_levels(merger.orderbook()),
+                         _levels(merge_exchange_orderbooks(list(books.values()), tick=Decimal('2'))))
+
+    def test_crossed_levels_are_skipped_by_index(self):
+        merger = IncrementalOrderbookMerger()
+        merger.sync({
+            'a': self._columnar([[105, 1], [104, 1], [100, 1]], [[106, 1]], 1),
+            'b': self._columnar([[99, 1]], [[103, 1], [104.5, 1], [107, 1]], 1),
+        })
+        # 先隐藏买一 105，再隐藏卖一 103，此时 104 < 104.5
+        self.assertEqual(crossed_levels(merger.bids, merger.asks), (1, 1))
+        orderbook = merger.orderbook(1, 1)
+        self.assertEqual([e.price for e in orderbook.bids], [Decimal('104'), Decimal('100'), Decimal('99')])
+        self.assertEqual([e.price for e in orderbook.asks], [Decimal('104.5'), Decimal('106'), Decimal('107')])
+
+
+class CrossedPolicyTests(SimpleTestCase):
+    def setUp(self):
+        # a 为落后的交易所，报价整体高于 b
+        self.merger = IncrementalOrderbookMerger()
+        self.merger.sync({
+            'a': ColumnarOrderbook.from_json({'timestamp': 1, 'bids': [[105, 5], [104, 5]], 'asks': [[106, 5]]}),
+            'b': ColumnarOrderbook.from_json({'timestamp': 2, 'bids': [[100, 1]], 'asks': [[101, 1], [102, 1]]}),
+        })
+
+    def _resolve(self, policy):
+        merger = self.merger
+        return resolve_crossed(merger.bids, merger.asks, policy,
+                               amount=lambda side, i: side.totals[side[i]], venues=merger.venues)
+
+    def test_policies(self):
+        self.assertEqual(self._resolve('alternating'), (2, 1))
+        # 只隐藏落后交易所 a 的买盘
+        self.assertEqual(self._resolve('stale_first'), (2, 0))
+        # 卖盘数量较小，先隐藏卖盘
+        self.assertEqual(self._resolve('volume'), (0, 2))
+
+    def test_uncrossed_book_hides_nothing(self):
+        bids, asks = [Decimal('100')], [Decimal('101')]
+        for policy in ('alternating', 'stale_first', 'volume'):
+            self.assertEqual(resolve_crossed(bids, asks, policy, amount=lambda side, i: 1,
+                                             venues=lambda reverse: []), (0, 0))
+
+    def test_equal_weights_alternate(self):
+        bids, asks = [Decimal('103'), Decimal('102')], [Decimal('101'), Decimal('102')]
+        self.assertEqual(crossed_levels(bids, asks, bid_weight=lambda i: 1, ask_weight=lambda i: 1),
+                         crossed_levels(bids, asks))
+
+    def test_full_merge_levels(self):
+        # 全量合并路径：价格来自 OrderEntry，时间戳来自 messages['groups'] 中的字符串价格
+        orderbook = merge_exchange_orderbooks([
+            _orderbook([[105, 5], [104, 5]], [[106, 5]]),
+            _orderbook([[100, 1]], [[101, 1], [102, 1]]),
+        ])
+        groups = [(1, ['105.0', '104.0']), (2, ['100.0'])], [(1, ['106.0']), (2, ['101.0', '102.0'])]
+        hidden = resolve_crossed(orderbook.bids, orderbook.asks, 'stale_first', price=lambda e: e.price,
+                                 venues=lambda reverse: groups[0] if reverse else groups[1])
+        self.assertEqual(hidden, (2, 0))
+
+    def test_incremental_matches_full_with_depth(self):
+        # 交叉盘 + 深度截断：两条路径都先隐藏交叉档位再截断，结果相同
+        books = {
+            'a': ColumnarOrderbook.from_json({'timestamp': 1, 'bids': [[105, 1], [104, 1], [100, 1], [98, 1]],
+                                              'asks': [[106, 1], [108, 1]]}),
+            'b': ColumnarOrderbook.from_json({'timestamp': 2, 'bids': [[99, 1], [97, 1]],
+                                              'asks': [[103, 1], [104.5, 1], [107, 1]]}),
+        }
+        symbol = SimpleNamespace(symbol_display='TEST/USDT')
+        for policy in ('alternating', 'stale_first', 'volume'):
+            with self.subTest(policy=policy), \
+                    mock.patch('apps.exchange.cache_ops.MERGED_ORDERBOOK_DEPTH', 3), \
+                    mock.patch('apps.exchange.cache_ops.MERGED_ORDERBOOK_CROSSED_POLICY', policy):
+                merger = IncrementalOrderbookMerger()
+                merger.sync(books)
+                incremental = _incremental_orderbook(symbol, merger, {})
+                full = _uncrossed_orderbook(symbol, merge_symbol_orderbooks('TEST/USDT', list(books.values())), {
+                    'groups': [{'timestamp': ob.timestamp, 'detail': ob.as_json()} for ob in books.values()],
+                })
+                self.assertEqual(_levels(incremental), _levels(full))
+                self.assertEqual(len(full.bids), 3)
+                self.assertEqual(len(full.asks), 3)
@@ -0,0 +1,98 @@
+import time
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+
+from apps.exchange.cache_ops import amerge_orderbooks, new_orderbook_merger, set_orderbook
+from apps.exchange.consts import (
+    EXCHANGE_ORDERBOOKS_KEY, NRDS_EXCHANGE_ORDERBOOKS_KEY, NRDS_EXCHANGE_ORDERBOOKS_LATEST_KEY,
+    NRDS_SYMBOL_MERGE_ORDERBOOKS_KEY, NRDS_SYMBOL_MERGE_ORDERBOOKS_LATEST_KEY, SYMBOL_MERGE_ORDERBOOKS_KEY,
+)
+from apps.exchange.models import Asset, Exchange, Market, TradingPair
+from apps.exchange.orderbook_history import keyframes_key
+from apps.exchange.symbol_exchanges import symbol_exchanges
+from common.redis_client import close_async_redis, global_redis, local_redis
+
+SYMBOL_COUNT = 200
+EXCHANGES = ('registry-a', 'registry-b', 'registry-down')
+
+
+class SymbolExchangeRegistryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        usdt = Asset.objects.create(symbol='RUSDT', name='Registry USDT')
+        bases = Asset.objects.bulk_create([Asset(symbol=f'R{i}', name=f'R{i}') for i in range(SYMBOL_COUNT)])
+        cls.pairs = TradingPair.objects.bulk_create([
+            TradingPair(symbol_display=f'R{i}/RUSDT', base_asset=base, quote_asset=usdt)
+            for i, base in enumerate(bases)
+        ])
+        exchanges = [Exchange.objects.create(name=name, slug=name) for name in EXCHANGES]
+        exchanges[-1].status = 'Down'
+        exchanges[-1].save()
+        Market.objects.bulk_create([
+            Market(exchange=exchange, trading_pair=pair, market_identifier=f'{exchange.slug}_{pair.id}',
+                   market_symbol=pair.symbol_display)
+            for pair in cls.pairs for exchange in exchanges
+        ])
+
+    def setUp(self):
+        symbol_exchanges.invalidate()
+        self.addCleanup(symbol_exchanges.invalidate)
+        self.addCleanup(self._cleanup)
+        config = {pair.symbol_display: {name: {} for name in EXCHANGES} for pair in self.pairs}
+        settings_override = override_settings(MERGE_SYMBOL_CONFIG=config)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        now = int(time.time() * 1000)
+        for pair in self.pairs[:2]:
+            for name in EXCHANGES:
+                set_orderbook(name, pair.symbol_display, {
+                    'source': 'test', 'timestamp': now, 'bids': [[100, 1]], 'asks': [[101, 1]],
+                })
+
+    def _cleanup(self):
+        for pair in self.pairs:
+            zkey = NRDS_SYMBOL_MERGE_ORDERBOOKS_KEY % pair.symbol_display
+            local_redis().delete(zkey, keyframes_key(zkey), NRDS_SYMBOL_MERGE_ORDERBOOKS_LATEST_KEY % pair.symbol_display)
+            global_redis().delete(SYMBOL_MERGE_ORDERBOOKS_KEY % pair.symbol_display)
+        for pair in self.pairs[:2]:
+            for name in EXCHANGES:
+                zkey = NRDS_EXCHANGE_ORDERBOOKS_KEY % (name, pair.symbol_display)
+                local_redis().delete(zkey, keyframes_key(zkey),
+                                     NRDS_EXCHANGE_ORDERBOOKS_LATEST_KEY % (name, pair.symbol_display))
+                global_redis().delete(EXCHANGE_ORDERBOOKS_KEY % (name, pair.symbol_display))
+
+    def _merge_cycle(self, mergers=None):
+        async_to_sync(self._amerge_cycle)(mergers)
+
+    async def _amerge_cycle(self, mergers):
+        try:
+            for pair in self.pairs:
+                await amerge_orderbooks(pair, mergers and mergers[pair.id])
+        finally:
+            await close_async_redis()
+
+    def test_merge_cycle_queries(self):
+        # 冷启动：一次联表查询加载全部交易对
+        with self.assertNumQueries(1):
+            self._merge_cycle()
+        with self.assertNumQueries(0):
+            self._merge_cycle()
+        mergers = {pair.id: new_orderbook_merger(pair) for pair in self.pairs}
+        with self.assertNumQueries(0):
+            self._merge_cycle(mergers)
+
+        # 下线的交易所不参与合并
+        self.assertEqual(symbol_exchanges.get(self.pairs[0].id), frozenset(EXCHANGES[:2]))
+        merged = global_redis().get(SYMBOL_MERGE_ORDERBOOKS_KEY % self.pairs[0].symbol_display)
+        self.assertIn('"bids": [["100.000000000000000000", 2.0]]', merged)
+
+    def test_model_changes_invalidate(self):
+        symbol_exchanges.get(self.pairs[0].id)
+        exchange = Exchange.objects.get(name=EXCHANGES[1])
+        exchange.status = 'Down'
+        exchange.save()
+        with self.assertNumQueries(1):
+            self._merge_cycle()
+        self.assertEqual(symbol_exchanges.get(self.pairs[0].id), frozenset(EXCHANGES[:1]))
@@ -0,0 +1,37 @@
+from decimal import Decimal
+
+from django.test import SimpleTestCase
+
+from apps.exchange.orderbook_merge import merge_exchange_orderbooks
+from apps.exchange.types import ColumnarOrderbook, Orderbook
+
+SNAPSHOT = {
+    'timestamp': 1700000000000,
+    'exchange': 'binance',
+    'source': 'crawler',
+    'bids': [[30000.5, 1.25], ['29999.9', 0.5], [29990, 3]],
+    'asks': [[30001, 0.75], [30002.25, 2]],
+}
+
+
+class ColumnarOrderbookTests(SimpleTestCase):
+    def test_matches_decimal_orderbook(self):
+        columnar = ColumnarOrderbook.from_json(SNAPSHOT)
+        orderbook = Orderbook.from_json(SNAPSHOT)
+
+        self.assertEqual(columnar.as_json(), orderbook.as_json())
+        self.assertEqual(columnar.mid_price(), orderbook.mid_price())
+        self.assertEqual(columnar.to_orderbook().as_json(), orderbook.as_json())
+        self.assertEqual([e.price for e in columnar.trading_entries('BUY')], [e.price for e in orderbook.asks])
+        self.assertEqual(columnar.selfie_entries('BUY')[1].price, Decimal('29999.9'))
+
+    def test_slicing_keeps_columnar_sides(self):
+        columnar = ColumnarOrderbook.from_json(SNAPSHOT)
+        columnar.bids = columnar.bids[:2]
+        self.assertEqual(len(columnar.bids), 2)
+        self.assertEqual(list(columnar.bids.prices), [30000.5, 29999.9])
+
+    def test_merge_accepts_columnar_orderbooks(self):
+        books = [ColumnarOrderbook.from_json(SNAPSHOT), Orderbook.from_json(SNAPSHOT)]
+        merged = merge_exchange_orderbooks(books)
+        self.assertEqual([e.amount for e in merged.bids], [Decimal('2.5'), Decimal('1'), Decimal('6')])
@@ -1,7 +1,8 @@
 import time
+from array import array
 from datetime import datetime
 from decimal import Decimal
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
 
 import ntplib
 from dateutil.parser import parse
@@ -81,6 +82,16 @@ class OrderEntry:
         return '[{}, {}]'.format(self.price_str, self.amount)
 
 
+def _orderbook_timestamp(timestamp: Union[int, float, None]) -> Union[int, float]:
+    if timestamp:
+        return timestamp
+    try:
+        ntp_time = ntplib.NTPClient().request(settings.NTP_TIME_SERVER).tx_time
+        return int(ntp_time * 1000)  # ms
+    except Exception:
+        return time.time() * 1000
+
+
 class Orderbook:
     timestamp: Union[int, float, None]
     bids: List[OrderEntry]
@@ -111,13 +122,7 @@ class Orderbook:
         ob.datetime = data.get('datetime')
         ob.source = data.get('source')
 
-        ob.timestamp = data['timestamp']
-        if not ob.timestamp:
-            try:
-                ntp_time = ntplib.NTPClient().request(settings.NTP_TIME_SERVER).tx_time
-                ob.timestamp = int(ntp_time * 1000)  # ms
-            except Exception:
-                ob.timestamp = time.time() * 1000
+        ob.timestamp = _orderbook_timestamp(data['timestamp'])
         return ob
 
     @classmethod
@@ -161,6 +166,147 @@ class Orderbook:
             return self.bids
 
 
+class OrderSide(Sequence[OrderEntry]):
+    """
+    盘口一侧的列式存储：价格和数量分别存放在 float64 数组中。
+
+    ccxt 返回的价格和数量本身就是 float，存成 float64 不损失精度；
+    只有按下标或迭代取出档位时才转换成带 Decimal 的 OrderEntry。
+    """
+    __slots__ = ('prices', 'amounts')
+
+    def __init__(self, prices: Optional[array] = None, amounts: Optional[array] = None):
+        self.prices = prices if prices is not None else array('d')
+        self.amounts = amounts if amounts is not None else array('d')
+
+    @classmethod
+    def from_json(cls, data: List[Any]) -> 'OrderSide':
+        side = cls()
+        for item in data:
+            side.prices.append(float(item[0]))
+            side.amounts.append(float(item[1]))
+        return side
+
+    @classmethod
+    def from_entries(cls, entries: Sequence[OrderEntry]) -> 'OrderSide':
+        if isinstance(entries, OrderSide):
+            return entries
+        return cls(array('d', (float(e.price) for e in entries)), array('d', (float(e.amount) for e in entries)))
+
+    def _entry(self, index: int) -> OrderEntry:
+        order = OrderEntry()
+        order.price = dec(repr(self.prices[index]))
+        order.amount = dec(repr(self.amounts[index]))
+        return order
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return OrderSide(self.prices[index], self.amounts[index])
+        return self._entry(index)
+
+    def __iter__(self) -> Iterator[OrderEntry]:
+        for index in range(len(self.prices)):
+            yield self._entry(index)
+
+    def is_sorted(self, reverse: bool = False) -> bool:
+        prices = self.prices
+        if reverse:
+            return all(a >= b for a, b in zip(prices, prices[1:]))
+        return all(a <= b for a, b in zip(prices, prices[1:]))
+
+    def as_json(self) -> List[List[Any]]:
+        return [['{:f}'.format(dec(repr(p))), a] for p, a in zip(self.prices, self.amounts)]
+
+
+class ColumnarOrderbook:
+    """
+    Orderbook 的列式版本，从 Redis 读出的快照直接解析成 float 数组，不逐档创建 Decimal。
+
+    对外接口与 Orderbook 一致（bids/asks 可迭代出 OrderEntry、mid_price、selfie_entries、trading_entries），
+    Decimal 只在真正取用某一档时生成。
+    """
+    timestamp: Union[int, float, None]
+    exchange: Optional[str] = None
+    source: Optional[str] = None
+    nonce: Optional[str] = None
+    datetime: Optional[str] = None
+
+    def __init__(self):
+        self._bids = OrderSide()
+        self._asks = OrderSide()
+        self.timestamp = time.time() * 1000
+        self.exchange = None
+
+    @property
+    def bids(self) -> OrderSide:
+        return self._bids
+
+    @bids.setter
+    def bids(self, entries: Sequence[OrderEntry]) -> None:
+        self._bids = OrderSide.from_entries(entries)
+
+    @property
+    def asks(self) -> OrderSide:
+        return self._asks
+
+    @asks.setter
+    def asks(self, entries: Sequence[OrderEntry]) -> None:
+        self._asks = OrderSide.from_entries(entries)
+
+    def mid_price(self) -> Decimal:
+        return self.asks[0].price / d2 + self.bids[0].price / d2
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> 'ColumnarOrderbook':
+        ob = ColumnarOrderbook()
+        ob._bids = OrderSide.from_json(data['bids'])
+        ob._asks = OrderSide.from_json(data['asks'])
+        ob.exchange = data.get('exchange', '')
+        ob.nonce = data.get('nonce')
+        ob.datetime = data.get('datetime')
+        ob.source = data.get('source')
+        ob.timestamp = _orderbook_timestamp(data['timestamp'])
+        return ob
+
+    def to_orderbook(self) -> Orderbook:
+        ob = Orderbook()
+        ob.bids = list(self.bids)
+        ob.asks = list(self.asks)
+        ob.timestamp = self.timestamp
+        ob.exchange = self.exchange
+        ob.source = self.source
+        ob.nonce = self.nonce
+        ob.datetime = self.datetime
+        return ob
+
+    def as_json(self) -> Dict[str, Any]:
+        asj = {
+            'timestamp': self.timestamp,
+            'bids': self.bids.as_json(),
+            'asks': self.asks.as_json(),
+        }
+        for attr in ('exchange', 'nonce', 'datetime', 'source'):
+            value = getattr(self, attr)
+            if value:
+                asj[attr] = value
+        return asj
+
+    def selfie_entries(self, side: str) -> OrderSide:
+        if side == 'BUY':
+            return self.bids
+        else:
+            return self.asks
+
+    def trading_entries(self, side: str) -> OrderSide:
+        if side == 'BUY':
+            return self.asks
+        else:
+            return self.bids
+
+
 class OrderBookL2(object):
     id: int
     symbol: str
@@ -2,28 +2,74 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+import time
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from decimal import Decimal
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple, Union
 
 import ccxt.async_support as async_ccxt
 
-from apps.price_oracle.constants import STABLECOIN_SYMBOLS, EXCHANGE_PRIORITY
+from apps.price_oracle.constants import (
+    ADAPTER_MAX_CONSECUTIVE_FAILURES, CCXT_MARKETS_RELOAD_INTERVAL, STABLECOIN_SYMBOLS, EXCHANGE_PRIORITY,
+)
 from common.helpers import getLogger
 
 logger = getLogger(__name__)
 
+# 计价货币的集合查找，过滤 fetch_tickers 结果时使用
+STABLECOIN_SET = frozenset(STABLECOIN_SYMBOLS)
+
+Number = Union[Decimal, float]
+
 
 @dataclass
 class PriceData:
-    """价格数据结构"""
+    """价格数据结构。CCXT 适配器直接使用 float，持久化时再转换为 Decimal"""
     symbol: str  # BTC/USDT
     base_asset: str  # BTC
     quote_asset: str  # USDT
-    price: Decimal
-    volume_24h: Optional[Decimal] = None
-    price_change_24h: Optional[Decimal] = None
+    price: Number
+    volume_24h: Optional[Number] = None
+    price_change_24h: Optional[Number] = None
+
+
+def _to_float(value) -> Optional[float]:
+    """CCXT 解析后的字段通常已经是 float 或 None，只有其他类型才转换"""
+    if value is None or type(value) is float:
+        return value
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def normalize_tickers(tickers: Dict[str, Dict]) -> Tuple[List[PriceData], int]:
+    """
+    把 fetch_tickers 的结果批量转换为稳定币计价的价格，返回 (价格列表, 稳定币交易对数量)。
+
+    先只按交易对符号在 STABLECOIN_SET 中查找计价货币，非稳定币交易对不再读取 ticker；
+    价格、成交量和涨跌幅保持 float，不再构造 Decimal，持久化时再转换。
+    """
+    prices = []
+    stablecoin_pairs = 0
+    for symbol, ticker in tickers.items():
+        # 分割交易对，例如：BTC/USDT -> (BTC, USDT)
+        base, _, quote = symbol.partition('/')
+        if quote not in STABLECOIN_SET or not ticker or 'symbol' not in ticker:
+            continue
+        last = ticker.get('last')
+        if not last:
+            continue
+        stablecoin_pairs += 1
+
+        price = _to_float(last)
+        # 同时排除无法解析的价格和 NaN
+        if price is None or not price > 0:
+            continue
+        prices.append(PriceData(symbol, base, quote, price,
+                                _to_float(ticker.get('quoteVolume')), _to_float(ticker.get('percentage'))))
+    return prices, stablecoin_pairs
 
 
 class ExchangeAdapter(ABC):
@@ -32,12 +78,18 @@ class ExchangeAdapter(ABC):
     def __init__(self, exchange_id: str):
         self.exchange_id = exchange_id
         self.client: Optional[async_ccxt.Exchange] = None
+        # 连续获取失败的次数，AdapterPool 据此重建适配器
+        self.consecutive_failures = 0
 
     @abstractmethod
     async def get_prices(self) -> List[PriceData]:
         """获取以稳定币计价的资产价格数据"""
         pass
 
+    async def reload_markets(self):
+        """重新加载市场信息，常驻的适配器由 AdapterPool 定期调用"""
+        pass
+
     async def close(self):
         """关闭连接"""
         if self.client:
@@ -52,6 +104,7 @@ class CCXTAdapter(ExchangeAdapter):
 
     def __init__(self, exchange_id: str):
         super().__init__(exchange_id)
+        self._last_request_at: Optional[float] = None
         self._create_client()
 
     def _create_client(self):
@@ -88,6 +141,7 @@ class CCXTAdapter(ExchangeAdapter):
         """获取价格数据"""
         if not self.client:
             logger.warning(f"CCXT客户端未初始化: {self.exchange_id}")
+            self.consecutive_failures += 1
             return []
 
         try:
@@ -95,50 +149,16 @@ class CCXTAdapter(ExchangeAdapter):
             logger.debug(f"开始获取 {self.exchange_id} tickers...")
 
             # YoBit 需要特殊参数
+            self._refill_rate_limit()
             if self.exchange_id == 'yobit':
                 tickers = await self.client.fetch_tickers(params={"all": True})
             else:
                 tickers = await self.client.fetch_tickers()
+            self._last_request_at = time.monotonic()
 
             logger.debug(f"{self.exchange_id} 原始获取到 {len(tickers)} 个tickers")
 
-            prices = []
-            stablecoin_pairs = 0
-
-            for symbol, ticker in tickers.items():
-                # 基础检查
-                if not ticker or 'symbol' not in ticker or not ticker.get('last'):
-                    continue
-
-                # 分割交易对，例如：BTC/USDT -> (BTC, USDT)
-                base, quote = symbol.split('/', 1)
-
-                # 只保留稳定币计价的交易对
-                if quote not in STABLECOIN_SYMBOLS:
-                    continue
-
-                stablecoin_pairs += 1
-
-                # 提取价格信息
-                try:
-                    price = self._extract_price(ticker)
-                    if price is None or price <= 0:
-                        logger.debug(f"{self.exchange_id} {symbol}: 价格无效 {price}")
-                        continue
-
-                    price_data = PriceData(
-                        symbol=symbol,  # 使用原始符号格式（现货）
-                        base_asset=base,
-                        quote_asset=quote,
-                        price=Decimal(str(price)),
-                        volume_24h=self._safe_decimal(ticker.get('quoteVolume')),
-                        price_change_24h=self._safe_decimal(ticker.get('percentage'))
-                    )
-                    prices.append(price_data)
-
-                except (ValueError, TypeError, Exception) as e:
-                    logger.debug(f"解析价格数据失败 {symbol}: {e}")
-                    continue
+            prices, stablecoin_pairs = normalize_tickers(tickers)
 
             logger.info(f"{self.exchange_id} 获取到 {len(prices)} 个资产价格 (共 {stablecoin_pairs} 个稳定币交易对)")
 
@@ -150,38 +170,36 @@ class CCXTAdapter(ExchangeAdapter):
                     ticker = tickers[symbol]
                     logger.debug(f"{self.exchange_id} {symbol}: {ticker}")
 
+            self.consecutive_failures = 0
             return prices
 
         except Exception as e:
             logger.error(f"{self.exchange_id} 获取价格失败: {e}")
+            self.consecutive_failures += 1
             return []
 
-    def _extract_price(self, ticker: Dict) -> Optional[float]:
-        """从ticker中提取价格，优先级: last > close > bid/ask平均"""
-        if ticker.get('last') is not None:
-            return float(ticker['last'])
-
-        if ticker.get('close') is not None:
-            return float(ticker['close'])
-
-        bid = ticker.get('bid')
-        ask = ticker.get('ask')
-        if bid is not None and ask is not None:
-            try:
-                return (float(bid) + float(ask)) / 2
-            except (ValueError, TypeError):
-                pass
-
-        return None
-
-    def _safe_decimal(self, value) -> Optional[Decimal]:
-        """安全转换为Decimal"""
-        if value is None:
-            return None
+    async def reload_markets(self):
+        """重新下载市场信息；失败时保留已加载的市场"""
+        if not self.client:
+            return
         try:
-            return Decimal(str(value))
-        except (ValueError, TypeError, Exception):
-            return None
+            self._refill_rate_limit()
+            await self.client.load_markets(reload=True)
+            self._last_request_at = time.monotonic()
+        except Exception as e:
+            logger.warning(f"{self.exchange_id} 重新加载市场失败: {e}")
+
+    def _refill_rate_limit(self):
+        """
+        按空闲时间补充 CCXT 限速令牌。CCXT 的令牌桶只在有请求排队时补充，常驻客户端空闲后的第一个请求
+        仍要等待上一轮请求的全部开销（binance 不带交易对的 fetch_tickers 约 0.8 秒）。
+        """
+        throttler = getattr(self.client, 'throttler', None)
+        if throttler is None or self._last_request_at is None:
+            return
+        config = throttler.config
+        idle_ms = (time.monotonic() - self._last_request_at) * 1000
+        config['tokens'] = min(config['tokens'] + idle_ms * config['refillRate'], config['capacity'])
 
 
 class AdapterFactory:
@@ -235,9 +253,75 @@ class AdapterFactory:
         return [ex for ex in EXCHANGE_PRIORITY if ex in cls.ADAPTERS]
 
 
+class AdapterPool:
+    """
+    进程内常驻的交易所适配器，按交易所复用。
+
+    每轮采集新建 CCXT 客户端都要重新建立连接（DNS、TLS）并在 fetch_tickers 中重新下载全部市场信息，
+    常驻的客户端复用 aiohttp 会话和已加载的市场，市场信息每隔 markets_reload_interval 秒重新加载一次。
+    适配器连续失败 max_failures 次后关闭并重建。同一交易所的采集不能并发（IndependentScheduler 保证）。
+    """
+
+    def __init__(self, markets_reload_interval: float = CCXT_MARKETS_RELOAD_INTERVAL,
+                 max_failures: int = ADAPTER_MAX_CONSECUTIVE_FAILURES):
+        self.markets_reload_interval = markets_reload_interval
+        self.max_failures = max_failures
+        self._adapters: Dict[str, ExchangeAdapter] = {}
+        self._markets_loaded_at: Dict[str, float] = {}
+
+    async def get(self, exchange: str) -> Optional[ExchangeAdapter]:
+        """获取交易所的常驻适配器，按需重建或重新加载市场"""
+        exchange = exchange.lower()
+        adapter = self._adapters.get(exchange)
+        if adapter is not None and adapter.consecutive_failures >= self.max_failures:
+            logger.warning(f"{exchange} 连续失败 {adapter.consecutive_failures} 次，重建适配器")
+            await self.discard(exchange)
+            adapter = None
+
+        now = time.monotonic()
+        if adapter is None:
+            adapter = AdapterFactory.get_adapter(exchange)
+            if adapter is None:
+                return None
+            self._adapters[exchange] = adapter
+            # 新客户端在第一次 fetch_tickers 时加载市场
+            self._markets_loaded_at[exchange] = now
+        elif now - self._markets_loaded_at[exchange] >= self.markets_reload_interval:
+            self._markets_loaded_at[exchange] = now
+            await adapter.reload_markets()
+        return adapter
+
+    async def discard(self, exchange: str):
+        """关闭并移除交易所的适配器，下次 get 时重建"""
+        adapter = self._adapters.pop(exchange.lower(), None)
+        self._markets_loaded_at.pop(exchange.lower(), None)
+        if adapter is not None:
+            await adapter.close()
+
+    async def close(self):
+        """关闭全部适配器"""
+        adapters, self._adapters = list(self._adapters.values()), {}
+        self._markets_loaded_at.clear()
+        await asyncio.gather(*(adapter.close() for adapter in adapters), return_exceptions=True)
+
+
 # 便捷函数
-async def get_exchange_prices(exchange: str) -> List[PriceData]:
-    """获取交易所价格的便捷函数"""
+async def get_exchange_prices(exchange: str, pool: Optional[AdapterPool] = None) -> List[PriceData]:
+    """获取交易所价格的便捷函数；给出 pool 时使用其中的常驻适配器，用完不关闭"""
+    if pool is not None:
+        adapter = await pool.get(exchange)
+        if not adapter:
+            return []
+        try:
+            prices = await adapter.get_prices()
+        except Exception as e:
+            logger.error(f"获取 {exchange} 价格失败: {e}")
+            adapter.consecutive_failures += 1
+            return []
+        # 只统计连续失败，成功一次即清零（CCXTAdapter.get_prices 内部也会清零）
+        adapter.consecutive_failures = 0
+        return prices
+
     adapter = AdapterFactory.get_adapter(exchange)
     if not adapter:
         return []
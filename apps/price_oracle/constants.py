@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+from django.conf import settings
+
 # 稳定币符号列表 - 用于识别交易对中的计价货币, 优先级从上到下递减
 STABLECOIN_SYMBOLS = [
     # 主流稳定币 - 最稳定，流动性最好
@@ -53,3 +55,19 @@ EXCHANGE_PRIORITY = [
     'hitbtc',
     'coinup',  # CoinUp - CP/USDT专用
 ]
+
+# 常驻 CCXT 客户端重新加载市场信息的间隔（秒）
+CCXT_MARKETS_RELOAD_INTERVAL = 3600
+
+# 常驻适配器连续失败多少次后重建
+ADAPTER_MAX_CONSECUTIVE_FAILURES = 3
+
+# 价格流变化检测：相对上次入队的值，价格或成交量的相对变化超过阈值才重新入队
+PRICE_CHANGE_EPSILON = getattr(settings, 'PRICE_CHANGE_EPSILON', 0.0001)
+VOLUME_CHANGE_EPSILON = getattr(settings, 'VOLUME_CHANGE_EPSILON', 0.01)
+# 未变化的资产距上次入队超过该秒数也重新入队，保证数据库中的价格时间戳持续刷新
+PRICE_HEARTBEAT_SECONDS = getattr(settings, 'PRICE_HEARTBEAT_SECONDS', 300)
+# 价格流的近似长度上限（MAXLEN ~），持久化进程长时间不消费时丢弃最旧的消息
+PRICE_STREAM_MAXLEN = getattr(settings, 'PRICE_STREAM_MAXLEN', 100000)
+# 消费者未确认的消息闲置超过该毫秒数后，可被其他持久化进程认领重新处理
+PRICE_STREAM_CLAIM_IDLE_MS = getattr(settings, 'PRICE_STREAM_CLAIM_IDLE_MS', 60000)
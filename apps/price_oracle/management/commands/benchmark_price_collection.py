@@ -0,0 +1,594 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import gc
+import json
+import random
+import statistics
+import time
+from decimal import Decimal
+from unittest import mock
+
+from aiohttp import web
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from redis import Redis
+from redis.connection import Connection, parse_url
+
+from apps.price_oracle.adapters import AdapterPool, CCXTAdapter, PriceData, get_exchange_prices, normalize_tickers
+from apps.price_oracle.constants import EXCHANGE_PRIORITY, STABLECOIN_SYMBOLS
+from apps.price_oracle.redis_service import PriceRedisService
+from apps.price_oracle.scheduler import IndependentScheduler
+from common.redis_client import close_async_redis
+
+STUB_HOST = '127.0.0.1'
+BENCH_PREFIX = 'benchmark:'
+# 旧实现使用的价格队列（list）
+LEGACY_QUEUE_KEY = BENCH_PREFIX + 'price_oracle:price_queue'
+# 轮流写入的交易所，优先级有高有低，已有最优价格有时保留、有时被覆盖
+BENCH_EXCHANGES = ('kraken', 'binance', 'okx', 'gate')
+
+
+def _percentile(values, pct):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
+
+
+def _assets(count):
+    return [f'A{i:04d}' for i in range(count)]
+
+
+def _binance_spot_symbol(base, quote):
+    return {
+        'symbol': base + quote, 'status': 'TRADING', 'baseAsset': base, 'baseAssetPrecision': 8,
+        'quoteAsset': quote, 'quotePrecision': 8, 'quoteAssetPrecision': 8,
+        'baseCommissionPrecision': 8, 'quoteCommissionPrecision': 8,
+        'orderTypes': ['LIMIT', 'LIMIT_MAKER', 'MARKET', 'STOP_LOSS_LIMIT', 'TAKE_PROFIT_LIMIT'],
+        'icebergAllowed': True, 'ocoAllowed': True, 'quoteOrderQtyMarketAllowed': True,
+        'isSpotTradingAllowed': True, 'isMarginTradingAllowed': False,
+        'filters': [
+            {'filterType': 'PRICE_FILTER', 'minPrice': '0.00001000', 'maxPrice': '922327.00000000',
+             'tickSize': '0.00001000'},
+            {'filterType': 'LOT_SIZE', 'minQty': '0.00010000', 'maxQty': '100000.00000000', 'stepSize': '0.00010000'},
+            {'filterType': 'NOTIONAL', 'minNotional': '5.00000000', 'applyMinToMarket': True,
+             'maxNotional': '9000000.00000000', 'applyMaxToMarket': False, 'avgPriceMins': 5},
+            {'filterType': 'MAX_NUM_ORDERS', 'maxNumOrders': 200},
+        ],
+        'permissions': [], 'permissionSets': [['SPOT']],
+        'defaultSelfTradePreventionMode': 'EXPIRE_MAKER',
+        'allowedSelfTradePreventionModes': ['EXPIRE_TAKER', 'EXPIRE_MAKER', 'EXPIRE_BOTH'],
+    }
+
+
+def _binance_contract_symbol(base, quote, inverse):
+    return {
+        'symbol': f'{base}{quote}_PERP' if inverse else base + quote, 'pair': base + quote,
+        'contractType': 'PERPETUAL', 'deliveryDate': 4133404800000, 'onboardDate': 1569398400000,
+        'status': 'TRADING', 'contractStatus': 'TRADING', 'baseAsset': base, 'quoteAsset': quote,
+        'marginAsset': base if inverse else quote, 'pricePrecision': 2, 'quantityPrecision': 3,
+        'baseAssetPrecision': 8, 'quotePrecision': 8, 'contractSize': 100 if inverse else None,
+        'underlyingType': 'COIN', 'triggerProtect': '0.0500', 'liquidationFee': '0.012500',
+        'filters': [
+            {'filterType': 'PRICE_FILTER', 'minPrice': '0.10', 'maxPrice': '4529764', 'tickSize': '0.10'},
+            {'filterType': 'LOT_SIZE', 'minQty': '0.001', 'maxQty': '1000', 'stepSize': '0.001'},
+        ],
+        'orderTypes': ['LIMIT', 'MARKET', 'STOP', 'STOP_MARKET', 'TAKE_PROFIT', 'TAKE_PROFIT_MARKET'],
+        'timeInForce': ['GTC', 'IOC', 'FOK', 'GTX'],
+    }
+
+
+def _binance_ticker(symbol, now):
+    price = random.uniform(0.001, 1000)
+    return {
+        'symbol': symbol, 'priceChange': '0.1', 'priceChangePercent': f'{random.uniform(-10, 10):.3f}',
+        'weightedAvgPrice': f'{price:.8f}', 'prevClosePrice': f'{price:.8f}', 'lastPrice': f'{price:.8f}',
+        'lastQty': '1.0', 'bidPrice': f'{price * 0.999:.8f}', 'bidQty': '10.0', 'askPrice': f'{price * 1.001:.8f}',
+        'askQty': '10.0', 'openPrice': f'{price:.8f}', 'highPrice': f'{price * 1.05:.8f}',
+        'lowPrice': f'{price * 0.95:.8f}', 'volume': '1000.0', 'quoteVolume': f'{price * 1000:.8f}',
+        'openTime': now - 86400000, 'closeTime': now, 'firstId': 1, 'lastId': 1000, 'count': 1000,
+    }
+
+
+def _okx_instrument(inst_type, base, quote, **extra):
+    instrument = {
+        'instType': inst_type, 'instId': f'{base}-{quote}', 'uly': '', 'instFamily': '', 'baseCcy': base,
+        'quoteCcy': quote, 'settleCcy': '', 'ctVal': '', 'ctMult': '', 'ctValCcy': '', 'optType': '', 'stk': '',
+        'listTime': '1606468572000', 'expTime': '', 'lever': '10', 'tickSz': '0.0001', 'lotSz': '0.0001',
+        'minSz': '0.001', 'ctType': '', 'alias': '', 'state': 'live', 'maxLmtSz': '9999999999',
+        'maxMktSz': '1000000', 'maxTwapSz': '9999999999', 'maxIcebergSz': '9999999999',
+        'maxTriggerSz': '9999999999', 'maxStopSz': '1000000',
+    }
+    instrument.update(extra)
+    return instrument
+
+
+def _okx_contract(inst_type, base, quote, suffix, **extra):
+    fields = dict(instId=f'{base}-{quote}-{suffix}', uly=f'{base}-{quote}', instFamily=f'{base}-{quote}',
+                  baseCcy='', quoteCcy='', settleCcy=quote, ctVal='0.01', ctMult='1', ctValCcy=base, ctType='linear')
+    fields.update(extra)
+    return _okx_instrument(inst_type, base, quote, **fields)
+
+
+def _okx_ticker(inst_id, now):
+    price = random.uniform(0.001, 1000)
+    return {
+        'instType': 'SPOT', 'instId': inst_id, 'last': f'{price:.8f}', 'lastSz': '1', 'askPx': f'{price * 1.001:.8f}',
+        'askSz': '10', 'bidPx': f'{price * 0.999:.8f}', 'bidSz': '10', 'open24h': f'{price:.8f}',
+        'high24h': f'{price * 1.05:.8f}', 'low24h': f'{price * 0.95:.8f}', 'volCcy24h': f'{price * 1000:.8f}',
+        'vol24h': '1000', 'ts': str(now), 'sodUtc0': f'{price:.8f}', 'sodUtc8': f'{price:.8f}',
+    }
+
+
+def _recorded_responses(markets):
+    """按真实接口格式构造 binance / okx 的市场与 ticker 响应，路径为 /<host><path>?<query>"""
+    now = int(time.time() * 1000)
+    quotes = ('USDT', 'USDC', 'BTC')
+    spot = [(base, quotes[i % len(quotes)]) for i, base in enumerate(_assets(markets))]
+    contracts = [(base, 'USDT') for base in _assets(markets // 4)]
+    coin_margined = [(base, 'USD') for base in _assets(max(markets // 50, 1))]
+    okx_spot = spot[:markets // 3]
+    ok = {'code': '0', 'msg': ''}
+    options = [
+        _okx_contract('OPTION', base, 'USD', f'250328-{strike}-{side}', optType=side, stk=str(strike),
+                      expTime='1743148800000', ctType='', settleCcy=base)
+        for base in ('BTC', 'ETH') for strike in range(1000, 1000 + 200 * 100, 100) for side in 'CP'
+    ]
+    return {
+        '/api.binance.com/api/v3/exchangeInfo': {
+            'timezone': 'UTC', 'serverTime': now, 'rateLimits': [], 'exchangeFilters': [],
+            'symbols': [_binance_spot_symbol(base, quote) for base, quote in spot]},
+        '/fapi.binance.com/fapi/v1/exchangeInfo': {
+            'timezone': 'UTC', 'serverTime': now, 'rateLimits': [], 'exchangeFilters': [], 'assets': [],
+            'symbols': [_binance_contract_symbol(base, quote, False) for base, quote in contracts]},
+        '/dapi.binance.com/dapi/v1/exchangeInfo': {
+            'timezone': 'UTC', 'serverTime': now, 'rateLimits': [], 'exchangeFilters': [],
+            'symbols': [_binance_contract_symbol(base, quote, True) for base, quote in coin_margined]},
+        '/api.binance.com/api/v3/ticker/24hr': [_binance_ticker(base + quote, now) for base, quote in spot],
+        '/www.okx.com/api/v5/public/instruments?instType=SPOT': dict(
+            ok, data=[_okx_instrument('SPOT', base, quote) for base, quote in okx_spot]),
+        '/www.okx.com/api/v5/public/instruments?instType=SWAP': dict(
+            ok, data=[_okx_contract('SWAP', base, quote, 'SWAP') for base, quote in contracts]),
+        '/www.okx.com/api/v5/public/instruments?instType=FUTURES': dict(
+            ok, data=[_okx_contract('FUTURES', base, 'USD', '250328', expTime='1743148800000', settleCcy=base,
+                                    ctType='inverse') for base, _ in coin_margined]),
+        '/www.okx.com/api/v5/public/instruments?instType=OPTION&uly=BTC-USD': dict(
+            ok, data=[option for option in options if option['uly'] == 'BTC-USD']),
+        '/www.okx.com/api/v5/public/instruments?instType=OPTION&uly=ETH-USD': dict(
+            ok, data=[option for option in options if option['uly'] == 'ETH-USD']),
+        '/www.okx.com/api/v5/market/tickers?instType=SPOT': dict(
+            ok, data=[_okx_ticker(f'{base}-{quote}', now) for base, quote in okx_spot]),
+    }
+
+
+def _redirect(urls, base):
+    if isinstance(urls, dict):
+        return {key: _redirect(value, base) for key, value in urls.items()}
+    if isinstance(urls, str) and urls.startswith('https://'):
+        return f"{base}/{urls[len('https://'):]}"
+    return urls
+
+
+class RecordedResponseStub:
+    """
+    本地回放交易所响应。每个请求加一个往返延迟；新连接的第一个请求另加 handshake_rtts 个往返，
+    模拟 TCP + TLS 握手，DNS 解析不计入。
+    """
+
+    def __init__(self, responses, rtt: float, handshake_rtts: int):
+        self.responses = {path: web.json_response(body).body for path, body in responses.items()}
+        self.rtt = rtt
+        self.handshake_rtts = handshake_rtts
+        self.requests = 0
+        self.connections = 0
+        self.bytes_sent = 0
+        self._transports = set()
+        self._runner = None
+        self.base_url = None
+
+    async def handle(self, request):
+        delay = self.rtt
+        if request.transport not in self._transports:
+            self._transports.add(request.transport)
+            self.connections += 1
+            delay += self.rtt * self.handshake_rtts
+        if delay:
+            await asyncio.sleep(delay)
+        body = self.responses.get(request.path_qs)
+        if body is None:
+            return web.json_response({}, status=404)
+        self.requests += 1
+        self.bytes_sent += len(body)
+        return web.Response(body=body, content_type='application/json')
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, STUB_HOST, 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://{STUB_HOST}:{port}'
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    def reset_counters(self):
+        self.requests = self.connections = self.bytes_sent = 0
+
+
+def _legacy_save_prices(service, exchange, prices):
+    """旧实现：每个资产先 GET 当前最优价格，在客户端比较后再写入 pipeline"""
+    current_time = time.time()
+    exchange_priority = service._get_exchange_priority(exchange)
+    asset_prices = {}
+    for price_data in prices:
+        base_asset = price_data.get('base_asset', '').upper()
+        price_data['exchange_priority'] = exchange_priority
+        price_data['quote_priority'] = service._get_quote_priority(price_data.get('quote_asset', ''))
+        asset_prices.setdefault(base_asset, []).append(price_data)
+    pipe = service.redis.pipeline()
+    saved_count = 0
+    for base_asset, price_list in asset_prices.items():
+        candidates = price_list.copy()
+        current = service.redis.get(f"{service.best_price_prefix}{base_asset}")
+        if current:
+            candidates.append(json.loads(current))
+        candidates.sort(key=lambda x: (x.get('exchange_priority', 999), x.get('quote_priority', 999)))
+        best_price = service._best_price_entry(base_asset, candidates[0], current_time)
+        pipe.lpush(LEGACY_QUEUE_KEY, json.dumps(best_price))
+        pipe.setex(f"{service.best_price_prefix}{base_asset}", 3600, json.dumps(best_price))
+        saved_count += 1
+    pipe.execute()
+    return saved_count
+
+
+def _legacy_drain(service, batch_size):
+    """旧实现的持久化读取：每个价格一次 RPOP"""
+    drained = 0
+    while True:
+        prices = []
+        for _ in range(batch_size):
+            data = service.redis.rpop(LEGACY_QUEUE_KEY)
+            if not data:
+                break
+            prices.append(json.loads(data))
+        drained += len(prices)
+        if len(prices) < batch_size:
+            return drained
+
+
+def _stream_drain(service, batch_size, consumer='benchmark'):
+    """当前实现的持久化读取：XREADGROUP 批量读取后确认"""
+    drained = 0
+    while True:
+        batch = service.read_price_batch(consumer, batch_size)
+        service.ack_prices(message_id for message_id, _ in batch)
+        drained += len(batch)
+        if len(batch) < batch_size:
+            return drained
+
+
+def _legacy_normalize(tickers):
+    """旧实现：逐个 ticker 分割符号、在列表中查找计价货币，并构造 Decimal"""
+    def safe_decimal(value):
+        if value is None:
+            return None
+        try:
+            return Decimal(str(value))
+        except Exception:
+            return None
+
+    prices = []
+    for symbol, ticker in tickers.items():
+        if not ticker or 'symbol' not in ticker or not ticker.get('last'):
+            continue
+        base, quote = symbol.split('/', 1)
+        if quote not in STABLECOIN_SYMBOLS:
+            continue
+        price = float(ticker['last'])
+        if price <= 0:
+            continue
+        prices.append(PriceData(symbol=symbol, base_asset=base, quote_asset=quote, price=Decimal(str(price)),
+                                volume_24h=safe_decimal(ticker.get('quoteVolume')),
+                                price_change_24h=safe_decimal(ticker.get('percentage'))))
+    return prices
+
+
+def _price_dicts(exchange, prices):
+    """collect_prices 写入 Redis 前的转换"""
+    return [{
+        'symbol': price_data.symbol, 'base_asset': price_data.base_asset, 'quote_asset': price_data.quote_asset,
+        'exchange': exchange, 'price': float(price_data.price),
+        'volume_24h': float(price_data.volume_24h) if price_data.volume_24h else 0,
+        'price_change_24h': float(price_data.price_change_24h) if price_data.price_change_24h else 0,
+    } for price_data in prices]
+
+
+def _cleanup(service):
+    service.redis.delete(LEGACY_QUEUE_KEY, service.stream_key, service.last_queued_key,
+                         *service.redis.keys(f'{service.best_price_prefix}*'))
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks price_oracle collection cycles (against a local recorded-response stub) and best price writes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=('collect', 'best_price', 'scheduler', 'queue', 'normalize'),
+                            help='Benchmark scenario to run.')
+        parser.add_argument('--exchanges', nargs='+', default=['binance', 'okx'],
+                            choices=['binance', 'okx'], help='Exchanges to collect.')
+        parser.add_argument('--cycles', type=int, default=10, help='Collection cycles per exchange and mode.')
+        parser.add_argument('--interval', type=float, default=3,
+                            help='Seconds between cycles; shorter intervals hit the CCXT rate limiter.')
+        parser.add_argument('--markets', type=int, default=2000,
+                            help='Spot markets served by the stub (normalize: 5000).')
+        parser.add_argument('--rtt', type=float, default=30, help='Emulated round trip time in ms.')
+        parser.add_argument('--handshake-rtts', type=int, default=3,
+                            help='Extra round trips for the first request on a new connection (TCP + TLS).')
+        parser.add_argument('--assets', type=int, default=5000,
+                            help='Assets per exchange batch (best_price: 5000, scheduler: 1000).')
+        parser.add_argument('--workers', type=int, default=20, help='Exchanges driven by the scheduler (scheduler).')
+        parser.add_argument('--duration', type=float, default=15, help='Seconds to run the scheduler (scheduler).')
+        parser.add_argument('--rounds', type=int, default=8,
+                            help='Exchange batches written per mode (best_price).')
+        parser.add_argument('--moved', type=float, default=0.05,
+                            help='Fraction of assets whose price moves each cycle (queue).')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Persister read batch size (queue).')
+        parser.add_argument('--redis-url', type=str, default=None,
+                            help='Redis used instead of local_redis, e.g. a latency proxy (best_price, scheduler).')
+        parser.add_argument('--mode', choices=('legacy', 'current', 'both'), default='both',
+                            help='Run the legacy implementation, the current one, or both.')
+
+    def handle(self, *args, **options):
+        if options['scenario'] == 'collect':
+            asyncio.run(self._bench_collect(options))
+            return
+        if options['scenario'] == 'normalize':
+            asyncio.run(self._bench_normalize(options))
+            return
+        self.stdout.write(self.style.WARNING(
+            "Benchmarks write to the configured Redis; run them against a development instance."))
+        if options['scenario'] == 'best_price':
+            self._bench_best_price(options)
+        elif options['scenario'] == 'queue':
+            self._bench_queue(options)
+        else:
+            self._bench_scheduler(options)
+
+    def _bench_service(self, options):
+        service = PriceRedisService()
+        if options['redis_url']:
+            service.redis = Redis.from_url(options['redis_url'])
+            service._best_price_script = service.redis.register_script(service._best_price_script.script)
+        service.best_price_prefix = BENCH_PREFIX + service.best_price_prefix
+        service.stream_key = BENCH_PREFIX + service.stream_key
+        service.last_queued_key = BENCH_PREFIX + service.last_queued_key
+        return service
+
+    def _bench_best_price(self, options):
+        """每个交易所批次写入 N 个资产的最优价格：逐个资产 GET vs 服务端脚本比较优先级"""
+        service = self._bench_service(options)
+        quotes = ('USDT', 'USDC')
+        sent = []
+        original_send = Connection.send_packed_command
+
+        def counting_send(connection, command, check_health=True):
+            sent.append(1)
+            return original_send(connection, command, check_health)
+
+        def batch(exchange):
+            return [{'symbol': f'{asset}/{quote}', 'base_asset': asset, 'quote_asset': quote, 'exchange': exchange,
+                     'price': random.uniform(0.001, 1000), 'volume_24h': 1000.0, 'price_change_24h': 0.5}
+                    for asset in _assets(options['assets']) for quote in random.sample(quotes, 1)]
+
+        save_funcs = {
+            'legacy': lambda exchange, prices: _legacy_save_prices(service, exchange, prices),
+            'current': service.save_prices_to_redis,
+        }
+        modes = ['legacy', 'current'] if options['mode'] == 'both' else [options['mode']]
+        results = {}
+        try:
+            for mode in modes:
+                _cleanup(service)
+                random.seed(0)
+                batches = [(exchange, batch(exchange))
+                           for exchange in (BENCH_EXCHANGES * options['rounds'])[:options['rounds']]]
+                latencies = []
+                sent.clear()
+                with mock.patch.object(Connection, 'send_packed_command', counting_send):
+                    for exchange, prices in batches:
+                        start = time.perf_counter()
+                        save_funcs[mode](exchange, prices)
+                        latencies.append(time.perf_counter() - start)
+                results[mode] = {asset: (best['exchange'], best['price']) for asset, best in (
+                    (asset, service.get_best_price(asset)) for asset in _assets(options['assets']))}
+                self._report(mode, latencies, f"assets={options['assets']} "
+                                              f"round_trips/batch={len(sent) / len(batches):.1f}")
+        finally:
+            _cleanup(service)
+        if len(results) == 2:
+            self.stdout.write(f"identical best prices: {results['legacy'] == results['current']}")
+
+    def _bench_scheduler(self, options):
+        """IndependentScheduler 驱动多个交易所同时写入：同步写入 vs redis.asyncio 写入时事件循环心跳的延迟"""
+        service = self._bench_service(options)
+        assets = options['assets'] if options['assets'] != 5000 else 1000
+        exchanges = EXCHANGE_PRIORITY[:options['workers']]
+        prices = {exchange: [{'symbol': f'{asset}/USDT', 'base_asset': asset, 'quote_asset': 'USDT',
+                              'exchange': exchange, 'price': random.uniform(0.001, 1000), 'volume_24h': 1000.0,
+                              'price_change_24h': 0.5} for asset in _assets(assets)]
+                  for exchange in exchanges}
+        tick = 0.01
+
+        async def blocking_save(exchange, batch):
+            return service.save_prices_to_redis(exchange, batch)
+
+        save_funcs = {'legacy': blocking_save, 'current': service.asave_prices_to_redis}
+
+        async def run(mode):
+            writes = []
+
+            async def collect(exchange):
+                start = time.perf_counter()
+                saved = await save_funcs[mode](exchange, prices[exchange])
+                writes.append(time.perf_counter() - start)
+                return saved
+
+            scheduler = IndependentScheduler(list(exchanges), collect)
+            for task in scheduler.tasks.values():
+                task.min_interval = task.current_interval = options['interval']
+            runner = asyncio.create_task(scheduler.start())
+            lags = []
+            try:
+                deadline = time.monotonic() + options['duration']
+                while time.monotonic() < deadline:
+                    start = time.monotonic()
+                    await asyncio.sleep(tick)
+                    lags.append(time.monotonic() - start - tick)
+            finally:
+                scheduler.stop()
+                runner.cancel()
+                await runner
+                await close_async_redis()
+            return lags, writes
+
+        redis_settings = settings.TRADING_REDIS
+        if options['redis_url']:
+            redis_settings = dict(redis_settings, **parse_url(options['redis_url']))
+        modes = ['legacy', 'current'] if options['mode'] == 'both' else [options['mode']]
+        try:
+            for mode in modes:
+                with override_settings(TRADING_REDIS=redis_settings):
+                    lags, writes = asyncio.run(run(mode))
+                self._report(mode, lags, f"(tick lag) writes={len(writes)} "
+                                         f"write_p50={_percentile(writes, 50) * 1000:.1f}ms")
+        finally:
+            _cleanup(service)
+
+    def _bench_queue(self, options):
+        """每轮只有少量资产价格变化：全部入队 + 逐个 RPOP vs 变化检测入队 + XREADGROUP 批量读取"""
+        service = self._bench_service(options)
+        assets = _assets(options['assets'])
+        save_funcs = {
+            'legacy': lambda prices: _legacy_save_prices(service, 'binance', prices),
+            'current': lambda prices: service.save_prices_to_redis('binance', prices),
+        }
+        drain_funcs = {'legacy': _legacy_drain, 'current': _stream_drain}
+        modes = ['legacy', 'current'] if options['mode'] == 'both' else [options['mode']]
+        try:
+            for mode in modes:
+                _cleanup(service)
+                service.ensure_stream_group()
+                random.seed(0)
+                prices = {asset: random.uniform(0.001, 1000) for asset in assets}
+                writes, drains, queued = [], [], []
+                for cycle in range(options['cycles'] + 1):
+                    for asset in random.sample(assets, int(len(assets) * options['moved'])):
+                        prices[asset] *= random.choice((0.99, 1.01))
+                    start = time.perf_counter()
+                    save_funcs[mode]([{'symbol': f'{asset}/USDT', 'base_asset': asset, 'quote_asset': 'USDT',
+                                       'exchange': 'binance', 'price': price, 'volume_24h': 1000.0,
+                                       'price_change_24h': 0.5} for asset, price in prices.items()])
+                    write = time.perf_counter() - start
+                    start = time.perf_counter()
+                    drained = drain_funcs[mode](service, options['batch_size'])
+                    # 第一轮所有资产都会入队，不计入统计
+                    if cycle:
+                        writes.append(write)
+                        drains.append(time.perf_counter() - start)
+                        queued.append(drained)
+                self._report(mode, drains, f"(drain) assets={len(assets)} queued/cycle={statistics.mean(queued):.0f} "
+                                           f"write_p50={_percentile(writes, 50) * 1000:.1f}ms")
+        finally:
+            _cleanup(service)
+
+    def _report(self, label, latencies, extra=''):
+        self.stdout.write(
+            f"{label:>8}: n={len(latencies)} p50={_percentile(latencies, 50) * 1000:.1f}ms "
+            f"p99={_percentile(latencies, 99) * 1000:.1f}ms max={max(latencies) * 1000:.1f}ms {extra}"
+        )
+
+    def _stubbed_adapters(self, stub):
+        """创建的 CCXT 客户端改为请求本地回放服务"""
+        create_client = CCXTAdapter._create_client
+
+        def stubbed_create_client(adapter):
+            create_client(adapter)
+            if adapter.client is not None:
+                adapter.client.urls['api'] = _redirect(adapter.client.urls['api'], stub.base_url)
+
+        return mock.patch.object(CCXTAdapter, '_create_client', stubbed_create_client)
+
+    async def _bench_collect(self, options):
+        stub = RecordedResponseStub(_recorded_responses(options['markets']), options['rtt'] / 1000,
+                                    options['handshake_rtts'])
+        await stub.start()
+        modes = ['legacy', 'current'] if options['mode'] == 'both' else [options['mode']]
+        try:
+            with self._stubbed_adapters(stub):
+                for exchange in options['exchanges']:
+                    for mode in modes:
+                        await self._bench(stub, exchange, mode, options['cycles'], options['interval'])
+        finally:
+            await stub.stop()
+
+    async def _bench_normalize(self, options):
+        """回放的 fetch_tickers 结果转换为写入 Redis 的价格：逐个构造 Decimal vs 批量过滤、保持 float"""
+        markets = options['markets'] if options['markets'] != 2000 else 5000
+        stub = RecordedResponseStub(_recorded_responses(markets), 0, 0)
+        await stub.start()
+        try:
+            with self._stubbed_adapters(stub):
+                adapter = CCXTAdapter('binance')
+                try:
+                    tickers = await adapter.client.fetch_tickers()
+                finally:
+                    await adapter.close()
+        finally:
+            await stub.stop()
+
+        normalize_funcs = {'legacy': _legacy_normalize, 'current': lambda tickers: normalize_tickers(tickers)[0]}
+        modes = ['legacy', 'current'] if options['mode'] == 'both' else [options['mode']]
+        results = {}
+        for mode in modes:
+            latencies = []
+            # 回放的 ticker 对象很多，分代回收会放大个别轮次的耗时，计时期间暂停 GC
+            gc.collect()
+            gc.disable()
+            try:
+                for _ in range(max(options['cycles'], 20)):
+                    start = time.perf_counter()
+                    results[mode] = _price_dicts('binance', normalize_funcs[mode](tickers))
+                    latencies.append(time.perf_counter() - start)
+            finally:
+                gc.enable()
+            self._report(mode, latencies, f"tickers={len(tickers)} prices={len(results[mode])}")
+        if len(results) == 2:
+            self.stdout.write(f"identical prices: {results['legacy'] == results['current']}")
+
+    async def _bench(self, stub, exchange, mode, cycles, interval):
+        pool = AdapterPool() if mode == 'current' else None
+        latencies = []
+        prices = []
+        stub.reset_counters()
+        try:
+            for cycle in range(cycles):
+                if cycle:
+                    await asyncio.sleep(interval)
+                start = time.perf_counter()
+                prices = await get_exchange_prices(exchange, pool=pool)
+                latencies.append(time.perf_counter() - start)
+        finally:
+            if pool is not None:
+                await pool.close()
+        steady = latencies[1:] or latencies
+        self.stdout.write(
+            f"{exchange:>8} {mode:>8}: cycles={cycles} first={latencies[0] * 1000:.0f}ms "
+            f"p50={_percentile(steady, 50) * 1000:.0f}ms p99={_percentile(steady, 99) * 1000:.0f}ms "
+            f"requests/cycle={stub.requests / cycles:.1f} connections={stub.connections} "
+            f"MiB/cycle={stub.bytes_sent / cycles / 2 ** 20:.2f} prices={len(prices)}"
+        )
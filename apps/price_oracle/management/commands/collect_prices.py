@@ -6,15 +6,17 @@ import time
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from common.helpers import getLogger
-from apps.price_oracle.adapters import AdapterFactory, get_exchange_prices
+from apps.price_oracle.adapters import AdapterFactory, AdapterPool, get_exchange_prices
 from apps.price_oracle.redis_service import redis_service
 from apps.price_oracle.scheduler import IndependentScheduler
+from common.redis_client import close_async_redis
 
 logger = getLogger(__name__)
 
 
 class Command(BaseCommand):
     help = '采集交易所价格数据并存入Redis'
+    adapter_pool = None
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -55,6 +57,7 @@ class Command(BaseCommand):
             self.stdout.write(f"✅ 采集完成，共保存 {total_saved} 个价格到Redis")
             
         finally:
+            loop.run_until_complete(close_async_redis())
             loop.close()
 
     async def collect_all_exchanges_parallel(self, exchanges: list) -> int:
@@ -84,10 +87,14 @@ class Command(BaseCommand):
         """独立调度循环"""
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
+        # 常驻适配器，各交易所每轮采集复用同一个 CCXT 客户端
+        self.adapter_pool = AdapterPool()
         
         try:
             loop.run_until_complete(self.independent_collect_loop(exchanges))
         finally:
+            loop.run_until_complete(self.adapter_pool.close())
+            loop.run_until_complete(close_async_redis())
             loop.close()
 
     async def independent_collect_loop(self, exchanges: list):
@@ -105,7 +112,7 @@ class Command(BaseCommand):
         """采集单个交易所（适配调度器接口）"""
         try:
             # 获取价格数据
-            prices = await get_exchange_prices(exchange)
+            prices = await get_exchange_prices(exchange, pool=self.adapter_pool)
             
             if not prices:
                 return 0
@@ -125,7 +132,7 @@ class Command(BaseCommand):
                 price_dicts.append(price_dict)
             
             # 保存到Redis
-            saved_count = redis_service.save_prices_to_redis(exchange, price_dicts)
+            saved_count = await redis_service.asave_prices_to_redis(exchange, price_dicts)
             return saved_count
             
         except Exception as e:
@@ -159,7 +166,7 @@ class Command(BaseCommand):
                 price_dicts.append(price_dict)
             
             # 保存到Redis
-            saved_count = redis_service.save_prices_to_redis(exchange, price_dicts)
+            saved_count = await redis_service.asave_prices_to_redis(exchange, price_dicts)
             
             if saved_count > 0:
                 self.stdout.write(f"  ✅ {exchange}: 保存 {saved_count} 个价格到Redis")
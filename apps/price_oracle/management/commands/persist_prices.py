@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import socket
 import time
 
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 
+from apps.cmc_proxy.utils import bump_market_data_generation
 from apps.price_oracle.services import price_service
 from apps.price_oracle.redis_service import redis_service
 from common.helpers import getLogger
@@ -25,6 +28,10 @@ class Command(BaseCommand):
             '--interval', type=int, default=0,
             help='循环处理间隔（秒），0表示只运行一次',
         )
+        parser.add_argument(
+            '--consumer', default=f'{socket.gethostname()}-{os.getpid()}',
+            help='价格流消费组中的消费者名称（默认 主机名-进程号），多个持久化进程需各不相同',
+        )
         parser.add_argument(
             '--cleanup', action='store_true',
             help='处理后清理过期的Redis数据',
@@ -34,10 +41,12 @@ class Command(BaseCommand):
         batch_size = options['batch_size']
         interval = options['interval']
         cleanup = options['cleanup']
+        self.consumer = options['consumer']
+        redis_service.ensure_stream_group()
 
         if interval > 0:
             self.stdout.write(f"🔄 循环模式: 每 {interval} 秒处理一次 (Ctrl+C 停止)")
-            self.stdout.write(f"📦 批处理大小: {batch_size}")
+            self.stdout.write(f"📦 批处理大小: {batch_size}，消费者: {self.consumer}")
             self.stdout.write("⚡ 使用优化模式")
             self.run_loop(batch_size, interval, cleanup)
         else:
@@ -55,12 +64,12 @@ class Command(BaseCommand):
                 # 显示队列状态
                 queue_size = redis_service.get_queue_size()
                 if queue_size > 0:
-                    self.stdout.write(f"📋 Redis队列中有 {queue_size} 个待处理价格")
+                    self.stdout.write(f"📋 Redis价格流中有 {queue_size} 个待处理价格")
 
                     processed_count = self.process_once(batch_size, cleanup)
                     self.stdout.write(f"✅ 本次处理 {processed_count} 个价格")
                 else:
-                    self.stdout.write("📭 Redis队列为空，等待新数据...")
+                    self.stdout.write("📭 Redis价格流为空，等待新数据...")
 
                 self.stdout.write(f"⏳ 等待 {interval} 秒...")
                 time.sleep(interval)
@@ -73,26 +82,41 @@ class Command(BaseCommand):
         total_processed = 0
 
         while True:
-            # 从Redis队列获取价格数据
+            # 从Redis价格流批量读取价格数据
             start_time = time.time()
-            prices = redis_service.get_prices_from_queue(batch_size)
+            batch = redis_service.read_price_batch(self.consumer, batch_size)
 
-            if not prices:
+            if not batch:
                 break
 
-            # 保存到数据库
-            saved_count = price_service.save_prices_to_db_upsert(prices)
+            # 同一批次中同一资产可能来自多个采集周期，只保留最新的一条
+            latest = {}
+            for _, price_data in batch:
+                if price_data and price_data.get('base_asset'):
+                    latest[price_data['base_asset']] = price_data
+            prices = list(latest.values())
+
+            # 保存到数据库，成功后再确认消息；失败的批次留在待确认列表中，闲置后重新投递
+            saved_count = price_service.save_prices_to_db_upsert(prices) if prices else 0
+            if prices and saved_count == 0:
+                logger.error(f"持久化 {len(prices)} 个价格失败，等待重新投递")
+                break
+            redis_service.ack_prices(message_id for message_id, _ in batch)
 
             total_processed += saved_count
             processing_time = time.time() - start_time
 
-            self.stdout.write(f"  💾 批次处理: {len(prices)} 个价格，保存 {saved_count} 个 "
+            self.stdout.write(f"  💾 批次处理: {len(batch)} 条消息，保存 {saved_count} 个 "
                               f"(耗时: {processing_time:.2f}s)")
 
-            # 如果这批数据量少于批处理大小，说明队列已空
-            if len(prices) < batch_size:
+            # 如果这批数据量少于批处理大小，说明价格流已读完
+            if len(batch) < batch_size:
                 break
 
+        # 新价格落库后，使分页行情缓存失效
+        if total_processed > 0:
+            bump_market_data_generation()
+
         # 清理过期数据
         if cleanup and total_processed > 0:
             self.stdout.write("🧹 清理过期数据...")
@@ -110,7 +134,7 @@ class Command(BaseCommand):
             # Redis统计
             redis_stats = redis_service.get_stats()
             self.stdout.write("📊 系统状态:")
-            self.stdout.write(f"  Redis队列: {redis_stats.get('queue_size', 0)} 项")
+            self.stdout.write(f"  Redis价格流: {redis_stats.get('queue_size', 0)} 项")
             self.stdout.write(f"  Redis缓存: {redis_stats.get('total_price_keys', 0)} 项")
 
             # 数据库统计
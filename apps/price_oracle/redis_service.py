@@ -3,14 +3,91 @@
 
 import json
 import time
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-from common.redis_client import local_redis
+from redis.exceptions import ResponseError
+
+from common.redis_client import local_async_redis, local_redis, register_async_script
 from common.helpers import getLogger
-from apps.price_oracle.constants import EXCHANGE_PRIORITY, STABLECOIN_SYMBOLS
+from apps.price_oracle.constants import (
+    EXCHANGE_PRIORITY, PRICE_CHANGE_EPSILON, PRICE_HEARTBEAT_SECONDS, PRICE_STREAM_CLAIM_IDLE_MS,
+    PRICE_STREAM_MAXLEN, STABLECOIN_SYMBOLS, VOLUME_CHANGE_EPSILON,
+)
 
 logger = getLogger(__name__)
 
+# 在服务端比较优先级、写入最优价格并检测变化，替代逐个资产 GET 当前最优价格。
+# KEYS: 价格流, 最近入队记录(hash), 各资产最优价格键
+# ARGV: 过期秒数, 本轮时间戳, 价格变化阈值, 成交量变化阈值, 心跳秒数, 价格流长度上限,
+#       然后每个资产依次为 资产, 交易所优先级, 稳定币优先级, 候选 json。
+# 已有最优价格的 (交易所优先级, 稳定币优先级) 更小时保留它（时间戳更新为本轮），否则写入候选，并刷新过期时间。
+# 胜出的价格与最近一次入队的记录相比来源变化、价格或成交量的相对变化超过阈值、或超过心跳间隔时才 XADD 入队。
+# 返回 {处理的资产数, 入队数}。
+BEST_PRICE_SCRIPT = """
+local ttl, timestamp = ARGV[1], ARGV[2]
+local now = tonumber(timestamp)
+local price_epsilon, volume_epsilon, heartbeat = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+local maxlen = ARGV[6]
+
+local function moved(value, last, epsilon)
+    value, last = tonumber(value) or 0, tonumber(last) or 0
+    if last == 0 then
+        return value ~= 0
+    end
+    return math.abs(value - last) / math.abs(last) > epsilon
+end
+
+local queued = 0
+for i = 3, #KEYS do
+    local arg = (i - 3) * 4 + 7
+    local asset, payload = ARGV[arg], ARGV[arg + 3]
+    local winner = nil
+    local current = redis.call('GET', KEYS[i])
+    if current then
+        local ok, best = pcall(cjson.decode, current)
+        if ok and type(best) == 'table' then
+            local exchange_priority = tonumber(best.exchange_priority) or 999
+            local quote_priority = tonumber(best.quote_priority) or 999
+            local new_exchange_priority, new_quote_priority = tonumber(ARGV[arg + 1]), tonumber(ARGV[arg + 2])
+            if exchange_priority < new_exchange_priority
+                    or (exchange_priority == new_exchange_priority and quote_priority < new_quote_priority) then
+                local restamped, count = string.gsub(current, '"timestamp": [-+%d.eE]+', '"timestamp": ' .. timestamp, 1)
+                if count == 0 then
+                    best.timestamp = now
+                    restamped = cjson.encode(best)
+                end
+                payload = restamped
+                winner = best
+            end
+        end
+    end
+    if winner == nil then
+        winner = cjson.decode(payload)
+    end
+    redis.call('SETEX', KEYS[i], ttl, payload)
+
+    local source = tostring(winner.exchange) .. '|' .. tostring(winner.symbol)
+    local enqueue = true
+    local last = redis.call('HGET', KEYS[2], asset)
+    if last then
+        local last_time, last_price, last_volume, last_source = string.match(last, '^([^|]*)|([^|]*)|([^|]*)|(.*)$')
+        enqueue = last_source ~= source or now - (tonumber(last_time) or 0) >= heartbeat
+            or moved(winner.price, last_price, price_epsilon) or moved(winner.volume_24h, last_volume, volume_epsilon)
+    end
+    if enqueue then
+        redis.call('XADD', KEYS[1], 'MAXLEN', '~', maxlen, '*', 'data', payload)
+        redis.call('HSET', KEYS[2], asset,
+            timestamp .. '|' .. tostring(winner.price) .. '|' .. tostring(winner.volume_24h) .. '|' .. source)
+        queued = queued + 1
+    end
+end
+return {#KEYS - 2, queued}
+"""
+
+
+def _priority(price_data: Dict) -> Tuple[int, int]:
+    return price_data.get('exchange_priority', 999), price_data.get('quote_priority', 999)
+
 
 class PriceRedisService:
     """Redis价格服务 - 处理价格数据的缓存和队列，支持优先级选择"""
@@ -18,56 +95,94 @@ class PriceRedisService:
     def __init__(self):
         self.redis = local_redis()
         self.raw_price_prefix = "price_oracle:raw_price:"  # 用于存储原始价格
-        self.queue_key = "price_oracle:price_queue"
+        # 待持久化的价格流，persist_prices 通过消费组读取
+        self.stream_key = "price_oracle:price_stream"
+        self.stream_group = "persist_prices"
+        # 每个资产最近一次入队的 时间戳|价格|成交量|交易所|交易对，用于变化检测
+        self.last_queued_key = "price_oracle:last_queued"
         self.best_price_prefix = "price_oracle:best_price:"  # 存储每个资产的最优价格
+        self.best_price_ttl = 3600
+        # 每次脚本调用处理的资产数，限制单次脚本阻塞 Redis 的时间
+        self.best_price_batch_size = 1000
+        self.price_epsilon = PRICE_CHANGE_EPSILON
+        self.volume_epsilon = VOLUME_CHANGE_EPSILON
+        self.heartbeat_seconds = PRICE_HEARTBEAT_SECONDS
+        self.stream_maxlen = PRICE_STREAM_MAXLEN
+        self.claim_idle_ms = PRICE_STREAM_CLAIM_IDLE_MS
+        self._best_price_script = self.redis.register_script(BEST_PRICE_SCRIPT)
+        self._best_price_ascript = register_async_script(BEST_PRICE_SCRIPT)
     
     def save_prices_to_redis(self, exchange: str, prices: List[Dict]) -> int:
         """将价格数据保存到Redis，同时计算最优价格"""
         try:
-            saved_count = 0
-            current_time = time.time()
-            
-            # 获取交易所优先级
-            exchange_priority = self._get_exchange_priority(exchange)
+            # 与已有最优价格的比较在 BEST_PRICE_SCRIPT 中完成，全部批次在一次往返内执行
+            pipe = self.redis.pipeline(transaction=False)
+            for keys, args in self._best_price_batches(exchange, prices):
+                self._best_price_script(keys=keys, args=args, client=pipe)
             
-            pipe = self.redis.pipeline()
-            
-            # 按基础资产分组处理价格
-            asset_prices = {}
-            for price_data in prices:
-                base_asset = price_data.get('base_asset', '').upper()
-                if not base_asset:
-                    continue
-                
-                if base_asset not in asset_prices:
-                    asset_prices[base_asset] = []
-                
-                # 添加优先级信息
-                price_data['exchange_priority'] = exchange_priority
-                price_data['quote_priority'] = self._get_quote_priority(price_data.get('quote_asset', ''))
-                asset_prices[base_asset].append(price_data)
-            
-            # 为每个资产选择最优价格
-            for base_asset, price_list in asset_prices.items():
-                best_price = self._select_best_price(base_asset, price_list)
-                if best_price:
-                    # 保存到队列等待持久化
-                    pipe.lpush(self.queue_key, json.dumps(best_price))
-                    
-                    # 更新最优价格缓存
-                    best_key = f"{self.best_price_prefix}{base_asset}"
-                    pipe.setex(best_key, 3600, json.dumps(best_price))
-                    
-                    saved_count += 1
+            results = pipe.execute()
+            saved_count = sum(saved for saved, _ in results)
+            queued_count = sum(queued for _, queued in results)
+            logger.info(f"保存 {saved_count} 个最优价格到Redis，其中 {queued_count} 个有变化入队")
+            return saved_count
             
-            pipe.execute()
-            logger.info(f"保存 {saved_count} 个最优价格到Redis")
+        except Exception as e:
+            logger.error(f"保存价格到Redis失败: {e}")
+            return 0
+    
+    async def asave_prices_to_redis(self, exchange: str, prices: List[Dict]) -> int:
+        """
+        save_prices_to_redis 的异步版本，供采集调度器的事件循环使用。
+
+        每个批次单独等待，批次之间让出事件循环，多个交易所的写入交错进行，不会阻塞其他交易所的采集。
+        """
+        try:
+            redis = local_async_redis()
+            saved_count = queued_count = 0
+            for keys, args in self._best_price_batches(exchange, prices):
+                saved, queued = await self._best_price_ascript(keys=keys, args=args, client=redis)
+                saved_count += saved
+                queued_count += queued
+            logger.info(f"保存 {saved_count} 个最优价格到Redis，其中 {queued_count} 个有变化入队")
             return saved_count
             
         except Exception as e:
             logger.error(f"保存价格到Redis失败: {e}")
             return 0
     
+    def _best_price_batches(self, exchange: str, prices: List[Dict]) -> Iterator[Tuple[List[str], List]]:
+        """按资产选出本交易所的候选，逐批生成 BEST_PRICE_SCRIPT 的 keys 和 args"""
+        current_time = time.time()
+        
+        # 获取交易所优先级
+        exchange_priority = self._get_exchange_priority(exchange)
+        
+        # 按基础资产分组，先在本交易所的价格中选出每个资产的候选
+        candidates: Dict[str, Dict] = {}
+        for price_data in prices:
+            base_asset = price_data.get('base_asset', '').upper()
+            if not base_asset:
+                continue
+            
+            # 添加优先级信息
+            price_data['exchange_priority'] = exchange_priority
+            price_data['quote_priority'] = self._get_quote_priority(price_data.get('quote_asset', ''))
+            best = candidates.get(base_asset)
+            if best is None or _priority(price_data) < _priority(best):
+                candidates[base_asset] = price_data
+        
+        assets = list(candidates)
+        timestamp = repr(current_time)
+        for start in range(0, len(assets), self.best_price_batch_size):
+            keys = [self.stream_key, self.last_queued_key]
+            args = [self.best_price_ttl, timestamp, self.price_epsilon, self.volume_epsilon,
+                    self.heartbeat_seconds, self.stream_maxlen]
+            for base_asset in assets[start:start + self.best_price_batch_size]:
+                entry = self._best_price_entry(base_asset, candidates[base_asset], current_time)
+                keys.append(f"{self.best_price_prefix}{base_asset}")
+                args.extend((base_asset, entry['exchange_priority'], entry['quote_priority'], json.dumps(entry)))
+            yield keys, args
+    
     def _get_exchange_priority(self, exchange: str) -> int:
         """获取交易所优先级（数字越小优先级越高）"""
         try:
@@ -82,74 +197,77 @@ class PriceRedisService:
         except ValueError:
             return 999  # 不在列表中的稳定币给最低优先级
     
-    def _select_best_price(self, base_asset: str, price_list: List[Dict]) -> Optional[Dict]:
-        """为资产选择最优价格"""
-        if not price_list:
-            return None
-        
-        # 检查Redis中是否已有该资产的价格
-        current_best = self._get_current_best_price(base_asset)
-        
-        # 将新价格加入候选列表
-        candidates = price_list.copy()
-        if current_best:
-            candidates.append(current_best)
-        
-        # 按优先级排序：先按交易所优先级，再按稳定币优先级
-        candidates.sort(key=lambda x: (x.get('exchange_priority', 999), x.get('quote_priority', 999)))
-        
-        best_candidate = candidates[0]
-        
-        # 准备最优价格数据
-        current_time = time.time()
+    def _best_price_entry(self, base_asset: str, candidate: Dict, current_time: float) -> Dict:
+        """最优价格缓存和队列中的数据格式"""
         return {
             'base_asset': base_asset,
-            'symbol': best_candidate.get('symbol', ''),
-            'quote_asset': best_candidate.get('quote_asset', ''),
-            'exchange': best_candidate.get('exchange', ''),
-            'price': str(best_candidate.get('price', '0')),
-            'volume_24h': str(best_candidate.get('volume_24h', '0')),
-            'price_change_24h': str(best_candidate.get('price_change_24h', '0')),
-            'exchange_priority': best_candidate.get('exchange_priority', 999),
-            'quote_priority': best_candidate.get('quote_priority', 999),
+            'symbol': candidate.get('symbol', ''),
+            'quote_asset': candidate.get('quote_asset', ''),
+            'exchange': candidate.get('exchange', ''),
+            'price': str(candidate.get('price', '0')),
+            'volume_24h': str(candidate.get('volume_24h', '0')),
+            'price_change_24h': str(candidate.get('price_change_24h', '0')),
+            'exchange_priority': candidate.get('exchange_priority', 999),
+            'quote_priority': candidate.get('quote_priority', 999),
             'timestamp': current_time
         }
     
-    def _get_current_best_price(self, base_asset: str) -> Optional[Dict]:
-        """获取当前最优价格"""
+    def ensure_stream_group(self):
+        """创建持久化消费组，已存在时忽略。新建的消费组从流的开头读取"""
         try:
-            key = f"{self.best_price_prefix}{base_asset}"
-            data = self.redis.get(key)
-            if data:
-                return json.loads(data)
-        except Exception:
-            pass
-        return None
+            self.redis.xgroup_create(self.stream_key, self.stream_group, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
     
-    def get_prices_from_queue(self, batch_size: int = 100) -> List[Dict]:
-        """从队列中批量获取价格数据"""
+    def read_price_batch(self, consumer: str, count: int = 100,
+                         block_ms: Optional[int] = None) -> List[Tuple[str, Optional[Dict]]]:
+        """
+        以消费者 consumer 的身份从价格流批量读取价格，返回 [(消息 id, 价格数据)]，无法解析的消息价格数据为 None。
+
+        先认领闲置超过 claim_idle_ms 仍未确认的消息（消费者崩溃或写库失败），没有时再读取新消息。
+        处理完成后需调用 ack_prices 确认，未确认的消息会被重新投递，即至少一次投递。
+        """
         try:
-            prices = []
-            
-            for _ in range(batch_size):
-                data = self.redis.rpop(self.queue_key)
-                if not data:
-                    break
-                
-                try:
-                    price_data = json.loads(data)
-                    prices.append(price_data)
-                except json.JSONDecodeError:
-                    continue
-            
-            if prices:
-                logger.debug(f"从队列获取 {len(prices)} 个价格数据")
-            
-            return prices
-            
-        except Exception as e:
-            logger.error(f"从队列获取价格失败: {e}")
-            return []
+            _, entries, *_ = self.redis.xautoclaim(
+                self.stream_key, self.stream_group, consumer, self.claim_idle_ms, start_id='0-0', count=count,
+            )
+            if not entries:
+                response = self.redis.xreadgroup(
+                    self.stream_group, consumer, {self.stream_key: '>'}, count=count, block=block_ms,
+                )
+                entries = response[0][1] if response else []
+        except ResponseError as e:
+            if 'NOGROUP' not in str(e):
+                logger.error(f"从价格流读取失败: {e}")
+                return []
+            self.ensure_stream_group()
+            return self.read_price_batch(consumer, count, block_ms)
+        
+        batch = []
+        for message_id, fields in entries:
+            if isinstance(message_id, bytes):
+                message_id = message_id.decode()
+            try:
+                price_data = json.loads(fields.get(b'data') or fields.get('data'))
+            except (TypeError, json.JSONDecodeError):
+                price_data = None
+            batch.append((message_id, price_data))
+        
+        if batch:
+            logger.debug(f"从价格流获取 {len(batch)} 个价格数据")
+        return batch
+    
+    def ack_prices(self, message_ids: Iterable[str]) -> int:
+        """确认已持久化的消息并从价格流删除"""
+        message_ids = list(message_ids)
+        if not message_ids:
+            return 0
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.xack(self.stream_key, self.stream_group, *message_ids)
+        pipe.xdel(self.stream_key, *message_ids)
+        acked, _ = pipe.execute()
+        return acked
     
     def get_best_price(self, base_asset: str) -> Optional[Dict]:
         """获取资产的最优价格"""
@@ -166,9 +284,9 @@ class PriceRedisService:
             return None
     
     def get_queue_size(self) -> int:
-        """获取队列大小"""
+        """获取价格流中未确认的消息数（已确认的消息会被删除）"""
         try:
-            return self.redis.llen(self.queue_key)
+            return self.redis.xlen(self.stream_key)
         except Exception as e:
             logger.error(f"获取队列大小失败: {e}")
             return 0
@@ -214,6 +332,7 @@ class PriceRedisService:
         try:
             return {
                 'queue_size': self.get_queue_size(),
+                'last_queued_assets': self.redis.hlen(self.last_queued_key),
                 'best_price_cache_keys': len(self.redis.keys(f"{self.best_price_prefix}*")),
                 'redis_memory_usage': self.redis.info().get('used_memory_human', 'unknown')
             }
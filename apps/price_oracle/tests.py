@@ -1 +1,252 @@
-# Create your tests here.
+import asyncio
+import json
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from apps.price_oracle.adapters import AdapterPool, ExchangeAdapter, PriceData, get_exchange_prices, normalize_tickers
+from apps.price_oracle.constants import EXCHANGE_PRIORITY
+from apps.price_oracle.redis_service import PriceRedisService
+from apps.price_oracle.scheduler import IndependentScheduler
+from common.redis_client import close_async_redis
+
+
+class FakeAdapter(ExchangeAdapter):
+    def __init__(self, exchange_id):
+        super().__init__(exchange_id)
+        self.reloads = 0
+        self.closed = False
+        self.fail = False
+
+    async def get_prices(self):
+        if self.fail:
+            raise RuntimeError('boom')
+        return []
+
+    async def reload_markets(self):
+        self.reloads += 1
+
+    async def close(self):
+        self.closed = True
+
+
+@mock.patch('apps.price_oracle.adapters.AdapterFactory.get_adapter', side_effect=FakeAdapter)
+class AdapterPoolTests(SimpleTestCase):
+    async def test_adapter_is_reused_and_closed(self, get_adapter):
+        pool = AdapterPool()
+        adapter = await pool.get('Binance')
+        self.assertIs(await pool.get('binance'), adapter)
+        self.assertEqual(get_adapter.call_count, 1)
+        self.assertEqual(adapter.reloads, 0)
+
+        await pool.close()
+        self.assertTrue(adapter.closed)
+
+    async def test_markets_reload_cadence(self, get_adapter):
+        pool = AdapterPool(markets_reload_interval=0)
+        adapter = await pool.get('okx')
+        await pool.get('okx')
+        await pool.get('okx')
+        self.assertEqual(adapter.reloads, 2)
+        await pool.close()
+
+    async def test_unhealthy_adapter_is_rebuilt(self, get_adapter):
+        pool = AdapterPool(max_failures=2)
+        adapter = await pool.get('okx')
+        adapter.fail = True
+        for _ in range(2):
+            self.assertEqual(await get_exchange_prices('okx', pool=pool), [])
+        self.assertFalse(adapter.closed)
+
+        rebuilt = await pool.get('okx')
+        self.assertIsNot(rebuilt, adapter)
+        self.assertTrue(adapter.closed)
+        await pool.close()
+
+    async def test_success_resets_failure_count(self, get_adapter):
+        pool = AdapterPool(max_failures=2)
+        adapter = await pool.get('okx')
+        # 失败之间有一次成功，不算连续失败
+        for fail in (True, False, True):
+            adapter.fail = fail
+            await get_exchange_prices('okx', pool=pool)
+        self.assertIs(await pool.get('okx'), adapter)
+        self.assertEqual(adapter.consecutive_failures, 1)
+        await pool.close()
+
+
+class NormalizeTickersTests(SimpleTestCase):
+    def test_stablecoin_pairs_are_kept_as_floats(self):
+        def ticker(symbol, last, **extra):
+            return dict({'symbol': symbol, 'last': last, 'quoteVolume': 1000.0, 'percentage': -1.5}, **extra)
+
+        prices, stablecoin_pairs = normalize_tickers({
+            'BTC/USDT': ticker('BTC/USDT', 100.5),
+            'ETH/USDC': ticker('ETH/USDC', '10.25', quoteVolume=None, percentage='bad'),
+            'ETH/BTC': ticker('ETH/BTC', 0.05),
+            'BTC/USDT:USDT': ticker('BTC/USDT:USDT', 100.4),
+            'SOL/USDT': ticker('SOL/USDT', None),
+            'DOGE/USDT': ticker('DOGE/USDT', -1),
+            'NAN/USDT': ticker('NAN/USDT', float('nan')),
+            'EMPTY/USDT': {},
+            'NOSLASH': ticker('NOSLASH', 1.0),
+        })
+        self.assertEqual(prices, [
+            PriceData('BTC/USDT', 'BTC', 'USDT', 100.5, 1000.0, -1.5),
+            PriceData('ETH/USDC', 'ETH', 'USDC', 10.25, None, None),
+        ])
+        self.assertEqual(stablecoin_pairs, 4)
+
+
+def _price(base, quote, price, exchange):
+    return {'symbol': f'{base}/{quote}', 'base_asset': base, 'quote_asset': quote, 'exchange': exchange,
+            'price': price, 'volume_24h': 0, 'price_change_24h': 0}
+
+
+class PriceRedisTestCase(SimpleTestCase):
+    def setUp(self):
+        self.service = PriceRedisService()
+        self.service.best_price_prefix = 'test:price_oracle:best_price:'
+        self.service.stream_key = 'test:price_oracle:price_stream'
+        self.service.last_queued_key = 'test:price_oracle:last_queued'
+        self.addCleanup(self._cleanup)
+
+    def _cleanup(self):
+        redis = self.service.redis
+        redis.delete(self.service.stream_key, self.service.last_queued_key,
+                     *redis.keys(f'{self.service.best_price_prefix}*'))
+
+    def _queued(self):
+        return [json.loads(fields[b'data']) for _, fields in self.service.redis.xrange(self.service.stream_key)]
+
+
+class BestPriceSelectionTests(PriceRedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service.best_price_batch_size = 2
+
+    def test_priority_is_compared_server_side(self):
+        self.assertEqual(self.service.save_prices_to_redis('okx', [
+            _price('BTC', 'USDC', 100.5, 'okx'),
+            _price('BTC', 'USDT', 100, 'okx'),
+            _price('ETH', 'USDT', 10, 'okx'),
+        ]), 2)
+        self.assertEqual(self.service.get_best_price('btc')['quote_asset'], 'USDT')
+
+        # 优先级更高的交易所覆盖已有价格
+        self.service.save_prices_to_redis('binance', [_price('ETH', 'USDC', 11, 'binance')])
+        self.assertEqual(self.service.get_best_price('ETH')['exchange'], 'binance')
+
+        # 优先级更低的交易所保留已有价格，只更新时间戳
+        before = self.service.get_best_price('ETH')
+        self.assertEqual(self.service.save_prices_to_redis('kraken', [
+            _price('ETH', 'USDT', 12, 'kraken'),
+            _price('SOL', 'USDT', 1, 'kraken'),
+            _price('DOGE', 'USDT', 0.1, 'kraken'),
+        ]), 3)
+        after = self.service.get_best_price('ETH')
+        self.assertEqual((after['exchange'], after['price']), ('binance', '11'))
+        self.assertGreater(after['timestamp'], before['timestamp'])
+        self.assertEqual(self.service.get_best_price('DOGE')['exchange'], 'kraken')
+
+        # 保留的 ETH 价格没有变化，不重新入队
+        queued = self._queued()
+        self.assertEqual([(price['base_asset'], price['exchange']) for price in queued], [
+            ('BTC', 'okx'), ('ETH', 'okx'), ('ETH', 'binance'), ('SOL', 'kraken'), ('DOGE', 'kraken'),
+        ])
+
+    def test_only_changes_are_queued(self):
+        save = self.service.save_prices_to_redis
+        save('okx', [_price('BTC', 'USDT', 100, 'okx'), _price('ETH', 'USDT', 10, 'okx')])
+        self.assertEqual(len(self._queued()), 2)
+
+        # 变化小于阈值不入队，超过阈值才入队
+        self.service.price_epsilon = 0.01
+        save('okx', [_price('BTC', 'USDT', 100.5, 'okx'), _price('ETH', 'USDT', 10.2, 'okx')])
+        self.assertEqual([price['price'] for price in self._queued()[2:]], ['10.2'])
+        # 阈值与最近一次入队的价格比较，缓慢的漂移累积后也会入队
+        save('okx', [_price('BTC', 'USDT', 101.1, 'okx')])
+        self.assertEqual([price['price'] for price in self._queued()[3:]], ['101.1'])
+        self.assertEqual(self.service.get_best_price('BTC')['price'], '101.1')
+
+        # 成交量变化或超过心跳间隔时也会入队
+        volume = dict(_price('BTC', 'USDT', 101.1, 'okx'), volume_24h=1000)
+        save('okx', [volume, _price('ETH', 'USDT', 10.2, 'okx')])
+        self.assertEqual([price['base_asset'] for price in self._queued()[4:]], ['BTC'])
+        self.service.heartbeat_seconds = 0
+        save('okx', [_price('ETH', 'USDT', 10.2, 'okx')])
+        self.assertEqual([price['base_asset'] for price in self._queued()[5:]], ['ETH'])
+
+    def test_consumer_group_redelivers_unacked(self):
+        self.service.save_prices_to_redis('okx', [_price(f'A{i}', 'USDT', i + 1, 'okx') for i in range(5)])
+        self.service.ensure_stream_group()
+        self.service.ensure_stream_group()
+
+        first = self.service.read_price_batch('persister-1', count=3)
+        second = self.service.read_price_batch('persister-2', count=3)
+        self.assertEqual([price['base_asset'] for _, price in first + second], [f'A{i}' for i in range(5)])
+        self.assertEqual(self.service.ack_prices(message_id for message_id, _ in second), 2)
+        self.assertEqual(self.service.get_queue_size(), 3)
+
+        # persister-1 未确认就退出，闲置超时后其他消费者认领重新处理
+        self.assertEqual(self.service.read_price_batch('persister-2', count=10), [])
+        self.service.claim_idle_ms = 0
+        reclaimed = self.service.read_price_batch('persister-2', count=10)
+        self.assertEqual(reclaimed, first)
+        self.service.ack_prices(message_id for message_id, _ in reclaimed)
+        self.assertEqual(self.service.get_queue_size(), 0)
+
+    async def test_async_write(self):
+        try:
+            self.assertEqual(await self.service.asave_prices_to_redis('okx', [
+                _price('BTC', 'USDC', 100.5, 'okx'),
+                _price('BTC', 'USDT', 100, 'okx'),
+                _price('ETH', 'USDT', 10, 'okx'),
+            ]), 2)
+            self.assertEqual(await self.service.asave_prices_to_redis('kraken', [_price('BTC', 'USDT', 99, 'kraken')]), 1)
+        finally:
+            await close_async_redis()
+        self.assertEqual(self.service.get_best_price('BTC')['price'], '100')
+        self.assertEqual(len(self._queued()), 2)
+
+
+class SchedulerJitterTests(PriceRedisTestCase):
+    EXCHANGES = EXCHANGE_PRIORITY[:20]
+    ASSETS = 300
+    INTERVAL = 0.5
+    TICK = 0.01
+
+    async def _max_tick_lag(self, save_prices) -> float:
+        """20 个交易所按调度器同时写入价格时，事件循环上 10ms 心跳的最大延迟"""
+        prices = {exchange: [_price(f'A{i}', 'USDT', i, exchange) for i in range(self.ASSETS)]
+                  for exchange in self.EXCHANGES}
+        executions = dict.fromkeys(self.EXCHANGES, 0)
+
+        async def collect(exchange):
+            executions[exchange] += 1
+            return await save_prices(exchange, prices[exchange])
+
+        scheduler = IndependentScheduler(list(self.EXCHANGES), collect)
+        for task in scheduler.tasks.values():
+            task.min_interval = task.current_interval = self.INTERVAL
+        runner = asyncio.create_task(scheduler.start())
+        lags = []
+        try:
+            deadline = time.monotonic() + 2
+            while time.monotonic() < deadline:
+                start = time.monotonic()
+                await asyncio.sleep(self.TICK)
+                lags.append(time.monotonic() - start - self.TICK)
+        finally:
+            scheduler.stop()
+            runner.cancel()
+            await runner
+            await close_async_redis()
+        self.assertTrue(all(executions.values()), executions)
+        return max(lags)
+
+    async def test_async_writes_keep_scheduler_ticks_bounded(self):
+        self.service.best_price_batch_size = 100
+        self.assertLess(await self._max_tick_lag(self.service.asave_prices_to_redis), 0.2)
+
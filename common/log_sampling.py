@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+热路径日志预算。
+
+高频写入路径（爬虫抓取、缓存写入）不再逐次输出带载荷的日志，而是：
+- 按事件累计次数和耗时，每隔 flush_interval 秒输出一行汇总；
+- 需要看具体键时，用 sample(key) 限制每个键在一个周期内最多输出一次。
+"""
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from django.conf import settings
+
+HOT_PATH_LOG_FLUSH_SECONDS = getattr(settings, 'HOT_PATH_LOG_FLUSH_SECONDS', 60)
+
+
+class _EventStats:
+    __slots__ = ('count', 'latency_total', 'latency_max')
+
+    def __init__(self):
+        self.count = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+
+class HotPathLog:
+    """按事件聚合的计数器和按键采样，线程安全"""
+
+    def __init__(self, logger: logging.Logger, flush_interval: float = HOT_PATH_LOG_FLUSH_SECONDS):
+        self.logger = logger
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._events: Dict[str, _EventStats] = {}
+        self._sampled: Dict[str, float] = {}
+        self._window_start = time.monotonic()
+
+    def record(self, event: str, latency: Optional[float] = None) -> None:
+        """累计一次事件，latency 单位为秒"""
+        now = time.monotonic()
+        with self._lock:
+            stats = self._events.get(event)
+            if stats is None:
+                stats = self._events[event] = _EventStats()
+            stats.count += 1
+            if latency is not None:
+                stats.latency_total += latency
+                if latency > stats.latency_max:
+                    stats.latency_max = latency
+            if now - self._window_start < self.flush_interval:
+                return
+            events, self._events = self._events, {}
+            elapsed, self._window_start = now - self._window_start, now
+            self._sampled.clear()
+        self._emit(events, elapsed)
+
+    def sample(self, key: str) -> bool:
+        """同一个 key 在一个汇总周期内只返回一次 True，用于限制逐键的详细日志"""
+        now = time.monotonic()
+        with self._lock:
+            last = self._sampled.get(key)
+            if last is not None and now - last < self.flush_interval:
+                return False
+            self._sampled[key] = now
+            return True
+
+    def flush(self) -> None:
+        """立即输出当前周期的汇总"""
+        now = time.monotonic()
+        with self._lock:
+            events, self._events = self._events, {}
+            elapsed, self._window_start = now - self._window_start, now
+            self._sampled.clear()
+        self._emit(events, elapsed)
+
+    def _emit(self, events: Dict[str, _EventStats], elapsed: float) -> None:
+        if not events or not self.logger.isEnabledFor(logging.INFO):
+            return
+        parts = []
+        for event, stats in sorted(events.items()):
+            part = f"{event}={stats.count}"
+            if stats.latency_total:
+                part += f" (avg {stats.latency_total / stats.count * 1000:.1f}ms, max {stats.latency_max * 1000:.1f}ms)"
+            parts.append(part)
+        self.logger.info(f"hot path stats over {elapsed:.0f}s: " + ", ".join(parts))
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import asyncio
 import json
 import time
+import weakref
 from typing import Optional, Dict, Any, List, Tuple, Union
 
 import redis.asyncio as aioredis
@@ -9,6 +11,7 @@ from django.conf import settings
 from django.core.cache import cache as django_redis
 from redis import ConnectionPool, StrictRedis
 from redis.asyncio import Redis as AsyncRedis
+from redis.commands.core import AsyncScript
 
 from common.helpers import getLogger
 from . import constants
@@ -35,6 +38,40 @@ def local_redis():
     return rsd_client
 
 
+# redis.asyncio 的连接绑定在创建它的事件循环上，连接池按事件循环各建一个
+ASYNC_REDIS_MAX_CONNECTIONS = getattr(settings, 'ASYNC_REDIS_MAX_CONNECTIONS', 50)
+ASYNC_REDIS_POOL_TIMEOUT = 10
+_ASYNC_POOLS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aioredis.BlockingConnectionPool]" = \
+    weakref.WeakKeyDictionary()
+
+
+def local_async_redis() -> AsyncRedis:
+    """
+    local_redis 的 redis.asyncio 版本，只能在事件循环中调用。
+
+    同一事件循环内共享一个 BlockingConnectionPool，并发请求超过连接数时排队等待空闲连接。
+    """
+    loop = asyncio.get_running_loop()
+    pool = _ASYNC_POOLS.get(loop)
+    if pool is None:
+        pool = _ASYNC_POOLS[loop] = aioredis.BlockingConnectionPool(
+            max_connections=ASYNC_REDIS_MAX_CONNECTIONS, timeout=ASYNC_REDIS_POOL_TIMEOUT, **settings.TRADING_REDIS
+        )
+    return AsyncRedis(connection_pool=pool)
+
+
+async def close_async_redis() -> None:
+    """断开当前事件循环的连接池，事件循环结束前调用"""
+    pool = _ASYNC_POOLS.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.disconnect()
+
+
+def register_async_script(script: str) -> AsyncScript:
+    """注册 redis.asyncio 的 Lua 脚本，调用时用 client= 传入 local_async_redis() 或它的 pipeline"""
+    return AsyncRedis(**settings.TRADING_REDIS).register_script(script)
+
+
 LOCAL_EXPIRE = 60
 
 
@@ -98,6 +135,28 @@ class GlobalRedisWrapper:
             GlobalRedisWrapper.__fix_args(ins, kwargs)
             return ins.set(*args, **kwargs)
 
+    @staticmethod
+    def set_many(mapping, **kwargs):
+        try:
+            ins = GlobalRedisWrapper.__instance()
+            return GlobalRedisWrapper.__set_many(ins, mapping, kwargs)
+
+        except Exception as e:
+            logger.warning('redis instance failed', exc_info=True)
+            ins = GlobalRedisWrapper.__fallback(e)
+            return GlobalRedisWrapper.__set_many(ins, mapping, kwargs)
+
+    @staticmethod
+    def __set_many(ins, mapping, kwargs):
+        GlobalRedisWrapper.__fix_args(ins, kwargs)
+        if ins is GlobalRedisWrapper.instance_global:
+            return ins.set_many(mapping, **kwargs)
+        # redis 没有带过期时间的 MSET，用 pipeline 一次发送
+        pipe = ins.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(key, value, **kwargs)
+        return pipe.execute()
+
     @staticmethod
     def delete(*args, **kwargs):
         try: